@@ -1,12 +1,20 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.http import StreamingHttpResponse
 from giftexchange.models import (
     GiftExchange,
     Participant,
     AppUser,
     ExchangeAssignment,
     AppInvitation,
-    MagicLink
+    MagicLink,
+    ExclusionPair,
+    ExclusionGroup,
+    OutboundEmail,
+    EmailSendRun,
+    EmailDeliveryStatus,
+    SuppressedEmail,
 )
+from giftexchange.snapshots import SnapshotError, clone_giftexchange, snapshot_chunks
 
 
 class ParticipantInline(admin.TabularInline):
@@ -18,6 +26,66 @@ class GiftExchangeAdmin(admin.ModelAdmin):
 		ParticipantInline,
 	]
 	list_display = ['title', 'date']
+	filter_horizontal = ['exclude_repeats_from']
+	actions = ['download_snapshot', 'clone_for_next_season']
+
+	def download_snapshot(self, request, queryset):
+		if queryset.count() != 1:
+			self.message_user(request, 'Select exactly one gift exchange to download a snapshot of.', messages.ERROR)
+			return None
+		giftexchange = queryset.get()
+		response = StreamingHttpResponse(snapshot_chunks(giftexchange), content_type='application/gzip')
+		response['Content-Disposition'] = 'attachment; filename="giftexchange-{}.jsonl.gz"'.format(giftexchange.pk)
+		return response
+	download_snapshot.short_description = 'Download a snapshot of the selected gift exchange'
+
+	def clone_for_next_season(self, request, queryset):
+		for giftexchange in queryset:
+			title = '{} (copy)'.format(giftexchange.title)
+			copy_number = 1
+			while GiftExchange.objects.filter(title=title).exists():
+				copy_number += 1
+				title = '{} (copy {})'.format(giftexchange.title, copy_number)
+			try:
+				restorer = clone_giftexchange(giftexchange, title, exclude_repeats=True)
+			except SnapshotError as error:
+				self.message_user(request, 'Could not clone "{}": {}'.format(giftexchange.title, error), messages.ERROR)
+				continue
+			self.message_user(request, 'Cloned "{}" into "{}" with {} participants.'.format(
+				giftexchange.title, title, restorer.counts['participants']
+			))
+	clone_for_next_season.short_description = 'Clone participants into a new gift exchange, excluding repeat assignments'
+
+
+class ExclusionPairAdmin(admin.ModelAdmin):
+	list_display = ['giftexchange', 'giver', 'reciever', 'both_ways']
+	list_filter = ['giftexchange']
+	raw_id_fields = ['giver', 'reciever']
+
+
+class ExclusionGroupAdmin(admin.ModelAdmin):
+	list_display = ['giftexchange', 'name']
+	list_filter = ['giftexchange']
+	raw_id_fields = ['members']
+
+
+class OutboundEmailAdmin(admin.ModelAdmin):
+	list_display = ['to_email', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+	list_filter = ['status']
+	search_fields = ['to_email', 'job_id']
+	raw_id_fields = ['assignment']
+
+
+class EmailDeliveryStatusAdmin(admin.ModelAdmin):
+	list_display = ['email', 'status', 'reason', 'event_at']
+	list_filter = ['status']
+	search_fields = ['email']
+
+
+class SuppressedEmailAdmin(admin.ModelAdmin):
+	list_display = ['email', 'reason', 'created_at']
+	list_filter = ['reason']
+	search_fields = ['email']
 
 admin.site.register(AppUser)
 admin.site.register(GiftExchange, GiftExchangeAdmin)
@@ -25,3 +93,9 @@ admin.site.register(Participant)
 admin.site.register(ExchangeAssignment)
 admin.site.register(AppInvitation)
 admin.site.register(MagicLink)
+admin.site.register(ExclusionPair, ExclusionPairAdmin)
+admin.site.register(ExclusionGroup, ExclusionGroupAdmin)
+admin.site.register(OutboundEmail, OutboundEmailAdmin)
+admin.site.register(EmailSendRun)
+admin.site.register(EmailDeliveryStatus, EmailDeliveryStatusAdmin)
+admin.site.register(SuppressedEmail, SuppressedEmailAdmin)
@@ -0,0 +1,280 @@
+import random
+from array import array
+from collections import namedtuple
+
+
+DEFAULT_MAX_BACKTRACKS = 20000
+DEFAULT_RESTARTS = 5
+
+
+AssignmentViolation = namedtuple('AssignmentViolation', ['code', 'giver_id', 'reciever_id', 'message'])
+
+
+class AssignmentError(Exception):
+	""" Raised when assignments can not be generated or changed for a reason
+		to report to the exchange's admins, rather than a programming error
+
+		`problems` holds a human readable reason for each issue found
+	"""
+	def __init__(self, problems):
+		self.problems = problems
+		super(AssignmentError, self).__init__('; '.join(problems))
+
+
+class AssignmentInfeasible(AssignmentError):
+	""" Raised when no single gift loop satisfies the exclusion rules
+	"""
+
+
+def build_assignment_cycle(participant_ids, rng=None):
+	""" Builds a single closed gift loop from a list of participant ids
+
+		The ids are shuffled once and each participant gives to the next one in
+		the shuffled order, with the last participant giving to the first. This
+		is linear in the number of participants and can not produce sub-loops,
+		so the result never needs to be verified and retried.
+
+		Returns a list of (giver_id, reciever_id) tuples in loop order
+	"""
+	if len(participant_ids) < 2:
+		raise AssignmentError(['At least two active participants are required to generate assignments'])
+	rng = rng or random
+	order = list(participant_ids)
+	rng.shuffle(order)
+	recievers = order[1:] + order[:1]
+	return list(zip(order, recievers))
+
+
+NO_EXCLUSIONS = frozenset()
+
+
+def build_exclusion_table(participant_ids, excluded_pairs=(), excluded_groups=()):
+	""" Converts exclusion rules into a sparse adjacency table
+
+		exclusions[i] holds the indexes (into participant_ids) that
+		participant_ids[i] may not give to. Pairs are (giver_id, reciever_id)
+		and only block that direction, groups block every pair of members in
+		both directions. Ids that are not in participant_ids are ignored.
+
+		Unconstrained participants share one empty frozenset, so memory only
+		grows with the number of rules rather than with participants squared.
+	"""
+	index = {participant_id: i for i, participant_id in enumerate(participant_ids)}
+	exclusions = [NO_EXCLUSIONS] * len(participant_ids)
+
+	def block(i, blocked):
+		if exclusions[i] is NO_EXCLUSIONS:
+			exclusions[i] = set()
+		exclusions[i].update(blocked)
+
+	for giver_id, reciever_id in excluded_pairs:
+		if giver_id in index and reciever_id in index:
+			block(index[giver_id], (index[reciever_id], ))
+	for group in excluded_groups:
+		members = [index[member_id] for member_id in group if member_id in index]
+		for i in members:
+			block(i, members)
+	return exclusions
+
+
+def diagnose_exclusions(participant_ids, exclusions, excluded_groups=(), describe=str):
+	""" Cheap checks that prove a set of exclusion rules can never be satisfied
+		Returns a list of problems, empty if none were found
+	"""
+	participant_count = len(participant_ids)
+	if participant_count < 2:
+		return ['At least two active participants are required to generate assignments']
+	problems = []
+	recieve_options = [participant_count - 1] * participant_count
+	for i, blocked in enumerate(exclusions):
+		blocked_count = 0
+		for j in blocked:
+			if j != i:
+				blocked_count += 1
+				recieve_options[j] -= 1
+		if blocked_count >= participant_count - 1:
+			problems.append('{} is excluded from giving to everyone'.format(describe(participant_ids[i])))
+	for j, option_count in enumerate(recieve_options):
+		if option_count <= 0:
+			problems.append('{} is excluded from receiving from everyone'.format(describe(participant_ids[j])))
+	active_ids = set(participant_ids)
+	for group in excluded_groups:
+		group_size = len(active_ids.intersection(group))
+		if group_size * 2 > participant_count:
+			problems.append(
+				'A group of {} participants can not all give outside the group with only {} other participants'.format(
+					group_size, participant_count - group_size
+				)
+			)
+	return problems
+
+
+def _search_cycle(exclusions, rng, max_backtracks):
+	""" Randomised depth first search for a loop through every participant
+
+		Unvisited participants are kept in a shuffled list with swap-removal, so
+		each step is O(1) when few exclusions apply, and every backtrack restores
+		the list exactly as it was for the frame being resumed.
+
+		Returns the loop as a list of indexes, None if the search proved there is
+		no loop, or False if it gave up after max_backtracks
+	"""
+	participant_count = len(exclusions)
+	remaining = list(range(participant_count))
+	rng.shuffle(remaining)
+	positions = [0] * participant_count
+	for k, i in enumerate(remaining):
+		positions[i] = k
+
+	def remove(i):
+		k = positions[i]
+		last = remaining.pop()
+		if last != i:
+			remaining[k] = last
+			positions[last] = k
+		return k
+
+	def restore(i, k):
+		if k == len(remaining):
+			remaining.append(i)
+		else:
+			displaced = remaining[k]
+			remaining.append(displaced)
+			positions[displaced] = len(remaining) - 1
+			remaining[k] = i
+		positions[i] = k
+
+	start = remaining[-1]
+	path = [start]
+	removed_at = [remove(start)]
+	next_candidate = [0]
+	backtracks = 0
+	while path:
+		current = path[-1]
+		blocked = exclusions[current]
+		if not remaining and start not in blocked:
+			return path
+		k = next_candidate[-1]
+		while k < len(remaining) and remaining[k] in blocked:
+			k += 1
+		if k < len(remaining):
+			chosen = remaining[k]
+			next_candidate[-1] = k + 1
+			removed_at.append(remove(chosen))
+			path.append(chosen)
+			next_candidate.append(0)
+			continue
+
+		backtracks += 1
+		if backtracks > max_backtracks:
+			return False
+		path.pop()
+		next_candidate.pop()
+		restore(current, removed_at.pop())
+	return None
+
+
+def build_constrained_assignment_cycle(participant_ids, excluded_pairs=(), excluded_groups=(), rng=None,
+		max_backtracks=DEFAULT_MAX_BACKTRACKS, restarts=DEFAULT_RESTARTS, describe=str):
+	""" Builds a single closed gift loop that respects exclusion rules
+
+		Falls back to build_assignment_cycle when there are no rules. Raises
+		AssignmentInfeasible when the rules can not be satisfied, or when no loop
+		was found within the backtracking budget.
+
+		Returns a list of (giver_id, reciever_id) tuples in loop order
+	"""
+	rng = rng or random
+	excluded_groups = list(excluded_groups)
+	exclusions = build_exclusion_table(participant_ids, excluded_pairs, excluded_groups)
+	if not any(exclusions):
+		return build_assignment_cycle(participant_ids, rng=rng)
+	problems = diagnose_exclusions(participant_ids, exclusions, excluded_groups=excluded_groups, describe=describe)
+	if problems:
+		raise AssignmentInfeasible(problems)
+
+	for attempt in range(restarts):
+		loop = _search_cycle(exclusions, rng, max_backtracks)
+		if loop is None:
+			raise AssignmentInfeasible(['No assignment loop satisfies the exclusion rules'])
+		if loop:
+			order = [participant_ids[i] for i in loop]
+			recievers = order[1:] + order[:1]
+			return list(zip(order, recievers))
+	raise AssignmentInfeasible([
+		'No assignment loop satisfying the exclusion rules was found after {} attempts, '
+		'try relaxing the rules'.format(restarts)
+	])
+
+
+def verify_assignments(assignments, participant_ids, excluded_pairs=(), excluded_groups=(), describe=str):
+	""" Validates a whole assignment set in linear time
+
+		Checks that every participant gives and receives exactly once, nobody
+		gives to themselves, no exclusion rule is broken and that the set forms a
+		single loop. Successors and receive counts are kept in arrays indexed by
+		participant position rather than searched in lists.
+
+		Returns a list of AssignmentViolation, empty if the set is valid
+	"""
+	participant_count = len(participant_ids)
+	index = {participant_id: i for i, participant_id in enumerate(participant_ids)}
+	exclusions = build_exclusion_table(participant_ids, excluded_pairs, excluded_groups)
+	successors = array('l', [-1]) * participant_count
+	recieve_counts = array('l', [0]) * participant_count
+	violations = []
+
+	def violation(code, giver_id, reciever_id, message):
+		violations.append(AssignmentViolation(code, giver_id, reciever_id, message))
+
+	for giver_id, reciever_id in assignments:
+		giver = index.get(giver_id)
+		reciever = index.get(reciever_id)
+		if giver is None:
+			violation('unknown_giver', giver_id, reciever_id, 'Participant {} gives a gift but is not an active participant'.format(
+				describe(giver_id)
+			))
+		if reciever is None:
+			violation('unknown_reciever', giver_id, reciever_id, 'Participant {} receives a gift but is not an active participant'.format(
+				describe(reciever_id)
+			))
+		if giver is None or reciever is None:
+			continue
+		if giver == reciever:
+			violation('self_assignment', giver_id, reciever_id, '{} gives to themselves'.format(describe(giver_id)))
+		elif reciever in exclusions[giver]:
+			violation('excluded_pair', giver_id, reciever_id, '{} gives to {} which an exclusion rule forbids'.format(
+				describe(giver_id), describe(reciever_id)
+			))
+		if successors[giver] != -1:
+			violation('gives_more_than_once', giver_id, reciever_id, '{} gives more than one gift'.format(describe(giver_id)))
+		else:
+			successors[giver] = reciever
+		recieve_counts[reciever] += 1
+		if recieve_counts[reciever] == 2:
+			violation('recieves_more_than_once', giver_id, reciever_id, '{} receives more than one gift'.format(
+				describe(reciever_id)
+			))
+
+	for i in range(participant_count):
+		if successors[i] == -1:
+			violation('does_not_give', participant_ids[i], None, '{} does not give a gift'.format(describe(participant_ids[i])))
+		if recieve_counts[i] == 0:
+			violation('does_not_recieve', None, participant_ids[i], '{} does not receive a gift'.format(
+				describe(participant_ids[i])
+			))
+
+	if not violations and participant_count:
+		visited = bytearray(participant_count)
+		loop_count = 0
+		for start in range(participant_count):
+			if visited[start]:
+				continue
+			loop_count += 1
+			current = start
+			while not visited[current]:
+				visited[current] = 1
+				current = successors[current]
+		if loop_count > 1:
+			violation('multiple_loops', None, None, 'Assignments form {} separate loops instead of one'.format(loop_count))
+	return violations
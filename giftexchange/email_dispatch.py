@@ -0,0 +1,186 @@
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from giftexchange.email_transports import get_email_transport
+
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_RATE_PER_SECOND = 10
+DEFAULT_CIRCUIT_FAILURES = 5
+DEFAULT_CIRCUIT_RESET_SECONDS = 60
+
+
+Email = namedtuple('Email', ['to_email', 'subject', 'html_body'])
+
+
+class CircuitOpen(Exception):
+	""" Raised instead of calling the provider while the circuit breaker is open
+	"""
+	pass
+
+
+class TokenBucket(object):
+	""" Thread safe token bucket that allows `rate` requests per second with
+		bursts of up to `capacity`. A rate of 0 or less, or None, is unlimited
+	"""
+	def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+		self.rate = float(rate or 0)
+		self.capacity = float(capacity or max(self.rate, 1))
+		self.tokens = self.capacity
+		self.clock = clock
+		self.sleep = sleep
+		self.updated_at = clock()
+		self.lock = threading.Lock()
+
+	def _refill(self):
+		now = self.clock()
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+		self.updated_at = now
+
+	def acquire(self):
+		""" Takes a token, waiting until one is available
+		"""
+		if self.rate <= 0:
+			return
+		while True:
+			with self.lock:
+				self._refill()
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return
+				wait = (1 - self.tokens) / self.rate
+			self.sleep(wait)
+
+
+class CircuitBreaker(object):
+	""" Stops calls to the provider for reset_seconds after failure_threshold
+		consecutive rate limit or server errors, then lets calls through again
+		to probe whether it has recovered
+	"""
+	def __init__(self, failure_threshold, reset_seconds, clock=time.monotonic):
+		self.failure_threshold = failure_threshold
+		self.reset_seconds = reset_seconds
+		self.clock = clock
+		self.failures = 0
+		self.open_until = None
+		self.lock = threading.Lock()
+
+	@property
+	def is_open(self):
+		return self.open_until is not None and self.clock() < self.open_until
+
+	def check(self):
+		if self.is_open:
+			raise CircuitOpen('Email provider circuit is open after {} consecutive failures'.format(self.failures))
+
+	def record_success(self):
+		with self.lock:
+			self.failures = 0
+			self.open_until = None
+
+	def record_failure(self):
+		with self.lock:
+			self.failures += 1
+			if self.failures >= self.failure_threshold:
+				self.open_until = self.clock() + self.reset_seconds
+
+
+def is_provider_overloaded(error):
+	""" True for errors that mean the provider wants us to back off: 429 and 5xx
+	"""
+	status_code = getattr(error, 'status_code', None)
+	return status_code is not None and (status_code == 429 or status_code >= 500)
+
+
+def is_request_rejected(error):
+	""" True for 4xx errors about the request's content, such as one malformed
+		address, which a smaller request without the offending email can avoid.
+		Authentication errors and rate limits are not, as splitting can not help
+	"""
+	status_code = getattr(error, 'status_code', None)
+	return status_code is not None and 400 <= status_code < 500 and status_code not in (401, 403, 429)
+
+
+class EmailDispatcher(object):
+	""" Sends through one shared transport from a bounded thread pool, under a
+		request rate limit and a circuit breaker
+	"""
+	def __init__(self, transport, max_workers=DEFAULT_MAX_WORKERS, rate_limiter=None, circuit_breaker=None):
+		self.transport = transport
+		self.max_workers = max_workers
+		self.rate_limiter = rate_limiter or TokenBucket(DEFAULT_RATE_PER_SECOND)
+		self.circuit_breaker = circuit_breaker or CircuitBreaker(DEFAULT_CIRCUIT_FAILURES, DEFAULT_CIRCUIT_RESET_SECONDS)
+		self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+	def send_batch(self, emails):
+		""" Sends one batch in a single provider request
+		"""
+		self.circuit_breaker.check()
+		self.rate_limiter.acquire()
+		self.circuit_breaker.check()
+		try:
+			response = self.transport.send_batch(emails)
+		except Exception as error:
+			if is_provider_overloaded(error):
+				self.circuit_breaker.record_failure()
+			raise
+		self.circuit_breaker.record_success()
+		return response
+
+	def send(self, subject, html_body, to_email):
+		return self.send_batch([Email(to_email, subject, html_body)])
+
+	def send_splitting(self, emails):
+		""" Sends a batch, halving it whenever the provider rejects the request,
+			so only the emails it actually rejects fail. One bad email in a
+			batch of n costs about 2 * log2(n) extra requests.
+			Returns a list of (email, error) for the emails that could not be sent
+		"""
+		try:
+			self.send_batch(emails)
+		except Exception as error:
+			if len(emails) == 1 or not is_request_rejected(error):
+				return [(email, error) for email in emails]
+			middle = len(emails) // 2
+			return self.send_splitting(emails[:middle]) + self.send_splitting(emails[middle:])
+		return []
+
+	def send_many(self, emails):
+		""" Sends emails concurrently in as few requests as the transport allows
+			Returns a list of (email, error) for the emails that could not be sent
+		"""
+		batches = list(self.transport.chunk(emails))
+		futures = [self.executor.submit(self.send_splitting, batch) for batch in batches]
+		failures = []
+		for future in futures:
+			failures.extend(future.result())
+		return failures
+
+
+@lru_cache(maxsize=None)
+def get_dispatcher():
+	""" The process wide dispatcher, configured from settings
+	"""
+	rate = getattr(settings, 'EMAIL_RATE_PER_SECOND', DEFAULT_RATE_PER_SECOND)
+	return EmailDispatcher(
+		get_email_transport(),
+		max_workers=getattr(settings, 'EMAIL_MAX_WORKERS', DEFAULT_MAX_WORKERS),
+		rate_limiter=TokenBucket(rate, getattr(settings, 'EMAIL_RATE_BURST', None)),
+		circuit_breaker=CircuitBreaker(
+			getattr(settings, 'EMAIL_CIRCUIT_FAILURES', DEFAULT_CIRCUIT_FAILURES),
+			getattr(settings, 'EMAIL_CIRCUIT_RESET_SECONDS', DEFAULT_CIRCUIT_RESET_SECONDS)
+		)
+	)
+
+
+@receiver(setting_changed)
+def reset_dispatcher(**kwargs):
+	if kwargs['setting'].startswith(('EMAIL_', 'SENDGRID_')):
+		get_dispatcher.cache_clear()
@@ -0,0 +1,72 @@
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import get_template
+
+
+ASSIGNMENT_EMAIL_TEMPLATE = 'giftexchange/emails/assignment_email.html'
+DEFAULT_RENDER_CACHE_SECONDS = 60 * 60
+
+
+@lru_cache(maxsize=None)
+def compiled_template(template_name):
+	""" Loads and compiles an email template once per process
+	"""
+	return get_template(template_name)
+
+
+class AssignmentEmailRenderer(object):
+	""" Renders assignment emails for one gift exchange
+
+		The template is compiled once and every recipient's email is filled from
+		assignments that already have their giver and reciever loaded, such as
+		those from GiftExchange._assignment_queryset(). Rendered emails are
+		cached in the settings.EMAIL_RENDER_CACHE cache by assignment, reciever
+		and the exchange's email_version, so paging back and forth through
+		previews only renders each email once per process. Previews and sends
+		share renders only if that cache is shared between processes.
+	"""
+	def __init__(self, giftexchange):
+		self.giftexchange = giftexchange
+		self.template = compiled_template(ASSIGNMENT_EMAIL_TEMPLATE)
+		self.subject = 'You have been given an assignment for "{}"'.format(giftexchange.title)
+		self.cache_seconds = getattr(settings, 'EMAIL_RENDER_CACHE_SECONDS', DEFAULT_RENDER_CACHE_SECONDS)
+		self.cache = caches[getattr(settings, 'EMAIL_RENDER_CACHE', 'default')]
+
+	def cache_key(self, assignment):
+		return 'assignment_email:{}:{}:{}:{}'.format(
+			self.giftexchange.pk, assignment.pk, assignment.reciever_id, self.giftexchange.email_version
+		)
+
+	def _render(self, assignment):
+		return {
+			'subject': self.subject,
+			'html_body': self.template.render({
+				'giver': assignment.giver,
+				'assignment': assignment.reciever,
+				'giftexchange': self.giftexchange
+			}),
+			'to_email': assignment.giver.email,
+			'from_email': settings.FROM_ADDRESS
+		}
+
+	def render_many(self, assignments):
+		""" Returns the email vars for each assignment, in the same order
+		"""
+		keys = [self.cache_key(assignment) for assignment in assignments]
+		rendered = self.cache.get_many([key for key, assignment in zip(keys, assignments) if assignment.pk])
+		new_renders = {}
+		results = []
+		for key, assignment in zip(keys, assignments):
+			if key not in rendered:
+				rendered[key] = self._render(assignment)
+				if assignment.pk:
+					new_renders[key] = rendered[key]
+			results.append(rendered[key])
+		if new_renders:
+			self.cache.set_many(new_renders, self.cache_seconds)
+		return results
+
+	def render(self, assignment):
+		return self.render_many([assignment])[0]
@@ -0,0 +1,205 @@
+import smtplib
+import threading
+import time
+from email.generator import BytesGenerator
+from email.mime.text import MIMEText
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+from sendgrid import SendGridAPIClient
+
+
+# SendGrid accepts at most 1000 personalizations in one mail/send request
+SENDGRID_MAX_PERSONALIZATIONS = 1000
+# and at most 10000 bytes of substitutions per personalization
+SENDGRID_MAX_SUBSTITUTION_BYTES = 10000
+SENDGRID_DEFAULT_HOST = 'https://api.sendgrid.com'
+BODY_SUBSTITUTION_TAG = '-body-'
+DEFAULT_BATCH_SIZE = 100
+
+
+class EmailTransport(object):
+	""" Base class for email transports
+
+		Transports take objects with to_email, subject and html_body, such as
+		OutboundEmail, and must be safe to call from several threads at once.
+		send_batch raises if any email in the batch could not be sent.
+	"""
+	def __init__(self, from_email=None, batch_size=DEFAULT_BATCH_SIZE):
+		self.from_email = from_email or settings.FROM_ADDRESS
+		self.batch_size = batch_size
+
+	def chunk(self, emails):
+		""" Splits emails into the batches send_batch will be called with
+		"""
+		emails = list(emails)
+		for batch_start in range(0, len(emails), self.batch_size):
+			yield emails[batch_start:batch_start + self.batch_size]
+
+	def send_batch(self, emails):
+		raise NotImplementedError
+
+	def mime_message(self, email):
+		# MIMEText's compat32 policy builds messages many times faster than email.message.EmailMessage
+		message = MIMEText(email.html_body, 'html', 'utf-8')
+		message['From'] = self.from_email
+		message['To'] = email.to_email
+		message['Subject'] = email.subject
+		return message
+
+
+class SendGridTransport(EmailTransport):
+	""" Sends emails through the SendGrid v3 mail/send API
+
+		Emails are packed into as few requests as possible: every recipient
+		gets their own personalization, with their subject set on it and their
+		html body substituted into a shared content placeholder.
+	"""
+	def __init__(self, api_key, host=SENDGRID_DEFAULT_HOST, from_email=None,
+			max_personalizations=SENDGRID_MAX_PERSONALIZATIONS):
+		super(SendGridTransport, self).__init__(from_email=from_email, batch_size=max_personalizations)
+		self.client = SendGridAPIClient(api_key, host=host)
+		self.max_personalizations = max_personalizations
+
+	@staticmethod
+	def _too_large_to_substitute(email):
+		return len(email.html_body.encode('utf-8')) > SENDGRID_MAX_SUBSTITUTION_BYTES
+
+	def _personalization(self, email, substitute=True):
+		personalization = {
+			'to': [{'email': email.to_email}],
+			'subject': email.subject,
+		}
+		if substitute:
+			personalization['substitutions'] = {BODY_SUBSTITUTION_TAG: email.html_body}
+		custom_args = {}
+		if getattr(email, 'pk', None):
+			custom_args['outbound_email_id'] = str(email.pk)
+		if getattr(email, 'assignment_id', None):
+			custom_args['assignment_id'] = str(email.assignment_id)
+		if custom_args:
+			personalization['custom_args'] = custom_args
+		return personalization
+
+	def request_body(self, emails):
+		if len(emails) == 1 and self._too_large_to_substitute(emails[0]):
+			personalizations = [self._personalization(emails[0], substitute=False)]
+			content = emails[0].html_body
+		else:
+			personalizations = [self._personalization(email) for email in emails]
+			content = BODY_SUBSTITUTION_TAG
+		return {
+			'from': {'email': self.from_email},
+			'personalizations': personalizations,
+			'content': [{'type': 'text/html', 'value': content}],
+		}
+
+	def chunk(self, emails):
+		""" Splits emails into the batches send_batch will post them in
+			Bodies too large to substitute are sent on their own
+		"""
+		batch = []
+		for email in emails:
+			if self._too_large_to_substitute(email):
+				yield [email]
+				continue
+			batch.append(email)
+			if len(batch) == self.max_personalizations:
+				yield batch
+				batch = []
+		if batch:
+			yield batch
+
+	def send_batch(self, emails):
+		""" Sends one batch from chunk() in a single API request
+
+			SendGrid accepts or rejects the whole request, so an exception means
+			none of the emails in the batch were sent
+		"""
+		if len(emails) > self.max_personalizations:
+			raise Exception('At most {} emails can be sent in one request'.format(self.max_personalizations))
+		return self.client.client.mail.send.post(request_body=self.request_body(emails))
+
+
+class DjangoEmailTransport(EmailTransport):
+	""" Sends through Django's configured EMAIL_BACKEND, one backend
+		connection per batch
+	"""
+	def send_batch(self, emails):
+		messages = []
+		for email in emails:
+			message = EmailMessage(email.subject, email.html_body, self.from_email, [email.to_email])
+			message.content_subtype = 'html'
+			messages.append(message)
+		connection = get_connection(fail_silently=False)
+		return connection.send_messages(messages)
+
+
+class SMTPTransport(EmailTransport):
+	""" Sends over plain SMTP, e.g. to a local sink for load testing, keeping
+		one open connection per thread
+	"""
+	def __init__(self, host='localhost', port=1025, **kwargs):
+		super(SMTPTransport, self).__init__(**kwargs)
+		self.host = host
+		self.port = port
+		self.local = threading.local()
+
+	def _connection(self):
+		connection = getattr(self.local, 'connection', None)
+		if connection is None:
+			connection = self.local.connection = smtplib.SMTP(self.host, self.port)
+		return connection
+
+	def send_batch(self, emails):
+		try:
+			connection = self._connection()
+			for email in emails:
+				connection.send_message(self.mime_message(email))
+		except smtplib.SMTPServerDisconnected:
+			self.local.connection = None
+			raise
+		return len(emails)
+
+
+class FileTransport(EmailTransport):
+	""" Appends emails to a local mbox file instead of sending them
+		The file is only ever appended to, so batches cost the same however big it gets
+	"""
+	def __init__(self, path, **kwargs):
+		super(FileTransport, self).__init__(**kwargs)
+		self.path = path
+		self.lock = threading.Lock()
+
+	def send_batch(self, emails):
+		messages = [self.mime_message(email) for email in emails]
+		with self.lock:
+			with open(self.path, 'ab') as mbox:
+				for message in messages:
+					message.set_unixfrom('From MAILER-DAEMON {}'.format(time.asctime()))
+					BytesGenerator(mbox, mangle_from_=True).flatten(message, unixfrom=True)
+					mbox.write(b'\n')
+		return len(messages)
+
+
+def get_email_transport(name=None):
+	""" Builds the transport named by settings.EMAIL_TRANSPORT, one of
+		sendgrid, django, smtp or file
+	"""
+	name = name or getattr(settings, 'EMAIL_TRANSPORT', 'sendgrid')
+	if name == 'sendgrid':
+		return SendGridTransport(
+			settings.SENDGRID_API_KEY,
+			host=getattr(settings, 'SENDGRID_API_HOST', SENDGRID_DEFAULT_HOST)
+		)
+	if name == 'django':
+		return DjangoEmailTransport()
+	if name == 'smtp':
+		return SMTPTransport(
+			host=getattr(settings, 'EMAIL_TRANSPORT_SMTP_HOST', 'localhost'),
+			port=getattr(settings, 'EMAIL_TRANSPORT_SMTP_PORT', 1025)
+		)
+	if name == 'file':
+		return FileTransport(getattr(settings, 'EMAIL_TRANSPORT_FILE_PATH', 'outbound_emails.mbox'))
+	raise Exception('Unknown email transport "{}"'.format(name))
@@ -0,0 +1,131 @@
+import csv
+import json
+
+from django.db.models import F
+
+from giftexchange.participant_import import PARTICIPANT_CSV_HEADER
+
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = ['csv', 'jsonl']
+# participant exports use the upload column names, so an export can be uploaded to another exchange
+PARTICIPANT_EXPORT_COLUMNS = PARTICIPANT_CSV_HEADER + ['status']
+ASSIGNMENT_EXPORT_COLUMNS = [
+	'loop_index',
+	'giver_first_name',
+	'giver_last_name',
+	'giver_email',
+	'reciever_first_name',
+	'reciever_last_name',
+	'reciever_email',
+	'email_sent',
+	'delivery_status',
+]
+GIFT_EXPORT_COLUMNS = [
+	'giver_first_name',
+	'giver_last_name',
+	'giver_email',
+	'reciever_first_name',
+	'reciever_last_name',
+	'reciever_email',
+	'gift',
+]
+
+
+class EchoBuffer(object):
+	""" File-like object for csv.writer that hands each written line straight
+		back, so CSV responses can be streamed
+	"""
+	def write(self, value):
+		return value
+
+
+def participant_rows(giftexchange):
+	return giftexchange.participant_set.order_by('pk').values(
+		'first_name',
+		'last_name',
+		'email',
+		'shipping_address',
+		'likes',
+		'dislikes',
+		'status',
+		allergies=F('allergies_sensitivities'),
+		other=F('additional_info'),
+	).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def _people(assignment):
+	return {
+		'giver_first_name': assignment.giver.first_name,
+		'giver_last_name': assignment.giver.last_name,
+		'giver_email': assignment.giver.email,
+		'reciever_first_name': assignment.reciever.first_name,
+		'reciever_last_name': assignment.reciever.last_name,
+		'reciever_email': assignment.reciever.email,
+	}
+
+
+def assignment_rows(giftexchange):
+	for loop_index, assignment in enumerate(giftexchange.iter_ordered_assignments(chunk_size=EXPORT_CHUNK_SIZE)):
+		row = _people(assignment)
+		row.update({
+			'loop_index': loop_index,
+			'email_sent': assignment.email_sent,
+			'delivery_status': assignment.delivery_status,
+		})
+		yield row
+
+
+def gift_rows(giftexchange):
+	for assignment in giftexchange.iter_ordered_assignments(chunk_size=EXPORT_CHUNK_SIZE):
+		row = _people(assignment)
+		row['gift'] = assignment.reciever.gift
+		yield row
+
+
+EXPORTS = {
+	'participants': (PARTICIPANT_EXPORT_COLUMNS, participant_rows),
+	'assignments': (ASSIGNMENT_EXPORT_COLUMNS, assignment_rows),
+	'gifts': (GIFT_EXPORT_COLUMNS, gift_rows),
+}
+
+
+def csv_lines(columns, rows):
+	writer = csv.writer(EchoBuffer())
+	yield writer.writerow(columns)
+	for row in rows:
+		yield writer.writerow([row[column] for column in columns])
+
+
+def jsonl_lines(columns, rows):
+	for row in rows:
+		yield json.dumps({column: row[column] for column in columns}) + '\n'
+
+
+def buffered(lines, buffer_size=64 * 1024):
+	""" Joins lines into pieces of about buffer_size characters, so a streamed
+		response is not written one short line at a time
+	"""
+	buffer = []
+	size = 0
+	for line in lines:
+		buffer.append(line)
+		size += len(line)
+		if size >= buffer_size:
+			yield ''.join(buffer)
+			buffer = []
+			size = 0
+	if buffer:
+		yield ''.join(buffer)
+
+
+def export_lines(giftexchange, export_name, export_format='csv'):
+	""" Streams one of EXPORTS for a gift exchange as CSV or JSON Lines
+	"""
+	if export_name not in EXPORTS:
+		raise Exception('Unknown export "{}", expected one of {}'.format(export_name, ', '.join(sorted(EXPORTS))))
+	if export_format not in EXPORT_FORMATS:
+		raise Exception('Unknown export format "{}", expected one of {}'.format(export_format, ', '.join(EXPORT_FORMATS)))
+	columns, rows = EXPORTS[export_name]
+	lines = csv_lines if export_format == 'csv' else jsonl_lines
+	return buffered(lines(columns, rows(giftexchange)))
@@ -0,0 +1,98 @@
+import json
+import logging
+
+from django.conf import settings
+
+from giftexchange.assignments import AssignmentError
+from giftexchange.models import EmailSendRun, Job, ParticipantImport
+
+
+logger = logging.getLogger(__name__)
+
+JOB_HANDLERS = {}
+
+
+def job_handler(kind):
+	""" Registers a function as the handler for jobs of `kind`
+
+		Handlers are called with the claimed Job, report progress with
+		job.set_progress() and return a JSON serializable result. An exception
+		fails the job. An AssignmentError keeps its problems in the job's
+		result for the admin, any other exception is logged as a bug.
+	"""
+	def register(handler):
+		JOB_HANDLERS[kind] = handler
+		return handler
+	return register
+
+
+def enqueue_job(kind, giftexchange=None, **params):
+	""" Queues a job for the run_workers command
+
+		With settings.JOBS_RUN_INLINE the job runs straight away in this
+		process instead, which is handy in development and tests
+	"""
+	if kind not in JOB_HANDLERS:
+		raise Exception('Unknown job kind "{}"'.format(kind))
+	job = Job.objects.create(kind=kind, giftexchange=giftexchange, params=json.dumps(params))
+	if getattr(settings, 'JOBS_RUN_INLINE', False):
+		job.start()
+		run_job(job)
+	return job
+
+
+def run_job(job):
+	try:
+		result = JOB_HANDLERS[job.kind](job)
+	except AssignmentError as error:
+		logger.info('Job %s could not finish: %s', job, error)
+		job.finish(result={'problems': error.problems}, error=str(error))
+	except Exception as error:
+		logger.exception('Job %s failed', job)
+		job.finish(error=str(error))
+	else:
+		job.finish(result=result)
+	return job
+
+
+@job_handler('generate_assignments')
+def generate_assignments(job):
+	seed = job.get_params().get('seed')
+	job.set_progress(0, 1, 'Generating assignments')
+	assignments = job.giftexchange.generate_assignemnts(seed=seed)
+	job.set_progress(1, 1, 'Generated {} assignments'.format(len(assignments)))
+	return {'assignment_count': len(assignments), 'seed': job.giftexchange.assignment_seed}
+
+
+def _send_run_result(send_run):
+	return {
+		'run_id': send_run.pk,
+		'job_id': send_run.job_id,
+		'queued': send_run.queued_count,
+		'skipped': send_run.skipped_count,
+	}
+
+
+@job_handler('send_assignment_emails')
+def send_assignment_emails(job):
+	send_run = EmailSendRun.start(job.giftexchange)
+	job.set_progress(0, send_run.total_count, 'Queueing assignment emails')
+	send_run.enqueue(on_progress=lambda done, total: job.set_progress(done, total))
+	return _send_run_result(send_run)
+
+
+@job_handler('resume_email_send_run')
+def resume_email_send_run(job):
+	send_run = job.giftexchange.emailsendrun_set.get(pk=job.get_params()['run_id'])
+	job.set_progress(0, send_run.total_count, 'Resuming email run {}'.format(send_run.job_id))
+	send_run.resume(on_progress=lambda done, total: job.set_progress(done, total))
+	return _send_run_result(send_run)
+
+
+@job_handler('import_participants')
+def import_participants(job):
+	participant_import = ParticipantImport.objects.get(pk=job.get_params()['import_id'])
+	job.set_progress(0, max(participant_import.line_count - 1, 0), 'Importing {}'.format(participant_import.filename))
+	counts = participant_import.run(on_progress=lambda done, total: job.set_progress(done, total))
+	counts['import_id'] = participant_import.pk
+	return counts
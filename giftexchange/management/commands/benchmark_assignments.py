@@ -0,0 +1,135 @@
+import csv
+import json
+import random
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from giftexchange.email_rendering import AssignmentEmailRenderer
+from giftexchange.models import (
+	ASSIGNMENT_BATCH_SIZE,
+	GiftExchange,
+	Participant,
+	bulk_batch_size,
+)
+
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+RESULT_FIELDS = ['database', 'participants', 'run', 'stage', 'seconds', 'queries']
+
+
+def seed_benchmark_giftexchange(size):
+	""" Creates a gift exchange with `size` active participants to benchmark against
+	"""
+	giftexchange = GiftExchange.objects.create(
+		title='Benchmark {} participants {}'.format(size, datetime.now().isoformat()),
+		location='Benchmark'
+	)
+	participants = [
+		Participant(
+			giftexchange=giftexchange,
+			first_name='Benchmark{}'.format(i),
+			last_name='Participant',
+			email='benchmark{}@example.com'.format(i),
+			likes='Things',
+			status='active'
+		) for i in range(size)
+	]
+	Participant.objects.bulk_create(
+		participants,
+		batch_size=bulk_batch_size(Participant, participants, ASSIGNMENT_BATCH_SIZE)
+	)
+	return giftexchange
+
+
+class Command(BaseCommand):
+	help = (
+		'Times assignment generation, verification, persistence, ordered traversal and email '
+		'rendering for seeded gift exchanges of increasing size. Use --settings to point it at '
+		'another database, e.g. a local Postgres.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+		parser.add_argument('--runs', type=int, default=1, help='Runs per size')
+		parser.add_argument('--output', help='File to write results to, .json or .csv')
+		parser.add_argument(
+			'--render-sample',
+			type=int,
+			default=200,
+			help='Number of assignment emails to render per run'
+		)
+		parser.add_argument('--seed', type=int, help='Seed for deterministic assignment generation')
+
+	def _measure(self, stage, function):
+		with CaptureQueriesContext(connection) as queries:
+			start = time.perf_counter()
+			result = function()
+			seconds = time.perf_counter() - start
+		return result, {'stage': stage, 'seconds': round(seconds, 6), 'queries': len(queries)}
+
+	def _render_sample(self, giftexchange, sample_size):
+		sample = []
+		for assignment in giftexchange.iter_ordered_assignments():
+			if len(sample) >= sample_size:
+				break
+			assignment.giftexchange = giftexchange
+			sample.append(assignment)
+		return len(AssignmentEmailRenderer(giftexchange).render_many(sample))
+
+	def _run(self, size, options):
+		giftexchange = seed_benchmark_giftexchange(size)
+		try:
+			measurements = []
+			rng = random.Random(options['seed']) if options['seed'] is not None else None
+			assignments, measurement = self._measure('generate', lambda: giftexchange._generate_assignments(rng=rng))
+			measurements.append(measurement)
+			violations, measurement = self._measure('verify', lambda: giftexchange.audit_assignments(assignments))
+			measurements.append(measurement)
+			if violations:
+				raise CommandError('Generated assignments for {} participants failed verification: {}'.format(
+					size, violations[0].message
+				))
+			measurements.append(self._measure('persist', lambda: giftexchange._save_assignments(assignments))[1])
+			measurements.append(self._measure('ordered_assignments', lambda: giftexchange.ordered_assignments)[1])
+			measurements.append(self._measure('iter_ordered_assignments', lambda: sum(
+				1 for assignment in giftexchange.iter_ordered_assignments()
+			))[1])
+			render_count = min(size, options['render_sample'])
+			measurements.append(self._measure(
+				'render_email_x{}'.format(render_count),
+				lambda: self._render_sample(giftexchange, render_count)
+			)[1])
+		finally:
+			giftexchange.delete()
+		return measurements
+
+	def _write_results(self, results, output):
+		if output.endswith('.csv'):
+			with open(output, 'w', newline='') as output_file:
+				writer = csv.DictWriter(output_file, fieldnames=RESULT_FIELDS)
+				writer.writeheader()
+				writer.writerows(results)
+		else:
+			with open(output, 'w') as output_file:
+				json.dump(results, output_file, indent=2)
+
+	def handle(self, *args, **options):
+		if options['output'] and not options['output'].endswith(('.json', '.csv')):
+			raise CommandError('Output file must end in .json or .csv')
+		results = []
+		for size in options['sizes']:
+			for run in range(1, options['runs'] + 1):
+				for measurement in self._run(size, options):
+					result = {'database': connection.vendor, 'participants': size, 'run': run}
+					result.update(measurement)
+					results.append(result)
+					self.stdout.write('{database} {participants:>7} run {run} {stage:<26} {seconds:>10.4f}s {queries:>6} queries'.format(
+						**result
+					))
+		if options['output']:
+			self._write_results(results, options['output'])
+			self.stdout.write(self.style.SUCCESS('Results written to {}'.format(options['output'])))
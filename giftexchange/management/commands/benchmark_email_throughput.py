@@ -0,0 +1,89 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from giftexchange.email_dispatch import CircuitBreaker, Email, EmailDispatcher, TokenBucket
+from giftexchange.email_rendering import AssignmentEmailRenderer
+from giftexchange.email_transports import get_email_transport
+from giftexchange.management.commands.benchmark_assignments import seed_benchmark_giftexchange
+
+
+class Command(BaseCommand):
+	help = (
+		'Measures end to end assignment email throughput, rendering plus transport, for a seeded '
+		'gift exchange. Use a local transport (file, smtp or django with the locmem or console '
+		'backend) to load test the send path offline.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--participants', type=int, default=1000)
+		parser.add_argument(
+			'--transport',
+			default='file',
+			choices=['sendgrid', 'django', 'smtp', 'file'],
+			help='Transport to send through, configured from the usual settings'
+		)
+		parser.add_argument('--workers', type=int, default=4, help='Dispatcher threads')
+		parser.add_argument(
+			'--rate',
+			type=float,
+			default=0,
+			help='Requests per second limit, 0 for no limit'
+		)
+		parser.add_argument('--chunk-size', type=int, default=1000, help='Assignments rendered and sent per chunk')
+
+	def handle(self, *args, **options):
+		giftexchange = seed_benchmark_giftexchange(options['participants'])
+		try:
+			giftexchange.generate_assignemnts()
+			transport = get_email_transport(options['transport'])
+			dispatcher = EmailDispatcher(
+				transport,
+				max_workers=options['workers'],
+				rate_limiter=TokenBucket(options['rate']),
+				circuit_breaker=CircuitBreaker(failure_threshold=5, reset_seconds=60)
+			)
+			renderer = AssignmentEmailRenderer(giftexchange)
+			chunks = []
+			start = time.perf_counter()
+			chunk = []
+			assignments = giftexchange._assignment_queryset().order_by('pk').iterator(chunk_size=options['chunk_size'])
+			for assignment in assignments:
+				assignment.giftexchange = giftexchange
+				chunk.append(assignment)
+				if len(chunk) < options['chunk_size']:
+					continue
+				chunks.append(self._send_chunk(renderer, dispatcher, chunk))
+				chunk = []
+			if chunk:
+				chunks.append(self._send_chunk(renderer, dispatcher, chunk))
+			total_seconds = time.perf_counter() - start
+		finally:
+			giftexchange.delete()
+
+		render_seconds = sum(rendered for rendered, sent, failed in chunks)
+		send_seconds = sum(sent for rendered, sent, failed in chunks)
+		failed_count = sum(failed for rendered, sent, failed in chunks)
+		sent_count = options['participants'] - failed_count
+
+		self.stdout.write('render     {:>10.3f}s {:>10.0f} emails/s'.format(
+			render_seconds, options['participants'] / render_seconds if render_seconds else 0
+		))
+		self.stdout.write('transport  {:>10.3f}s {:>10.0f} emails/s'.format(
+			send_seconds, sent_count / send_seconds if send_seconds else 0
+		))
+		self.stdout.write(self.style.SUCCESS('Sent {} emails ({} failed) through {} in {:.3f}s: {:.0f} emails/s end to end'.format(
+			sent_count, failed_count, options['transport'], total_seconds, sent_count / total_seconds if total_seconds else 0
+		)))
+
+	def _send_chunk(self, renderer, dispatcher, chunk):
+		""" Returns render seconds, send seconds and the number of failed emails
+		"""
+		start = time.perf_counter()
+		emails = [
+			Email(email_vars['to_email'], email_vars['subject'], email_vars['html_body'])
+			for email_vars in renderer.render_many(chunk)
+		]
+		rendered = time.perf_counter()
+		failures = dispatcher.send_many(emails)
+		return rendered - start, time.perf_counter() - rendered, len(failures)
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from giftexchange.models import GiftExchange
+from giftexchange.snapshots import SnapshotError, clone_giftexchange
+
+
+class Command(BaseCommand):
+	help = 'Copies a Gift Exchange\'s details, admins, participants and exclusions into a new Gift Exchange'
+
+	def add_arguments(self, parser):
+		parser.add_argument('id', type=int)
+		parser.add_argument('title', help='Title of the new gift exchange')
+		parser.add_argument(
+			'--exclude-repeats',
+			action='store_true',
+			help='Nobody in the new gift exchange gets the same person they had in this one'
+		)
+
+	def handle(self, *args, **options):
+		try:
+			giftexchange = GiftExchange.objects.get(pk=options['id'])
+		except GiftExchange.DoesNotExist:
+			raise CommandError('GiftExchange "{}" does not exist'.format(options['id']))
+		start = time.perf_counter()
+		try:
+			restorer = clone_giftexchange(giftexchange, options['title'], exclude_repeats=options['exclude_repeats'])
+		except SnapshotError as error:
+			raise CommandError(str(error))
+		self.stdout.write(self.style.SUCCESS(
+			'Cloned GiftExchange "{}" into {} "{}" with {} participants in {:.3f}s'.format(
+				giftexchange.title,
+				restorer.giftexchange.pk,
+				restorer.giftexchange.title,
+				restorer.counts['participants'],
+				time.perf_counter() - start
+			)
+		))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from giftexchange.exports import EXPORT_FORMATS, EXPORTS, export_lines
+from giftexchange.models import GiftExchange
+
+
+class Command(BaseCommand):
+	help = 'Streams a Gift Exchange\'s participants, assignment loop or gift results as CSV or JSON Lines'
+
+	def add_arguments(self, parser):
+		parser.add_argument('id', type=int)
+		parser.add_argument('export', choices=sorted(EXPORTS))
+		parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+		parser.add_argument('--output', help='File to write to instead of stdout')
+
+	def handle(self, *args, **options):
+		try:
+			giftexchange = GiftExchange.objects.get(pk=options['id'])
+		except GiftExchange.DoesNotExist:
+			raise CommandError('GiftExchange "{}" does not exist'.format(options['id']))
+		lines = export_lines(giftexchange, options['export'], options['format'])
+		if not options['output']:
+			for piece in lines:
+				self.stdout.write(piece, ending='')
+			return
+		with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+			for piece in lines:
+				output.write(piece)
+		self.stdout.write(self.style.SUCCESS(
+			'Exported {} for GiftExchange "{}" to {}'.format(options['export'], giftexchange.title, options['output'])
+		))
@@ -1,26 +1,135 @@
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import django
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
 
+from giftexchange.assignments import AssignmentError
 from giftexchange.models import GiftExchange
 
 
+def _init_worker():
+	django.setup()
+	# never reuse a database connection inherited from the parent process
+	connections.close_all()
+
+
+def exchange_seed(seed, giftexchange_id):
+	""" Derives a repeatable seed for one exchange of a multi-exchange run, so
+		exchanges given the same --seed do not all shuffle the same way
+	"""
+	if seed is None:
+		return None
+	digest = hashlib.sha256('{}:{}'.format(seed, giftexchange_id).encode('ascii')).digest()
+	return int.from_bytes(digest[:8], 'big') >> 1
+
+
+def generate_for_giftexchange(giftexchange_id, seed=None):
+	""" Generates assignments for one gift exchange and reports how it went
+		seed is combined with the exchange id with exchange_seed()
+		Returns a (giftexchange_id, title, assignment_count, seconds, error) tuple
+	"""
+	start = time.perf_counter()
+	title = None
+	try:
+		giftexchange = GiftExchange.objects.get(pk=giftexchange_id)
+		title = giftexchange.title
+		if giftexchange.assignments_locked:
+			return giftexchange_id, title, None, 0, 'assignments are locked'
+		assignments = giftexchange.generate_assignemnts(seed=exchange_seed(seed, giftexchange_id))
+	except GiftExchange.DoesNotExist:
+		return giftexchange_id, title, None, 0, 'does not exist'
+	except AssignmentError as error:
+		return giftexchange_id, title, None, time.perf_counter() - start, str(error)
+	return giftexchange_id, title, len(assignments), time.perf_counter() - start, None
+
+
 class Command(BaseCommand):
-	help = 'Generates exchange assignments for given Gift Exchange ID'
+	help = 'Generates exchange assignments for the given Gift Exchange IDs'
 
 	def add_arguments(self, parser):
-		parser.add_argument('id', type=int)
+		parser.add_argument('ids', type=int, nargs='*')
+		parser.add_argument(
+			'--pending',
+			action='store_true',
+			help='Generate for every unlocked gift exchange that has no assignments yet'
+		)
+		parser.add_argument(
+			'--workers',
+			type=int,
+			default=1,
+			help='Number of processes to generate assignments with'
+		)
+		parser.add_argument(
+			'--seed',
+			type=int,
+			help=(
+				'Regenerate deterministically from this seed instead of a random one. With several '
+				'exchanges each one is seeded from this seed and its id, and stores the seed it used'
+			)
+		)
 
-	def handle(self, *args, **options):
+	def _handle_single(self, giftexchange_id, seed):
 		try:
-			giftexchange = GiftExchange.objects.get(pk=options['id'])
+			giftexchange = GiftExchange.objects.get(pk=giftexchange_id)
 		except GiftExchange.DoesNotExist:
-			raise CommandError('GiftExchange "{}" does not exist'.format(options['id']))
+			raise CommandError('GiftExchange "{}" does not exist'.format(giftexchange_id))
 		if giftexchange.assignments_locked:
 			raise CommandError('Assignments are already locked for GiftExchange "{}"'.format(giftexchange.title))
-		assignments = giftexchange.generate_assignemnts()
+		try:
+			assignments = giftexchange.generate_assignemnts(seed=seed)
+		except AssignmentError as error:
+			raise CommandError('Could not generate assignments for GiftExchange "{}": {}'.format(giftexchange.title, error))
 		self.stdout.write(
 			self.style.SUCCESS(
-				'Assignments generated for GiftExchange "{}" for {} participants'.format(
-					giftexchange.title, len(assignments)
+				'Assignments generated for GiftExchange "{}" for {} participants with seed {}'.format(
+					giftexchange.title, len(assignments), giftexchange.assignment_seed
 				)
 			)
 		)
+
+	def _generate_all(self, giftexchange_ids, workers, seed):
+		generate = partial(generate_for_giftexchange, seed=seed)
+		if workers > 1 and connection.vendor == 'sqlite':
+			self.stdout.write(self.style.WARNING('SQLite allows one writer at a time, generating in a single process'))
+			workers = 1
+		if workers <= 1:
+			return map(generate, giftexchange_ids)
+		connections.close_all()
+		with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+			return list(executor.map(generate, giftexchange_ids))
+
+	def handle(self, *args, **options):
+		giftexchange_ids = list(options['ids'])
+		if options['pending']:
+			pending = GiftExchange.objects.filter(
+				assignments_locked=False,
+				exchangeassignment__isnull=True
+			).order_by('pk').values_list('pk', flat=True)
+			giftexchange_ids += [giftexchange_id for giftexchange_id in pending if giftexchange_id not in giftexchange_ids]
+		elif not giftexchange_ids:
+			raise CommandError('Give at least one Gift Exchange ID, or --pending')
+
+		if len(giftexchange_ids) == 1 and not options['pending']:
+			return self._handle_single(giftexchange_ids[0], options['seed'])
+
+		start = time.perf_counter()
+		generated_count = 0
+		for giftexchange_id, title, assignment_count, seconds, error in self._generate_all(giftexchange_ids, options['workers'], options['seed']):
+			if error:
+				self.stdout.write(self.style.WARNING(
+					'Skipped GiftExchange {} "{}": {}'.format(giftexchange_id, title or '', error)
+				))
+			else:
+				generated_count += 1
+				self.stdout.write(self.style.SUCCESS(
+					'Assignments generated for GiftExchange {} "{}" for {} participants in {:.3f}s'.format(
+						giftexchange_id, title, assignment_count, seconds
+					)
+				))
+		self.stdout.write('Generated assignments for {} of {} gift exchanges in {:.3f}s'.format(
+			generated_count, len(giftexchange_ids), time.perf_counter() - start
+		))
@@ -0,0 +1,71 @@
+import json
+import random
+import time
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from giftexchange.models import DELIVERY_STATUS_CHOICES, GiftExchange
+
+
+class Command(BaseCommand):
+	help = 'Posts synthetic provider delivery events to the delivery webhook and reports events per second'
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			'--host',
+			default='http://127.0.0.1:8000',
+			help='Server the webhook is running on'
+		)
+		parser.add_argument('--token', help='Webhook token, if DELIVERY_WEBHOOK_TOKEN is set')
+		parser.add_argument('--events', type=int, default=10000, help='Total events to post')
+		parser.add_argument('--batch-size', type=int, default=1000, help='Events per request')
+		parser.add_argument(
+			'--giftexchange',
+			type=int,
+			help='Use this gift exchange\'s assignments as recipients instead of made up addresses'
+		)
+
+	def _recipients(self, giftexchange_id, count):
+		if giftexchange_id is None:
+			return [{'email': 'synthetic{}@example.com'.format(i)} for i in range(count)]
+		try:
+			giftexchange = GiftExchange.objects.get(pk=giftexchange_id)
+		except GiftExchange.DoesNotExist:
+			raise CommandError('GiftExchange "{}" does not exist'.format(giftexchange_id))
+		recipients = [
+			{'email': email, 'assignment_id': str(assignment_id)}
+			for assignment_id, email in giftexchange.exchangeassignment_set.values_list('pk', 'giver__email')
+		]
+		if not recipients:
+			raise CommandError('GiftExchange "{}" has no assignments'.format(giftexchange.title))
+		return recipients
+
+	def _events(self, recipients, count):
+		statuses = [status for status, label in DELIVERY_STATUS_CHOICES]
+		now = int(time.time())
+		for i in range(count):
+			event = dict(recipients[i % len(recipients)])
+			event.update({
+				'event': random.choice(statuses),
+				'timestamp': now + i // len(recipients),
+				'sg_event_id': 'synthetic-{}'.format(i),
+			})
+			if event['event'] in ('bounce', 'dropped'):
+				event['reason'] = 'Synthetic {}'.format(event['event'])
+			yield event
+
+	def handle(self, *args, **options):
+		url = options['host'].rstrip('/') + reverse('email_delivery_event_webhook')
+		if options['token']:
+			url += '?token={}'.format(options['token'])
+		events = list(self._events(self._recipients(options['giftexchange'], options['events']), options['events']))
+		start = time.perf_counter()
+		for batch_start in range(0, len(events), options['batch_size']):
+			payload = json.dumps(events[batch_start:batch_start + options['batch_size']]).encode('utf-8')
+			urlopen(Request(url, data=payload, headers={'Content-Type': 'application/json'})).read()
+		seconds = time.perf_counter() - start
+		self.stdout.write(self.style.SUCCESS('Posted {} events in {:.3f}s ({:.0f} events/s)'.format(
+			len(events), seconds, len(events) / seconds if seconds else 0
+		)))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from giftexchange.snapshots import SnapshotError, restore_snapshot
+
+
+class Command(BaseCommand):
+	help = 'Restores a Gift Exchange snapshot as a new Gift Exchange'
+
+	def add_arguments(self, parser):
+		parser.add_argument('path', help='Snapshot file written by snapshot_giftexchange')
+		parser.add_argument('--title', help='Title for the new gift exchange instead of the one in the snapshot')
+		parser.add_argument(
+			'--clone',
+			action='store_true',
+			help='Only copy details, admins, participants and exclusions, leaving assignments and gifts behind'
+		)
+
+	def handle(self, *args, **options):
+		start = time.perf_counter()
+		try:
+			with open(options['path'], 'rb') as snapshot_file:
+				restorer = restore_snapshot(snapshot_file, title=options['title'], clone=options['clone'])
+		except (OSError, SnapshotError) as error:
+			raise CommandError('Could not restore {}: {}'.format(options['path'], error))
+		self.stdout.write(self.style.SUCCESS(
+			'Restored GiftExchange {} "{}" with {participants} participants and {assignments} assignments in {seconds:.3f}s'.format(
+				restorer.giftexchange.pk, restorer.giftexchange.title, seconds=time.perf_counter() - start, **restorer.counts
+			)
+		))
+		if restorer.counts['missing_admins']:
+			self.stdout.write(self.style.WARNING(
+				'{} admins in the snapshot have no account here and were not added'.format(restorer.counts['missing_admins'])
+			))
@@ -0,0 +1,63 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+
+from giftexchange.jobs import run_job
+from giftexchange.models import Job
+
+
+class Command(BaseCommand):
+	help = 'Runs queued background jobs from the database with N worker threads'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--concurrency', type=int, default=2, help='Number of worker threads')
+		parser.add_argument('--once', action='store_true', help='Exit once there are no jobs left to run')
+		parser.add_argument('--sleep', type=float, default=2, help='Seconds to wait when there are no jobs')
+
+	def _work(self, once, sleep, stop):
+		while not stop.is_set():
+			try:
+				job = Job.claim_next()
+			except DatabaseError as error:
+				# e.g. SQLite, which has no row locks, refusing concurrent claims
+				self.stderr.write('Could not claim a job: {}'.format(error))
+				stop.wait(sleep)
+				continue
+			if job:
+				run_job(job)
+				self.stdout.write('{} {}'.format(job, job.error or ''))
+			elif once:
+				break
+			else:
+				stop.wait(sleep)
+
+	def _work_in_thread(self, *args):
+		try:
+			self._work(*args)
+		finally:
+			# each thread has its own database connection
+			connection.close()
+
+	def handle(self, *args, **options):
+		stop = threading.Event()
+		if options['concurrency'] <= 1:
+			try:
+				return self._work(options['once'], options['sleep'], stop)
+			except KeyboardInterrupt:
+				return
+		workers = [
+			threading.Thread(target=self._work_in_thread, args=(options['once'], options['sleep'], stop), daemon=True)
+			for i in range(options['concurrency'])
+		]
+		for worker in workers:
+			worker.start()
+		try:
+			while any(worker.is_alive() for worker in workers):
+				time.sleep(0.2)
+		except KeyboardInterrupt:
+			self.stdout.write('Stopping once running jobs finish')
+			stop.set()
+			for worker in workers:
+				worker.join()
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from giftexchange.models import OutboundEmail
+
+
+class Command(BaseCommand):
+	help = 'Delivers queued outbox emails, retrying failures with exponential backoff'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--once', action='store_true', help='Drain the due emails once and exit')
+		parser.add_argument('--batch-size', type=int, default=1000, help='Emails to claim per batch')
+		parser.add_argument('--sleep', type=float, default=5, help='Seconds to wait when the outbox is empty')
+		parser.add_argument(
+			'--max-attempts',
+			type=int,
+			default=5,
+			help='Attempts before an email is marked failed'
+		)
+
+	def handle(self, *args, **options):
+		processed_count = 0
+		while True:
+			claimed_count = OutboundEmail.send_due(
+				batch_size=options['batch_size'],
+				max_attempts=options['max_attempts']
+			)
+			processed_count += claimed_count
+			if claimed_count:
+				continue
+			if options['once']:
+				break
+			time.sleep(options['sleep'])
+		self.stdout.write(self.style.SUCCESS('Processed {} queued emails'.format(processed_count)))
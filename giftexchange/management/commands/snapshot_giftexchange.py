@@ -0,0 +1,28 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from giftexchange.models import GiftExchange
+from giftexchange.snapshots import write_snapshot
+
+
+class Command(BaseCommand):
+	help = 'Writes a compressed snapshot of a Gift Exchange, with its participants, admins, exclusions, assignments and gifts'
+
+	def add_arguments(self, parser):
+		parser.add_argument('id', type=int)
+		parser.add_argument('path', help='File to write, e.g. exchange-2020.jsonl.gz')
+
+	def handle(self, *args, **options):
+		try:
+			giftexchange = GiftExchange.objects.get(pk=options['id'])
+		except GiftExchange.DoesNotExist:
+			raise CommandError('GiftExchange "{}" does not exist'.format(options['id']))
+		start = time.perf_counter()
+		write_snapshot(giftexchange, options['path'])
+		self.stdout.write(self.style.SUCCESS(
+			'Wrote a snapshot of GiftExchange "{}" to {} ({} bytes) in {:.3f}s'.format(
+				giftexchange.title, options['path'], os.path.getsize(options['path']), time.perf_counter() - start
+			)
+		))
@@ -0,0 +1,41 @@
+# Generated by Django 3.0.6 on 2026-10-18 08:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('giftexchange', '0005_auto_20201204_0058'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='giftexchange',
+            name='exclude_repeats_from',
+            field=models.ManyToManyField(blank=True, help_text='Nobody gets the same person they had in these gift exchanges', related_name='excluded_repeats_in', to='giftexchange.GiftExchange'),
+        ),
+        migrations.CreateModel(
+            name='ExclusionGroup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('giftexchange', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='giftexchange.GiftExchange')),
+                ('members', models.ManyToManyField(blank=True, to='giftexchange.Participant')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ExclusionPair',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('both_ways', models.BooleanField(default=True)),
+                ('giftexchange', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='giftexchange.GiftExchange')),
+                ('giver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exclusion_giver', to='giftexchange.Participant')),
+                ('reciever', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exclusion_reciever', to='giftexchange.Participant')),
+            ],
+            options={
+                'unique_together': {('giftexchange', 'giver', 'reciever')},
+            },
+        ),
+    ]
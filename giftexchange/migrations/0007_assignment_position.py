@@ -0,0 +1,44 @@
+# Generated by Django 3.0.6 on 2026-10-18 08:15
+
+from django.db import migrations, models
+
+
+def set_assignment_positions(apps, schema_editor):
+    ExchangeAssignment = apps.get_model('giftexchange', 'ExchangeAssignment')
+    GiftExchange = apps.get_model('giftexchange', 'GiftExchange')
+    for giftexchange in GiftExchange.objects.all():
+        assignments = list(ExchangeAssignment.objects.filter(giftexchange=giftexchange).order_by('pk'))
+        if not assignments:
+            continue
+        assignments_by_giver = {assignment.giver_id: assignment for assignment in assignments}
+        assignment = assignments[0]
+        for position in range(len(assignments)):
+            assignment.position = position
+            assignment = assignments_by_giver.get(assignment.reciever_id)
+            if assignment is None or assignment.position is not None:
+                break
+        ExchangeAssignment.objects.bulk_update(
+            [assignment for assignment in assignments if assignment.position is not None],
+            ['position'],
+            batch_size=500
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('giftexchange', '0006_assignment_exclusions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exchangeassignment',
+            name='position',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='exchangeassignment',
+            index=models.Index(fields=['giftexchange', 'position'], name='giftexchang_giftexc_a5e435_idx'),
+        ),
+        migrations.RunPython(set_assignment_positions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.6 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('giftexchange', '0007_assignment_position'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='giftexchange',
+            name='assignment_seed',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.0.6 on 2026-10-18 08:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+import giftexchange.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('giftexchange', '0009_outboundemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailSendRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_id', models.CharField(default=giftexchange.models.new_email_job_id, max_length=32, unique=True)),
+                ('status', models.CharField(choices=[('queuing', 'queuing'), ('queued', 'queued'), ('completed', 'completed'), ('failed', 'failed')], default='queuing', max_length=10)),
+                ('cursor', models.PositiveIntegerField(default=0)),
+                ('total_count', models.PositiveIntegerField(default=0)),
+                ('queued_count', models.PositiveIntegerField(default=0)),
+                ('skipped_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('giftexchange', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='giftexchange.GiftExchange')),
+            ],
+        ),
+    ]
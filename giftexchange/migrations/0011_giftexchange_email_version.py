@@ -0,0 +1,18 @@
+# Generated by Django 3.0.6 on 2026-10-18 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('giftexchange', '0010_emailsendrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='giftexchange',
+            name='email_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
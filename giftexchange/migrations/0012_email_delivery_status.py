@@ -0,0 +1,37 @@
+# Generated by Django 3.0.6 on 2026-10-18 08:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('giftexchange', '0011_giftexchange_email_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailDeliveryStatus',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254, unique=True)),
+                ('status', models.CharField(choices=[('delivered', 'delivered'), ('deferred', 'deferred'), ('bounce', 'bounce'), ('dropped', 'dropped'), ('open', 'open'), ('click', 'click'), ('spamreport', 'spamreport')], max_length=20)),
+                ('reason', models.TextField(blank=True, null=True)),
+                ('event_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'email delivery statuses',
+            },
+        ),
+        migrations.AddField(
+            model_name='exchangeassignment',
+            name='delivery_status',
+            field=models.CharField(blank=True, choices=[('delivered', 'delivered'), ('deferred', 'deferred'), ('bounce', 'bounce'), ('dropped', 'dropped'), ('open', 'open'), ('click', 'click'), ('spamreport', 'spamreport')], max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='exchangeassignment',
+            name='delivery_status_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.6 on 2026-10-18 08:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('giftexchange', '0012_email_delivery_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SuppressedEmail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254, unique=True)),
+                ('reason', models.CharField(choices=[('bounce', 'bounce'), ('complaint', 'complaint'), ('manual', 'manual')], default='manual', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 3.0.6 on 2026-10-18 08:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('giftexchange', '0014_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParticipantImport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(max_length=255)),
+                ('line_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ParticipantImportChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ParticipantImportRowError',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line_number', models.PositiveIntegerField()),
+                ('reason', models.CharField(max_length=50)),
+                ('row', models.TextField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(fields=['giftexchange', 'email'], name='giftexchang_giftexc_0e67e7_idx'),
+        ),
+        migrations.AddField(
+            model_name='participantimportrowerror',
+            name='participant_import',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='giftexchange.ParticipantImport'),
+        ),
+        migrations.AddField(
+            model_name='participantimportchunk',
+            name='participant_import',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='giftexchange.ParticipantImport'),
+        ),
+        migrations.AddField(
+            model_name='participantimport',
+            name='giftexchange',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='giftexchange.GiftExchange'),
+        ),
+        migrations.AddField(
+            model_name='participantimport',
+            name='job',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='giftexchange.Job'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='participantimportchunk',
+            unique_together={('participant_import', 'index')},
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('giftexchange', '0015_participantimport'),
+    ]
+
+    # Participant.bulk_upsert matches on LOWER(email), which the (giftexchange, email) index can not serve.
+    # Written as SQL since expression indexes need Django 3.2; SQLite and PostgreSQL both support them.
+    operations = [
+        migrations.RunSQL(
+            sql='CREATE INDEX giftexchange_participant_email_lower ON giftexchange_participant (giftexchange_id, LOWER(email));',
+            reverse_sql='DROP INDEX giftexchange_participant_email_lower;',
+        ),
+    ]
@@ -1,17 +1,70 @@
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Lower
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
+from django.core.paginator import Paginator
 from django.urls import reverse
 from django.core.mail import EmailMessage
 from django.conf import settings
 from django.template.loader import render_to_string
+from django.utils import timezone
 from datetime import datetime, timedelta
 
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+from giftexchange.assignments import (
+	AssignmentError,
+	AssignmentInfeasible,
+	build_constrained_assignment_cycle,
+	verify_assignments,
+)
+from giftexchange.email_dispatch import get_dispatcher
+from giftexchange.email_rendering import AssignmentEmailRenderer, compiled_template
+from giftexchange.participant_import import (
+	IMPORT_BATCH_SIZE,
+	ParticipantCSVReader,
+	ParticipantImportError,
+	batched,
+	participant_values,
+	row_problem,
+)
+from giftexchange.suppression import SuppressionCache
 
 import random
 import string
 import hashlib
+import json
+import uuid
+
+
+ASSIGNMENT_BATCH_SIZE = 1000
+ASSIGNMENTS_PER_PAGE = 50
+EMAIL_PREVIEWS_PER_PAGE = 25
+# loop positions are spaced out so participants can be spliced in between them
+ASSIGNMENT_POSITION_STEP = 1024
+OUTBOX_RETRY_BASE_SECONDS = 30
+OUTBOX_RETRY_MAX_SECONDS = 3600
+# how long a worker has to deliver a claimed email before another worker may retry it
+OUTBOX_CLAIM_SECONDS = 300
+# how long a job worker may go without reporting progress before its job can be claimed again
+JOB_LEASE_SECONDS = 600
+JOB_MAX_ATTEMPTS = 3
+# jobs that queue the emails of an EmailSendRun
+EMAIL_SEND_JOB_KINDS = ['send_assignment_emails', 'resume_email_send_run']
+# hard bounces and spam complaints put an address on the suppression list
+SUPPRESSING_EVENTS = {'bounce': 'bounce', 'spamreport': 'complaint'}
+DELIVERY_STATUS_CHOICES = [
+	('delivered', 'delivered'),
+	('deferred', 'deferred'),
+	('bounce', 'bounce'),
+	('dropped', 'dropped'),
+	('open', 'open'),
+	('click', 'click'),
+	('spamreport', 'spamreport'),
+]
+# participant fields a bulk upsert only overwrites with non blank values
+PARTICIPANT_OPTIONAL_FIELDS = ['likes', 'dislikes', 'allergies_sensitivities', 'shipping_address', 'additional_info']
+PARTICIPANT_UPSERT_FIELDS = ['first_name', 'last_name', 'status'] + PARTICIPANT_OPTIONAL_FIELDS
 
 
 def twentyfourhoursfromnow():
@@ -31,22 +84,113 @@ def generate_login_token(email):
 	token_hash = hashlib.sha256(token_base.encode())
 	return token_hash.hexdigest()
 
+def bulk_batch_size(model, objs, batch_size):
+	""" Caps a bulk operation batch size to what the database backend accepts
+		(Django 3.0 does not do this itself when batch_size is given)
+	"""
+	backend_limit = connection.ops.bulk_batch_size(model._meta.concrete_fields, objs)
+	return max(min(batch_size, backend_limit), 1)
+
+class EmailSuppressed(Exception):
+	""" Raised for emails to addresses on the suppression list, which are never retried
+	"""
+	pass
+
+
+suppressed_emails = SuppressionCache(
+	lambda: SuppressedEmail.objects.values_list('email', flat=True),
+	ttl=getattr(settings, 'SUPPRESSION_REFRESH_SECONDS', 60)
+)
+
+
 def send_email(subject, html_body, to_emails):
 	if settings.SEND_EMAILS and not settings.TEST_EMAIL_DOMAIN in to_emails:
-		message = Mail(
-			from_email=settings.FROM_ADDRESS,
-			to_emails=to_emails,
-			subject=subject,
-			html_content=html_body
-		)
-		sg = SendGridAPIClient(settings.SENDGRID_API_KEY)
-		response = sg.send(message)
-		return response
+		if to_emails in suppressed_emails:
+			return False
+		return get_dispatcher().send(subject, html_body, to_emails)
 	else:
 		return True
 
 
-class AppUser(models.Model):
+def send_email_batch(emails):
+	""" Sends many emails concurrently with as few provider requests as possible
+
+		emails are objects with to_email, subject and html_body, such as
+		OutboundEmail. Returns a list of (email, error) for the emails that
+		could not be sent, with EmailSuppressed errors for suppressed addresses.
+	"""
+	if not settings.SEND_EMAILS:
+		return []
+	failures = []
+	sendable = []
+	for email in emails:
+		if settings.TEST_EMAIL_DOMAIN in email.to_email:
+			continue
+		if email.to_email in suppressed_emails:
+			failures.append((email, EmailSuppressed('{} is on the suppression list'.format(email.to_email))))
+		else:
+			sendable.append(email)
+	return failures + get_dispatcher().send_many(sendable)
+
+
+def new_email_job_id():
+	return uuid.uuid4().hex
+
+
+def queue_email(subject, html_body, to_emails, job_id=None):
+	""" Adds an email to the outbox for the send_queued_emails worker to deliver
+	"""
+	return OutboundEmail.objects.create(
+		job_id=job_id or new_email_job_id(),
+		to_email=to_emails,
+		subject=subject,
+		html_body=html_body
+	)
+
+
+class EmailFieldsTracker(object):
+	""" Remembers the loaded values of the EMAIL_FIELDS attnames, the fields
+		that show up in assignment emails, so a save can tell if they changed
+	"""
+	EMAIL_FIELDS = ()
+
+	@classmethod
+	def from_db(cls, db, field_names, values):
+		instance = super(EmailFieldsTracker, cls).from_db(db, field_names, values)
+		instance._remember_email_fields()
+		return instance
+
+	def refresh_from_db(self, using=None, fields=None):
+		super(EmailFieldsTracker, self).refresh_from_db(using=using, fields=fields)
+		self._remember_email_fields(fields)
+
+	def _remember_email_fields(self, fields=None):
+		names = self.EMAIL_FIELDS
+		if fields is not None:
+			fields = set(self._meta.get_field(name).attname for name in fields)
+			names = [name for name in names if name in fields]
+		loaded = getattr(self, '_loaded_email_fields', {}) if fields is not None else {}
+		loaded.update({name: self.__dict__[name] for name in names if name in self.__dict__})
+		self._loaded_email_fields = loaded
+
+	def email_fields_changed(self, update_fields=None):
+		""" True if saving update_fields would change what assignment emails show.
+			An instance that was not loaded from the database only counts as
+			changed when it overwrites an existing primary key
+		"""
+		loaded = getattr(self, '_loaded_email_fields', None)
+		if loaded is None:
+			return self.pk is not None
+		if update_fields is not None:
+			update_fields = set(self._meta.get_field(name).attname for name in update_fields)
+		return any(
+			name in self.__dict__ and (name not in loaded or self.__dict__[name] != loaded[name])
+			for name in self.EMAIL_FIELDS
+			if update_fields is None or name in update_fields
+		)
+
+
+class AppUser(EmailFieldsTracker, models.Model):
 	djangouser = models.OneToOneField(User, on_delete=models.CASCADE)
 	default_likes = models.TextField(blank=True, null=True)
 	default_dislikes = models.TextField(blank=True, null=True)
@@ -54,9 +198,21 @@ class AppUser(models.Model):
 	default_shipping_address = models.TextField(blank=True, null=True)
 	default_additional_info = models.TextField(blank=True, null=True)
 
+	# default shipping addresses show up in assignment emails
+	EMAIL_FIELDS = ('default_shipping_address',)
+
 	def __str__(self):
 		return '<AppUser {}> {}'.format(self.pk, self.djangouser.email)
 
+	def save(self, *args, **kwargs):
+		email_fields_changed = self.email_fields_changed(kwargs.get('update_fields'))
+		super(AppUser, self).save(*args, **kwargs)
+		if email_fields_changed:
+			GiftExchange.bump_email_version(
+				GiftExchange.objects.filter(Q(participant___appuser=self) | Q(participant__email=self.djangouser.email))
+			)
+		self._remember_email_fields()
+
 	@classmethod
 	def invite(cls, email, first_name, last_name, giftexchange, inviter, set_active=False, create_django_user=False):
 		if create_django_user:
@@ -190,13 +346,10 @@ class MagicLink(models.Model):
 
 	def send_link_email(self, request):
 		subject = 'Gifterator3000 login link'
-		formatted_body = render_to_string(
-			'giftexchange/emails/send_magic_link.html',
-			context={
-				'login_link': self.full_link(request),
-			}
-		)
-		email_result = send_email(
+		formatted_body = compiled_template('giftexchange/emails/send_magic_link.html').render({
+			'login_link': self.full_link(request),
+		})
+		return queue_email(
 			subject=subject,
 			to_emails=self.user_email,
 			html_body=formatted_body
@@ -206,7 +359,7 @@ class MagicLink(models.Model):
 		return '{} // expires: {}'.format(self.user_email, self.expiration)
 
 
-class GiftExchange(models.Model):
+class GiftExchange(EmailFieldsTracker, models.Model):
 	title = models.CharField(max_length=300, unique=True)
 	date = models.DateField(blank=True, null=True)
 	location = models.CharField(max_length=500)
@@ -215,6 +368,45 @@ class GiftExchange(models.Model):
 	admin_appuser = models.ManyToManyField(AppUser)
 	assignments_locked = models.BooleanField(default=False)
 	ship_gifts_allowed = models.BooleanField(default=False)
+	assignment_seed = models.BigIntegerField(blank=True, null=True)
+	exclude_repeats_from = models.ManyToManyField(
+		'self',
+		symmetrical=False,
+		blank=True,
+		related_name='excluded_repeats_in',
+		help_text='Nobody gets the same person they had in these gift exchanges'
+	)
+	# bumped whenever something shown in assignment emails changes, to invalidate rendered emails
+	email_version = models.PositiveIntegerField(default=0)
+
+	EMAIL_FIELDS = ('title', 'date', 'location', 'description', 'spending_limit', 'ship_gifts_allowed')
+
+	def save(self, *args, **kwargs):
+		""" Saves and bumps email_version if a field shown in assignment emails
+			changed. A loaded exchange writes email_version as an expression on
+			the stored value, so an instance loaded earlier can never set it back
+		"""
+		update_fields = kwargs.get('update_fields')
+		email_fields_changed = self.email_fields_changed(update_fields)
+		if self._state.adding:
+			super(GiftExchange, self).save(*args, **kwargs)
+			if email_fields_changed:
+				GiftExchange.bump_email_version(GiftExchange.objects.filter(pk=self.pk))
+				# reloaded from the database on next access
+				del self.email_version
+		elif update_fields is None or 'email_version' in update_fields or email_fields_changed:
+			if update_fields is not None and 'email_version' not in update_fields:
+				kwargs['update_fields'] = list(update_fields) + ['email_version']
+			self.email_version = F('email_version') + 1 if email_fields_changed else F('email_version')
+			super(GiftExchange, self).save(*args, **kwargs)
+			del self.email_version
+		else:
+			super(GiftExchange, self).save(*args, **kwargs)
+		self._remember_email_fields()
+
+	@staticmethod
+	def bump_email_version(giftexchanges):
+		giftexchanges.update(email_version=F('email_version') + 1)
 
 	def get_assignment(self, giver_appuser):
 		giver_participant = Participant.objects.get(giftexchange=self, appuser=giver_appuser)
@@ -239,19 +431,87 @@ class GiftExchange(models.Model):
 		self.assignments_locked = False
 		self.save()
 
+	def _assignment_queryset(self):
+		return self.exchangeassignment_set.select_related(
+			'giver___appuser__djangouser',
+			'reciever___appuser__djangouser',
+		)
+
+	@staticmethod
+	def _walk_assignment_loop(recievers_by_giver, start_giver_id):
+		""" Yields giver ids in loop order starting from start_giver_id
+			Stops at the end of the loop, or early if the loop is broken
+		"""
+		giver_id = start_giver_id
+		for step in range(len(recievers_by_giver)):
+			yield giver_id
+			giver_id = recievers_by_giver.get(giver_id)
+			if giver_id is None or giver_id == start_giver_id:
+				break
+
+	@property
+	def assignments_positioned(self):
+		return not self.exchangeassignment_set.filter(position__isnull=True).exists()
+
 	@property
 	def ordered_assignments(self):
-		assignments = []
-		if self.exchangeassignment_set.count() > 0:
-			start_assignment = self.exchangeassignment_set.order_by('pk').first()
-			next_assignment = start_assignment
-			next_giver = start_assignment.reciever
-			while next_assignment.reciever != start_assignment.giver:
-				assignments.append(next_assignment)
-				next_assignment = self.exchangeassignment_set.all().get(giver=next_assignment.reciever)
-				next_giver = next_assignment.reciever
-			assignments.append(next_assignment)
-		return assignments
+		assignments = list(self._assignment_queryset().order_by('position', 'pk'))
+		if all(assignment.position is not None for assignment in assignments):
+			return assignments
+		assignments_by_giver = {}
+		for assignment in sorted(assignments, key=lambda assignment: assignment.pk):
+			assignments_by_giver[assignment.giver_id] = assignment
+		start_giver_id = min(assignments, key=lambda assignment: assignment.pk).giver_id
+		recievers_by_giver = {
+			giver_id: assignment.reciever_id for giver_id, assignment in assignments_by_giver.items()
+		}
+		return [
+			assignments_by_giver[giver_id]
+			for giver_id in self._walk_assignment_loop(recievers_by_giver, start_giver_id)
+		]
+
+	def iter_ordered_assignments(self, chunk_size=500):
+		""" Streams assignments in loop order
+
+			Positioned loops are read straight from the (giftexchange, position)
+			index with a server side cursor. Older loops are walked over ids only
+			and model instances are fetched chunk_size at a time, so very large
+			exchanges can be walked without loading every assignment at once
+		"""
+		if self.assignments_positioned:
+			yield from self._assignment_queryset().order_by('position').iterator(chunk_size=chunk_size)
+			return
+		links = self.exchangeassignment_set.order_by('pk').values_list('pk', 'giver_id', 'reciever_id')
+		assignment_ids_by_giver = {}
+		recievers_by_giver = {}
+		start_giver_id = None
+		for assignment_id, giver_id, reciever_id in links:
+			assignment_ids_by_giver[giver_id] = assignment_id
+			recievers_by_giver[giver_id] = reciever_id
+			if start_giver_id is None:
+				start_giver_id = giver_id
+		if start_giver_id is None:
+			return
+		ordered_ids = [
+			assignment_ids_by_giver[giver_id]
+			for giver_id in self._walk_assignment_loop(recievers_by_giver, start_giver_id)
+		]
+		del assignment_ids_by_giver, recievers_by_giver
+		for chunk_start in range(0, len(ordered_ids), chunk_size):
+			chunk_ids = ordered_ids[chunk_start:chunk_start + chunk_size]
+			assignments = self._assignment_queryset().in_bulk(chunk_ids)
+			for assignment_id in chunk_ids:
+				yield assignments[assignment_id]
+
+	def assignments_page(self, page_number, per_page=ASSIGNMENTS_PER_PAGE):
+		""" One page of the assignment loop, in loop order
+			Positioned loops are fetched with a count and one indexed range query
+		"""
+		if self.assignments_positioned:
+			assignments = self._assignment_queryset().order_by('position')
+		else:
+			assignments = self.ordered_assignments
+		return Paginator(assignments, per_page).get_page(page_number)
 
 	def update(self, date, location, description, spending_limit, ship_gifts_allowed):
 		self.date = date
@@ -288,84 +548,247 @@ class GiftExchange(models.Model):
 			created = True
 		return giftexchange, created
 
-	def add_participant(self, appuser, delete_assignments=False):
+	def add_participant(self, appuser, delete_assignments=False, splice_assignments=False, status='invited'):
 		if delete_assignments:
 			ExchangeAssignment.objects.filter(giftexchange=self).delete()
-		new_participant, created = Participant.get_or_create(
+		new_participant, created = Participant.objects.get_or_create(
 			giftexchange=self,
-			appuser=appuser,
+			email=appuser.djangouser.email,
+			defaults={
+				'_appuser': appuser,
+				'first_name': appuser.djangouser.first_name,
+				'last_name': appuser.djangouser.last_name,
+				'status': status,
+			}
 		)
+		if splice_assignments and created and not delete_assignments:
+			self.splice_in_participant(new_participant)
 		return new_participant, created
 
 
-	def _generate_assignments(self):
-		starting_giver = self.participant_set.filter(status='active').order_by('?').first()
-		current_giver = starting_giver
+	def _excluded_pairs(self, participant_ids_by_email):
+		excluded_pairs = []
+		for exclusion in self.exclusionpair_set.all():
+			excluded_pairs.append((exclusion.giver_id, exclusion.reciever_id))
+			if exclusion.both_ways:
+				excluded_pairs.append((exclusion.reciever_id, exclusion.giver_id))
+		previous_pairs = ExchangeAssignment.objects.filter(
+			giftexchange__in=self.exclude_repeats_from.all()
+		).values_list('giver__email', 'reciever__email')
+		for giver_email, reciever_email in previous_pairs:
+			giver_id = participant_ids_by_email.get(giver_email)
+			reciever_id = participant_ids_by_email.get(reciever_email)
+			if giver_id and reciever_id:
+				excluded_pairs.append((giver_id, reciever_id))
+		return excluded_pairs
+
+	def _excluded_groups(self):
+		groups = {}
+		memberships = ExclusionGroup.members.through.objects.filter(
+			exclusiongroup__giftexchange=self
+		).values_list('exclusiongroup_id', 'participant_id')
+		for group_id, participant_id in memberships:
+			groups.setdefault(group_id, []).append(participant_id)
+		return list(groups.values())
+
+	def _exclusion_check(self):
+		""" Returns a function telling whether a giver may not give to a reciever
+			under this exchange's exclusion rules
+		"""
+		participant_ids_by_email = {
+			email: participant_id for participant_id, email in self.participant_set.values_list('pk', 'email')
+		}
+		excluded_pairs = set(self._excluded_pairs(participant_ids_by_email))
+		groups_by_participant = {}
+		for group_index, members in enumerate(self._excluded_groups()):
+			for participant_id in members:
+				groups_by_participant.setdefault(participant_id, set()).add(group_index)
+
+		def is_excluded(giver_id, reciever_id):
+			if giver_id == reciever_id or (giver_id, reciever_id) in excluded_pairs:
+				return True
+			giver_groups = groups_by_participant.get(giver_id)
+			return bool(giver_groups and giver_groups.intersection(groups_by_participant.get(reciever_id, ())))
+		return is_excluded
+
+	def _describe_participant(self, participant_id):
+		return Participant.objects.get(pk=participant_id).name
+
+	def _renumber_assignment_positions(self):
+		assignments = self.ordered_assignments
+		for index, assignment in enumerate(assignments):
+			assignment.position = index * ASSIGNMENT_POSITION_STEP
+		ExchangeAssignment.objects.bulk_update(
+			assignments,
+			['position'],
+			batch_size=bulk_batch_size(ExchangeAssignment, assignments, ASSIGNMENT_BATCH_SIZE)
+		)
 
-		participants = self.participant_set.filter(status='active').all()
-		assignments = []
-		reciever_appusers = [starting_giver, ]
-		while len(assignments) <= self.participant_set.filter(status='active').all().count() - 2:
-			exclusions = reciever_appusers + [current_giver]
-			random_reciever_qs = self.participant_set.filter(status='active').exclude(pk__in=[ex.pk for ex in exclusions])
-			random_reciever = random_reciever_qs.order_by('?').first()
+	def splice_in_participant(self, participant, rng=None):
+		""" Adds a participant to the existing assignment loop without regenerating it
 
-			if random_reciever:
-				assignments.append((current_giver, random_reciever))
-				reciever_appusers.append(random_reciever)
-				current_giver = random_reciever
+			A random link giver -> reciever that the exclusion rules allow is
+			replaced with giver -> participant -> reciever, so only one assignment
+			is updated and one is created. Only active participants are spliced
+			in, as only they are part of the loop.
 
-		final_giver = current_giver
-		assignments.append((final_giver, starting_giver))
+			Returns the givers whose assignment changed and who need a new email
+		"""
+		if participant.status != 'active':
+			return []
+		rng = rng or random
+		with transaction.atomic():
+			links = list(
+				self.exchangeassignment_set.select_for_update().order_by('position', 'pk').values_list(
+					'pk', 'giver_id', 'reciever_id', 'position'
+				)
+			)
+			if not links or any(giver_id == participant.pk for pk, giver_id, reciever_id, position in links):
+				return []
+			if any(position is None for pk, giver_id, reciever_id, position in links):
+				self._renumber_assignment_positions()
+				return self.splice_in_participant(participant, rng=rng)
+			is_excluded = self._exclusion_check()
+			link_indexes = list(range(len(links)))
+			rng.shuffle(link_indexes)
+			for link_index in link_indexes:
+				assignment_id, giver_id, reciever_id, position = links[link_index]
+				if not is_excluded(giver_id, participant.pk) and not is_excluded(participant.pk, reciever_id):
+					break
+			else:
+				raise AssignmentInfeasible([
+					'{} can not be added to the assignments without breaking an exclusion rule'.format(participant.name)
+				])
+
+			if link_index == len(links) - 1:
+				new_position = position + ASSIGNMENT_POSITION_STEP
+			else:
+				next_position = links[link_index + 1][3]
+				if next_position - position < 2:
+					self._renumber_assignment_positions()
+					return self.splice_in_participant(participant, rng=rng)
+				new_position = (position + next_position) // 2
+
+			self.exchangeassignment_set.filter(pk=assignment_id).update(reciever=participant, email_sent=False)
+			ExchangeAssignment.objects.create(
+				giftexchange=self,
+				giver=participant,
+				reciever_id=reciever_id,
+				position=new_position
+			)
+		return list(Participant.objects.filter(pk__in=[giver_id, participant.pk]).order_by('pk'))
+
+	def splice_out_participant(self, participant):
+		""" Closes the assignment loop around a participant that is leaving
+
+			giver -> participant -> reciever becomes giver -> reciever, so only
+			one assignment is updated and one is deleted. Participant.delete
+			calls this, call it first to find out who needs a new email. Raises
+			AssignmentInfeasible if the exclusion rules do not allow
+			giver -> reciever.
+
+			Returns the givers whose assignment changed and who need a new email
+		"""
+		with transaction.atomic():
+			outgoing = self.exchangeassignment_set.select_for_update().filter(giver=participant).first()
+			incoming = self.exchangeassignment_set.select_for_update().filter(reciever=participant).first()
+			if not outgoing or not incoming:
+				return []
+			if incoming.giver_id == outgoing.reciever_id:
+				# only one person would be left in the loop
+				self.exchangeassignment_set.all().delete()
+				return []
+			if self._exclusion_check()(incoming.giver_id, outgoing.reciever_id):
+				raise AssignmentInfeasible([
+					'{} can not give to {} without breaking an exclusion rule'.format(
+						incoming.giver.name, outgoing.reciever.name
+					)
+				])
+			outgoing.delete()
+			incoming.reciever_id = outgoing.reciever_id
+			incoming.email_sent = False
+			incoming.save()
+		return [incoming.giver]
+
+	def _assignment_rules(self):
+		""" Active participant ids, excluded (giver_id, reciever_id) pairs and exclusion groups
+		"""
+		participants = list(self.participant_set.filter(status='active').order_by('pk').values_list('pk', 'email'))
+		participant_ids_by_email = {email: participant_id for participant_id, email in participants}
+		participant_ids = [participant_id for participant_id, email in participants]
+		return participant_ids, self._excluded_pairs(participant_ids_by_email), self._excluded_groups()
+
+	def _generate_assignments(self, rng=None):
+		participant_ids, excluded_pairs, excluded_groups = self._assignment_rules()
+		assignments = build_constrained_assignment_cycle(
+			participant_ids,
+			excluded_pairs=excluded_pairs,
+			excluded_groups=excluded_groups,
+			rng=rng,
+			describe=self._describe_participant
+		)
+		violations = verify_assignments(assignments, participant_ids, excluded_pairs, excluded_groups)
+		if violations:
+			raise AssignmentError([
+				'Generated assignments failed verification: {}'.format(violation.message) for violation in violations
+			])
 		return assignments
 
-	def _verify_closed_loop(self, assignments):
-		def _get_reciever_for_participant(qgiver, assignments):
-			for giver, reciever in assignments:
-				if giver == qgiver:
-					return reciever
-
-		# print('Checking loop is closed....')
-		loop_is_closed = False
-		expected_connection_count = len(assignments)
-		checked_recievers = []
-		first_giver = assignments[0][0]
-		first_reciever = assignments[0][1]
-
-		giver = first_giver
-		reciever = first_reciever
-		while first_giver not in checked_recievers:
-			# print('{} gives to {}'.format(giver, reciever))
-			checked_recievers.append(reciever)
-			giver = reciever
-			reciever = _get_reciever_for_participant(giver, assignments)
-
-		loop_is_closed = len(checked_recievers) == expected_connection_count
-		return loop_is_closed
-
-	def generate_assignemnts(self, override_lock=False):
+	def audit_assignments(self, assignments=None):
+		""" Checks an assignment set against the active participants and exclusion rules
+
+			Defaults to the stored assignments. Returns a list of
+			AssignmentViolation, empty if the set is a valid single loop
+		"""
+		if assignments is None:
+			assignments = list(self.exchangeassignment_set.values_list('giver_id', 'reciever_id'))
+		participant_ids, excluded_pairs, excluded_groups = self._assignment_rules()
+		names = {}
+
+		def describe(participant_id):
+			if not names:
+				names.update(
+					(participant_id, '{} {}'.format(first_name, last_name))
+					for participant_id, first_name, last_name in self.participant_set.values_list('pk', 'first_name', 'last_name')
+				)
+			return names.get(participant_id, '#{}'.format(participant_id))
+		return verify_assignments(assignments, participant_ids, excluded_pairs, excluded_groups, describe=describe)
+
+	def generate_assignemnts(self, override_lock=False, seed=None):
+		""" Generates and saves a new assignment loop
+
+			The loop is driven by a PRNG seed which is stored on the gift exchange,
+			so passing the stored seed back in regenerates the same loop as long as
+			the active participants and exclusion rules have not changed
+		"""
 		if self.assignments_locked and not override_lock:
-			raise Exception('Assignments are locked for this gift exchange')
-		# print('Removing old assignments...')
-		self.exchangeassignment_set.all().delete()
-		# print('Making assignments...')
-		loop_is_closed = False
-		tries = 0
-		while not loop_is_closed:
-			assignments = self._generate_assignments()
-			loop_is_closed = self._verify_closed_loop(assignments)
-			tries += 1
-
-		# print("Took {} tries".format(tries))
-		assignment_objects = []
-		for giver_participant, reciever_participant in assignments:
-			new_assignment = ExchangeAssignment(
+			raise AssignmentError(['Assignments are locked for this gift exchange'])
+		if seed is None:
+			seed = random.SystemRandom().getrandbits(63)
+		assignments = self._generate_assignments(rng=random.Random(seed))
+		with transaction.atomic():
+			assignment_objects = self._save_assignments(assignments)
+			self.assignment_seed = seed
+			self.save(update_fields=['assignment_seed'])
+		return assignment_objects
+
+	def _save_assignments(self, assignments):
+		""" Replaces the current assignment set with the given (giver_id, reciever_id) loop
+		"""
+		assignment_objects = [
+			ExchangeAssignment(
 				giftexchange=self,
-				giver=giver_participant,
-				reciever=reciever_participant
+				giver_id=giver_id,
+				reciever_id=reciever_id,
+				position=index * ASSIGNMENT_POSITION_STEP
+			) for index, (giver_id, reciever_id) in enumerate(assignments)
+		]
+		with transaction.atomic():
+			self.exchangeassignment_set.all().delete()
+			assignment_objects = ExchangeAssignment.objects.bulk_create(
+				assignment_objects,
+				batch_size=bulk_batch_size(ExchangeAssignment, assignment_objects, ASSIGNMENT_BATCH_SIZE)
 			)
-			new_assignment.save()
-			assignment_objects.append(new_assignment)
 		return assignment_objects
 
 
@@ -373,7 +796,7 @@ class GiftExchange(models.Model):
 		return self.title
 
 
-class Participant(models.Model):
+class Participant(EmailFieldsTracker, models.Model):
 	giftexchange = models.ForeignKey(GiftExchange, on_delete=models.CASCADE)
 	_appuser = models.ForeignKey(AppUser, blank=True, null=True, on_delete=models.CASCADE)
 	status = models.CharField(
@@ -395,6 +818,13 @@ class Participant(models.Model):
 	additional_info = models.TextField(blank=True, null=True)
 	gift = models.TextField(blank=True, null=True)
 
+	EMAIL_FIELDS = ('_appuser_id', 'first_name', 'last_name', 'email') + tuple(PARTICIPANT_OPTIONAL_FIELDS)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['giftexchange', 'email']),
+		]
+
 	@property
 	def name(self):
 		return '{} {}'.format(self.first_name, self.last_name)
@@ -412,6 +842,25 @@ class Participant(models.Model):
 			return self._appuser
 
 
+	def save(self, *args, **kwargs):
+		email_fields_changed = self.email_fields_changed(kwargs.get('update_fields'))
+		super(Participant, self).save(*args, **kwargs)
+		if email_fields_changed:
+			GiftExchange.bump_email_version(GiftExchange.objects.filter(pk=self.giftexchange_id))
+		self._remember_email_fields()
+
+	def delete(self, *args, **kwargs):
+		""" Closes the assignment loop around the participant before their
+			assignments cascade, clearing the assignments if the exclusion rules
+			do not allow the loop to be closed
+		"""
+		with transaction.atomic():
+			try:
+				self.giftexchange.splice_out_participant(self)
+			except AssignmentInfeasible:
+				self.giftexchange.exchangeassignment_set.all().delete()
+			return super(Participant, self).delete(*args, **kwargs)
+
 	@property
 	def get_shipping_address(self):
 		return self.shipping_address or self.appuser.default_shipping_address
@@ -463,18 +912,113 @@ class Participant(models.Model):
 		participant.save()
 		return participant, created
 
+	@classmethod
+	def bulk_upsert(cls, giftexchange, rows, status='active'):
+		""" Creates or updates a batch of participants, matched on email ignoring case
+
+			rows are dicts of participant field values. As in patch, first and
+			last names are always set while blank optional values leave what is
+			already stored alone. The existing participants are fetched in one
+			query, through the (giftexchange_id, LOWER(email)) index added in
+			migration 0016, and written with bulk_create and bulk_update in one
+			transaction. New participants keep their email as it was typed.
+
+			Returns a dict of created, updated and unchanged counts
+		"""
+		emails = set(row['email'].lower() for row in rows)
+		existing = {}
+		matches = cls.objects.annotate(email_lower=Lower('email')).filter(giftexchange=giftexchange, email_lower__in=emails)
+		for participant in matches.order_by('pk'):
+			existing.setdefault(participant.email_lower, participant)
+		new_participants = {}
+		changed = {}
+		for row in rows:
+			email_key = row['email'].lower()
+			participant = existing.get(email_key) or new_participants.get(email_key)
+			if participant is None:
+				participant = new_participants[email_key] = cls(giftexchange=giftexchange, email=row['email'])
+			values = {'first_name': row['first_name'], 'last_name': row['last_name']}
+			for field_name in PARTICIPANT_OPTIONAL_FIELDS:
+				if row.get(field_name):
+					values[field_name] = row[field_name]
+			if status:
+				values['status'] = status
+			for field_name, value in values.items():
+				if getattr(participant, field_name) != value:
+					setattr(participant, field_name, value)
+					if participant.pk:
+						changed[participant.pk] = participant
+
+		new_participants = list(new_participants.values())
+		changed_participants = list(changed.values())
+		with transaction.atomic():
+			cls.objects.bulk_create(
+				new_participants,
+				batch_size=bulk_batch_size(cls, new_participants, ASSIGNMENT_BATCH_SIZE)
+			)
+			cls.objects.bulk_update(
+				changed_participants,
+				PARTICIPANT_UPSERT_FIELDS,
+				batch_size=bulk_batch_size(cls, changed_participants, ASSIGNMENT_BATCH_SIZE)
+			)
+			if new_participants or changed_participants:
+				GiftExchange.bump_email_version(GiftExchange.objects.filter(pk=giftexchange.pk))
+		return {
+			'created': len(new_participants),
+			'updated': len(changed_participants),
+			'unchanged': len(existing) - len(changed_participants),
+		}
+
 	def __str__(self):
 		return '{} // {}'.format(self.giftexchange.title, self.name)
 
 
+class ExclusionPair(models.Model):
+	""" Two participants that should not be assigned to each other
+		e.g., spouses, or someone who drew the same person three years running
+	"""
+	giftexchange = models.ForeignKey(GiftExchange, on_delete=models.CASCADE)
+	giver = models.ForeignKey(Participant, on_delete=models.CASCADE, related_name='exclusion_giver')
+	reciever = models.ForeignKey(Participant, on_delete=models.CASCADE, related_name='exclusion_reciever')
+	both_ways = models.BooleanField(default=True)
+
+	class Meta:
+		unique_together = ['giftexchange', 'giver', 'reciever']
+
+	def __str__(self):
+		return '{} // {} {} {}'.format(
+			self.giftexchange,
+			self.giver.name,
+			'<-/->' if self.both_ways else '-/->',
+			self.reciever.name,
+		)
+
+
+class ExclusionGroup(models.Model):
+	""" Participants that should not gift within the group, e.g., a household or team
+	"""
+	giftexchange = models.ForeignKey(GiftExchange, on_delete=models.CASCADE)
+	name = models.CharField(max_length=100)
+	members = models.ManyToManyField(Participant, blank=True)
+
+	def __str__(self):
+		return '{} // {}'.format(self.giftexchange, self.name)
+
+
 class ExchangeAssignment(models.Model):
 	giftexchange = models.ForeignKey(GiftExchange, on_delete=models.CASCADE)
 	giver = models.ForeignKey(Participant, on_delete=models.CASCADE, related_name='giftexchange_giver')
 	reciever = models.ForeignKey(Participant, on_delete=models.CASCADE, related_name='giftexchange_reciever')
 	email_sent = models.BooleanField(default=False)
+	position = models.PositiveIntegerField(blank=True, null=True)
+	delivery_status = models.CharField(max_length=20, blank=True, null=True, choices=DELIVERY_STATUS_CHOICES)
+	delivery_status_at = models.DateTimeField(blank=True, null=True)
 
 	class Meta:
 		unique_together = ['giftexchange', 'giver', 'reciever']
+		indexes = [
+			models.Index(fields=['giftexchange', 'position']),
+		]
 
 	def __str__(self):
 		return '{} // {} {} -> {} {}'.format(
@@ -485,41 +1029,27 @@ class ExchangeAssignment(models.Model):
 			self.reciever.last_name,
 		)
 
-	def send_assignment_email(self):
-		subject = 'You have been given an assignment for "{}"'.format(self.giftexchange.title)
-		formatted_body = render_to_string(
-			'giftexchange/emails/assignment_email.html',
-			context={
-				'giver': self.giver,
-				'assignment': self.reciever,
-				'giftexchange': self.giftexchange
-			}
-		)
-		email = send_email(
-		    subject=subject,
-		    html_body=formatted_body,
-		    to_emails=self.giver.email,
+	def build_assignment_email(self, job_id, email_vars=None):
+		""" Unsaved outbox entry for this assignment's email, for bulk queueing
+		"""
+		email_vars = email_vars or self.render_assignment_email()
+		return OutboundEmail(
+			job_id=job_id,
+			to_email=email_vars['to_email'],
+			subject=email_vars['subject'],
+			html_body=email_vars['html_body'],
+			assignment=self
 		)
-		self.email_sent = True
-		self.save()
+
+	def send_assignment_email(self, job_id=None):
+		""" Queues the assignment email, email_sent is set once the outbox worker delivers it
+		"""
+		outbound_email = self.build_assignment_email(job_id or new_email_job_id())
+		outbound_email.save()
+		return outbound_email
 
 	def render_assignment_email(self):
-		subject = 'You have been given an assignment for "{}"'.format(self.giftexchange.title)
-		formatted_body = render_to_string(
-			'giftexchange/emails/assignment_email.html',
-			context={
-				'giver': self.giver,
-				'assignment': self.reciever,
-				'giftexchange': self.giftexchange
-			}
-		)
-		email_vars = {
-		    'subject': subject,
-		    'html_body': formatted_body,
-		    'to_email': self.giver.email,
-		    'from_email': settings.FROM_ADDRESS
-		}
-		return email_vars
+		return AssignmentEmailRenderer(self.giftexchange).render(self)
 
 
 class AdminInvitation(models.Model):
@@ -604,3 +1134,650 @@ class AppInvitation(models.Model):
 		)
 		self.status = 'sent'
 		self.save()
+
+
+class OutboundEmail(models.Model):
+	""" Outbox of emails waiting to be delivered by the send_queued_emails worker
+	"""
+	job_id = models.CharField(max_length=32, db_index=True)
+	to_email = models.EmailField()
+	subject = models.CharField(max_length=500)
+	html_body = models.TextField()
+	assignment = models.ForeignKey(ExchangeAssignment, blank=True, null=True, on_delete=models.SET_NULL)
+	status = models.CharField(
+		max_length=10,
+		default='pending',
+		choices=[
+			('pending', 'pending'),
+			('sent', 'sent'),
+			('failed', 'failed'),
+		]
+	)
+	attempts = models.PositiveIntegerField(default=0)
+	next_attempt_at = models.DateTimeField(default=timezone.now)
+	last_error = models.TextField(blank=True, null=True)
+	created_at = models.DateTimeField(auto_now_add=True)
+	sent_at = models.DateTimeField(blank=True, null=True)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['status', 'next_attempt_at']),
+		]
+
+	def __str__(self):
+		return '{} // {} ({})'.format(self.to_email, self.subject, self.status)
+
+	@staticmethod
+	def retry_delay(attempts):
+		return timedelta(seconds=min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_SECONDS))
+
+	@classmethod
+	def claim_due(cls, batch_size):
+		""" Claims up to batch_size due emails for this worker
+
+			Claimed emails are pushed OUTBOX_CLAIM_SECONDS into the future so
+			other workers skip them, and become due again if this worker dies
+			before delivering them
+		"""
+		now = timezone.now()
+		with transaction.atomic():
+			emails = list(
+				cls.objects.select_for_update(skip_locked=True).filter(
+					status='pending',
+					next_attempt_at__lte=now
+				).order_by('next_attempt_at', 'pk')[:batch_size]
+			)
+			for email in emails:
+				email.attempts += 1
+				email.next_attempt_at = now + timedelta(seconds=OUTBOX_CLAIM_SECONDS)
+			cls.objects.bulk_update(emails, ['attempts', 'next_attempt_at'])
+		return emails
+
+	@classmethod
+	def send_due(cls, batch_size=1000, max_attempts=5):
+		""" Delivers one batch of due emails
+
+			Emails go out through send_email_batch, so a batch costs a few
+			provider requests rather than one per email. A request the provider
+			rejects is split until only the offending emails fail. Failed emails are
+			retried with exponential backoff and marked failed after
+			max_attempts. Assignments are flagged email_sent only once their
+			email is delivered.
+
+			Returns the number of emails claimed
+		"""
+		emails = cls.claim_due(batch_size)
+		if not emails:
+			return 0
+		errors = {email.pk: error for email, error in send_email_batch(emails)}
+		delivered = []
+		for email in emails:
+			if email.pk in errors:
+				email.last_error = str(errors[email.pk])
+				if email.attempts >= max_attempts or isinstance(errors[email.pk], EmailSuppressed):
+					email.status = 'failed'
+				else:
+					email.next_attempt_at = timezone.now() + cls.retry_delay(email.attempts)
+			else:
+				email.status = 'sent'
+				email.sent_at = timezone.now()
+				email.last_error = None
+				delivered.append(email)
+		with transaction.atomic():
+			cls.objects.bulk_update(emails, ['status', 'next_attempt_at', 'last_error', 'sent_at'])
+			ExchangeAssignment.objects.filter(
+				pk__in=[email.assignment_id for email in delivered if email.assignment_id]
+			).update(email_sent=True)
+		return len(emails)
+
+
+class EmailSendRun(models.Model):
+	""" One "send all assignment emails" run for a gift exchange
+
+		Assignment emails are queued in chunks ordered by assignment pk, and
+		`cursor` records the last assignment queued so an interrupted run picks
+		up where it stopped. Assignments whose email was already sent, or is
+		already waiting in the outbox, are skipped.
+	"""
+	giftexchange = models.ForeignKey(GiftExchange, on_delete=models.CASCADE)
+	job_id = models.CharField(max_length=32, unique=True, default=new_email_job_id)
+	status = models.CharField(
+		max_length=10,
+		default='queuing',
+		choices=[
+			('queuing', 'queuing'),
+			('queued', 'queued'),
+			('completed', 'completed'),
+			('failed', 'failed'),
+		]
+	)
+	cursor = models.PositiveIntegerField(default=0)
+	total_count = models.PositiveIntegerField(default=0)
+	queued_count = models.PositiveIntegerField(default=0)
+	skipped_count = models.PositiveIntegerField(default=0)
+	created_at = models.DateTimeField(auto_now_add=True)
+	updated_at = models.DateTimeField(auto_now=True)
+
+	def __str__(self):
+		return '{} // {} ({})'.format(self.giftexchange.title, self.job_id, self.status)
+
+	@classmethod
+	def start(cls, giftexchange):
+		""" Returns the exchange's interrupted run if there is one, otherwise a new run
+			The exchange row is locked so two starts can not both create a run
+		"""
+		with transaction.atomic():
+			GiftExchange.objects.select_for_update().filter(pk=giftexchange.pk).first()
+			run = cls.objects.filter(giftexchange=giftexchange, status='queuing').order_by('-pk').first()
+			if not run:
+				run = cls.objects.create(
+					giftexchange=giftexchange,
+					total_count=giftexchange.exchangeassignment_set.filter(giver__status='active').count()
+				)
+		return run
+
+	def enqueue(self, chunk_size=ASSIGNMENT_BATCH_SIZE, on_progress=None):
+		""" Queues assignment emails from the cursor onwards
+			on_progress(done, total) is called after each chunk
+
+			Each chunk locks the run, re-reading its cursor, and the chunk's
+			assignments before checking the outbox, so jobs enqueueing at the
+			same time never queue the same assignment twice
+		"""
+		queryset = self.giftexchange._assignment_queryset().filter(giver__status='active').order_by('pk')
+		renderer = AssignmentEmailRenderer(self.giftexchange)
+		while True:
+			with transaction.atomic():
+				run = EmailSendRun.objects.select_for_update().get(pk=self.pk)
+				self.cursor, self.queued_count, self.skipped_count = run.cursor, run.queued_count, run.skipped_count
+				assignments = list(queryset.select_for_update(of=('self',)).filter(pk__gt=self.cursor)[:chunk_size])
+				if not assignments:
+					break
+				already_queued = set(OutboundEmail.objects.filter(
+					assignment__in=assignments,
+					status='pending'
+				).values_list('assignment_id', flat=True))
+				to_queue = []
+				for assignment in assignments:
+					if not assignment.email_sent and not assignment.pk in already_queued:
+						assignment.giftexchange = self.giftexchange
+						to_queue.append(assignment)
+				outbound_emails = [
+					assignment.build_assignment_email(self.job_id, email_vars)
+					for assignment, email_vars in zip(to_queue, renderer.render_many(to_queue))
+				]
+				OutboundEmail.objects.bulk_create(
+					outbound_emails,
+					batch_size=bulk_batch_size(OutboundEmail, outbound_emails, ASSIGNMENT_BATCH_SIZE)
+				)
+				self.cursor = assignments[-1].pk
+				self.queued_count += len(outbound_emails)
+				self.skipped_count += len(assignments) - len(outbound_emails)
+				self.save(update_fields=['cursor', 'queued_count', 'skipped_count', 'updated_at'])
+			if on_progress:
+				on_progress(self.queued_count + self.skipped_count, self.total_count)
+		self.status = 'queued'
+		self.save(update_fields=['status', 'updated_at'])
+
+	@property
+	def is_interrupted(self):
+		""" Whether the run can be resumed: it failed, or stopped queueing, and
+			no job is waiting to queue its emails or holds a live lease on them
+		"""
+		if self.status not in ('queuing', 'failed'):
+			return False
+		active_jobs = Job.objects.filter(giftexchange_id=self.giftexchange_id, kind__in=EMAIL_SEND_JOB_KINDS).filter(
+			Q(status='queued') | Q(status='running', locked_until__gte=timezone.now())
+		)
+		return not active_jobs.exists()
+
+	def resume(self, on_progress=None):
+		""" Finishes queueing an interrupted run, or re-queues the failed emails
+			of a failed run whose assignments still have not been sent
+		"""
+		if self.status == 'queuing':
+			self.enqueue(on_progress=on_progress)
+		elif self.status == 'failed':
+			self.outbound_emails().filter(status='failed').exclude(assignment__email_sent=True).update(
+				status='pending',
+				attempts=0,
+				next_attempt_at=timezone.now(),
+				last_error=None
+			)
+			self.status = 'queued'
+			self.save(update_fields=['status', 'updated_at'])
+
+	def outbound_emails(self):
+		return OutboundEmail.objects.filter(job_id=self.job_id)
+
+	def progress(self):
+		""" Delivery counts for the run, also moving a queued run to completed
+			or failed once the outbox has no pending emails left for it
+		"""
+		counts = {'pending': 0, 'sent': 0, 'failed': 0}
+		for status_counts in self.outbound_emails().values('status').annotate(count=models.Count('pk')):
+			counts[status_counts['status']] = status_counts['count']
+		if self.status == 'queued' and not counts['pending']:
+			self.status = 'failed' if counts['failed'] else 'completed'
+			self.save(update_fields=['status', 'updated_at'])
+		done_count = self.skipped_count + counts['sent']
+		return {
+			'job_id': self.job_id,
+			'status': self.status,
+			'total': self.total_count,
+			'queued': self.queued_count,
+			'skipped': self.skipped_count,
+			'pending': counts['pending'],
+			'sent': counts['sent'],
+			'failed': counts['failed'],
+			'percent': int(100 * done_count / self.total_count) if self.total_count else 100,
+			'resumable': self.is_interrupted,
+		}
+
+
+class EmailDeliveryStatus(models.Model):
+	""" Latest delivery event the email provider reported for each recipient
+	"""
+	email = models.EmailField(unique=True)
+	status = models.CharField(max_length=20, choices=DELIVERY_STATUS_CHOICES)
+	reason = models.TextField(blank=True, null=True)
+	event_at = models.DateTimeField()
+	updated_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		verbose_name_plural = 'email delivery statuses'
+
+	def __str__(self):
+		return '{} // {}'.format(self.email, self.status)
+
+	@staticmethod
+	def _parse_event(event):
+		""" Returns (email, event_at, status, reason, assignment_id, outbound_email_id)
+			for a tracked webhook event, or None for untracked and malformed events
+		"""
+		if not isinstance(event, dict) or event.get('event') not in dict(DELIVERY_STATUS_CHOICES):
+			return None
+		email = event.get('email')
+		if not email or not isinstance(email, str):
+			return None
+		reason = event.get('reason')
+		try:
+			event_at = datetime.fromtimestamp(int(event.get('timestamp') or 0), tz=timezone.utc)
+			assignment_id = int(event['assignment_id']) if event.get('assignment_id') else None
+			outbound_email_id = int(event['outbound_email_id']) if event.get('outbound_email_id') else None
+		except (TypeError, ValueError, OverflowError, OSError):
+			return None
+		return email.lower(), event_at, event['event'], str(reason) if reason is not None else None, assignment_id, outbound_email_id
+
+	@staticmethod
+	def _latest_events(events):
+		""" Reduces a payload to the latest tracked event per recipient and per
+			assignment, so each row is written at most once per payload, and
+			collects hard bounced and complaining addresses to suppress.
+			Malformed events are skipped so one bad event cannot fail the batch.
+		"""
+		latest_by_email = {}
+		latest_by_assignment = {}
+		outbound_email_ids = {}
+		to_suppress = {}
+		for event in events:
+			parsed = EmailDeliveryStatus._parse_event(event)
+			if parsed is None:
+				continue
+			email, event_at, status, reason, assignment_id, outbound_email_id = parsed
+			update = (event_at, status, reason)
+			if status in SUPPRESSING_EVENTS and event.get('type') != 'blocked':
+				to_suppress[email] = status
+			if email not in latest_by_email or latest_by_email[email][0] <= event_at:
+				latest_by_email[email] = update
+			if assignment_id is not None:
+				if assignment_id not in latest_by_assignment or latest_by_assignment[assignment_id][0] <= event_at:
+					latest_by_assignment[assignment_id] = update
+			elif outbound_email_id is not None:
+				outbound_email_ids[outbound_email_id] = update
+		if outbound_email_ids:
+			assignment_ids = OutboundEmail.objects.filter(
+				pk__in=outbound_email_ids.keys(),
+				assignment__isnull=False
+			).values_list('pk', 'assignment_id')
+			for outbound_email_id, assignment_id in assignment_ids:
+				update = outbound_email_ids[outbound_email_id]
+				if assignment_id not in latest_by_assignment or latest_by_assignment[assignment_id][0] <= update[0]:
+					latest_by_assignment[assignment_id] = update
+		return latest_by_email, latest_by_assignment, to_suppress
+
+	@classmethod
+	def apply_events(cls, events):
+		""" Applies a batch of provider webhook events with a fixed number of
+			bulk queries however many events there are. Events older than the
+			status already stored are ignored, so batches may arrive out of order.
+
+			Returns the number of recipient statuses written
+		"""
+		latest_by_email, latest_by_assignment, to_suppress = cls._latest_events(events)
+		with transaction.atomic():
+			SuppressedEmail.suppress(to_suppress)
+			existing = cls.objects.in_bulk(latest_by_email.keys(), field_name='email')
+			created = []
+			updated = []
+			for email, (event_at, status, reason) in latest_by_email.items():
+				delivery_status = existing.get(email)
+				if delivery_status is None:
+					created.append(cls(email=email, status=status, reason=reason, event_at=event_at))
+				elif delivery_status.event_at <= event_at:
+					delivery_status.status = status
+					delivery_status.reason = reason
+					delivery_status.event_at = event_at
+					delivery_status.updated_at = timezone.now()
+					updated.append(delivery_status)
+			cls.objects.bulk_create(created, batch_size=bulk_batch_size(cls, created, ASSIGNMENT_BATCH_SIZE))
+			cls.objects.bulk_update(
+				updated,
+				['status', 'reason', 'event_at', 'updated_at'],
+				batch_size=bulk_batch_size(cls, updated, ASSIGNMENT_BATCH_SIZE)
+			)
+
+			assignments = ExchangeAssignment.objects.filter(pk__in=latest_by_assignment.keys()).only(
+				'pk', 'delivery_status', 'delivery_status_at'
+			)
+			changed_assignments = []
+			for assignment in assignments:
+				event_at, status, reason = latest_by_assignment[assignment.pk]
+				if assignment.delivery_status_at is None or assignment.delivery_status_at <= event_at:
+					assignment.delivery_status = status
+					assignment.delivery_status_at = event_at
+					changed_assignments.append(assignment)
+			ExchangeAssignment.objects.bulk_update(
+				changed_assignments,
+				['delivery_status', 'delivery_status_at'],
+				batch_size=bulk_batch_size(ExchangeAssignment, changed_assignments, ASSIGNMENT_BATCH_SIZE)
+			)
+		return len(created) + len(updated)
+
+
+class SuppressedEmail(models.Model):
+	""" Addresses emails are never sent to, checked through the in-process
+		suppressed_emails set rather than queried per send
+	"""
+	email = models.EmailField(unique=True)
+	reason = models.CharField(
+		max_length=10,
+		default='manual',
+		choices=[
+			('bounce', 'bounce'),
+			('complaint', 'complaint'),
+			('manual', 'manual'),
+		]
+	)
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	def __str__(self):
+		return '{} ({})'.format(self.email, self.reason)
+
+	def save(self, *args, **kwargs):
+		self.email = self.email.lower()
+		super(SuppressedEmail, self).save(*args, **kwargs)
+
+	@classmethod
+	def suppress(cls, events_by_email):
+		""" Suppresses addresses from a {email: webhook event} dict
+		"""
+		suppressions = [cls(email=email, reason=SUPPRESSING_EVENTS[event]) for email, event in events_by_email.items()]
+		cls.objects.bulk_create(
+			suppressions,
+			batch_size=bulk_batch_size(cls, suppressions, ASSIGNMENT_BATCH_SIZE),
+			ignore_conflicts=True
+		)
+		suppressed_emails.add(events_by_email.keys())
+
+
+@receiver([post_save, post_delete], sender=SuppressedEmail)
+def reload_suppressed_emails(**kwargs):
+	""" Edits made in this process, e.g. from the django admin, apply straight
+		away, other processes pick them up on their next refresh
+	"""
+	suppressed_emails.invalidate()
+
+
+class Job(models.Model):
+	""" A slow admin action run outside the request by the run_workers command
+
+		Workers claim queued jobs with select_for_update(skip_locked=True) and
+		hold a lease on them until locked_until. Progress updates renew the
+		lease, and a job whose worker died becomes claimable again once its
+		lease runs out.
+	"""
+	kind = models.CharField(max_length=50)
+	giftexchange = models.ForeignKey(GiftExchange, blank=True, null=True, on_delete=models.CASCADE)
+	params = models.TextField(default='{}')
+	status = models.CharField(
+		max_length=10,
+		default='queued',
+		choices=[
+			('queued', 'queued'),
+			('running', 'running'),
+			('succeeded', 'succeeded'),
+			('failed', 'failed'),
+		]
+	)
+	progress = models.PositiveIntegerField(default=0)
+	total = models.PositiveIntegerField(blank=True, null=True)
+	message = models.CharField(max_length=500, blank=True, null=True)
+	result = models.TextField(blank=True, null=True)
+	error = models.TextField(blank=True, null=True)
+	attempts = models.PositiveIntegerField(default=0)
+	locked_until = models.DateTimeField(blank=True, null=True)
+	created_at = models.DateTimeField(auto_now_add=True)
+	started_at = models.DateTimeField(blank=True, null=True)
+	finished_at = models.DateTimeField(blank=True, null=True)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['status', 'created_at']),
+		]
+
+	def __str__(self):
+		return '{} #{} ({})'.format(self.kind, self.pk, self.status)
+
+	@property
+	def label(self):
+		return self.kind.replace('_', ' ').capitalize()
+
+	@property
+	def is_finished(self):
+		return self.status in ('succeeded', 'failed')
+
+	def get_params(self):
+		return json.loads(self.params)
+
+	def get_result(self):
+		return json.loads(self.result) if self.result else None
+
+	@classmethod
+	def claim_next(cls):
+		""" Claims the oldest runnable job, or returns None if there is none
+
+			Jobs whose workers stopped responding JOB_MAX_ATTEMPTS times are
+			marked failed rather than claimed again
+		"""
+		while True:
+			now = timezone.now()
+			with transaction.atomic():
+				job = cls.objects.select_for_update(skip_locked=True).filter(
+					Q(status='queued') | Q(status='running', locked_until__lt=now)
+				).order_by('created_at', 'pk').first()
+				if not job:
+					return None
+				if job.attempts >= JOB_MAX_ATTEMPTS:
+					job.finish(error='The worker running this job stopped responding {} times'.format(job.attempts))
+					continue
+				job.start()
+				return job
+
+	def start(self):
+		now = timezone.now()
+		self.status = 'running'
+		self.attempts += 1
+		self.started_at = now
+		self.locked_until = now + timedelta(seconds=JOB_LEASE_SECONDS)
+		self.save(update_fields=['status', 'attempts', 'started_at', 'locked_until'])
+
+	def set_progress(self, progress, total=None, message=None):
+		""" Records progress and renews the worker's lease on the job
+		"""
+		self.progress = progress
+		if total is not None:
+			self.total = total
+		if message is not None:
+			self.message = message
+		self.locked_until = timezone.now() + timedelta(seconds=JOB_LEASE_SECONDS)
+		self.save(update_fields=['progress', 'total', 'message', 'locked_until'])
+
+	def finish(self, result=None, error=None):
+		self.status = 'failed' if error else 'succeeded'
+		self.result = json.dumps(result) if result is not None else None
+		self.error = error
+		self.locked_until = None
+		self.finished_at = timezone.now()
+		self.save(update_fields=['status', 'result', 'error', 'locked_until', 'finished_at'])
+
+	def as_dict(self):
+		""" Status and progress, with a rate and ETA once the job is running
+		"""
+		rate = None
+		eta_seconds = None
+		if self.started_at and self.progress:
+			elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+			if elapsed > 0:
+				rate = self.progress / elapsed
+				if self.total and not self.is_finished:
+					eta_seconds = max(self.total - self.progress, 0) / rate
+		return {
+			'id': self.pk,
+			'kind': self.kind,
+			'status': self.status,
+			'progress': self.progress,
+			'total': self.total,
+			'percent': int(100 * self.progress / self.total) if self.total else (100 if self.is_finished else 0),
+			'rate': rate,
+			'eta_seconds': eta_seconds,
+			'message': self.message,
+			'error': self.error,
+			'result': self.get_result(),
+		}
+
+
+class ParticipantImport(models.Model):
+	""" A CSV file of participants uploaded to a gift exchange and imported by
+		an import_participants job
+
+		The upload is stored as it arrived in ParticipantImportChunk rows, so
+		neither the request nor the job ever holds the whole file, and the
+		chunks are deleted once the file has been imported. Rows that can not be
+		imported are kept as ParticipantImportRowError for the error report.
+	"""
+	giftexchange = models.ForeignKey(GiftExchange, on_delete=models.CASCADE)
+	job = models.ForeignKey(Job, blank=True, null=True, on_delete=models.SET_NULL)
+	filename = models.CharField(max_length=255)
+	line_count = models.PositiveIntegerField(default=0)
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	def __str__(self):
+		return '{} // {}'.format(self.giftexchange.title, self.filename)
+
+	@classmethod
+	def receive(cls, giftexchange, uploaded_file):
+		""" Stores an uploaded file chunk by chunk, counting its lines for progress reports
+		"""
+		with transaction.atomic():
+			participant_import = cls.objects.create(giftexchange=giftexchange, filename=uploaded_file.name[:255])
+			line_count = 0
+			last_chunk = b''
+			for index, data in enumerate(uploaded_file.chunks()):
+				ParticipantImportChunk.objects.create(participant_import=participant_import, index=index, data=data)
+				line_count += data.count(b'\n')
+				last_chunk = data
+			if last_chunk and not last_chunk.endswith(b'\n'):
+				line_count += 1
+			participant_import.line_count = line_count
+			participant_import.save(update_fields=['line_count'])
+		return participant_import
+
+	def chunks(self):
+		for data in self.participantimportchunk_set.order_by('index').values_list('data', flat=True).iterator(chunk_size=16):
+			yield bytes(data)
+
+	def run(self, batch_size=IMPORT_BATCH_SIZE, on_progress=None):
+		""" Imports the stored file in batches with Participant.bulk_upsert
+
+			Rows with a missing name, a bad email or an email repeated earlier in
+			the file are recorded as row errors instead of stopping the import.
+			A file that can not be read at all raises ParticipantImportError and
+			is discarded. Any other error keeps the stored file, so a retried job
+			imports it again from the start.
+
+			Returns a dict of created, updated, unchanged and failed counts
+		"""
+		self.participantimportrowerror_set.all().delete()
+		counts = {'created': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+		seen_emails = set()
+		try:
+			reader = ParticipantCSVReader(self.chunks())
+			for batch in batched(reader.numbered_rows(), batch_size):
+				rows = []
+				row_errors = []
+				for line_number, row in batch:
+					values = participant_values(row)
+					problem = row_problem(values, seen_emails)
+					if problem:
+						row_errors.append(ParticipantImportRowError(
+							participant_import=self,
+							line_number=line_number,
+							reason=problem,
+							row=json.dumps({column: value for column, value in row.items() if column is not None})
+						))
+					else:
+						rows.append(values)
+				with transaction.atomic():
+					if rows:
+						for key, count in Participant.bulk_upsert(self.giftexchange, rows).items():
+							counts[key] += count
+					ParticipantImportRowError.objects.bulk_create(
+						row_errors,
+						batch_size=bulk_batch_size(ParticipantImportRowError, row_errors, ASSIGNMENT_BATCH_SIZE)
+					)
+				counts['failed'] += len(row_errors)
+				if on_progress:
+					on_progress(reader.line_num - 1, max(self.line_count - 1, 0))
+		except ParticipantImportError:
+			self.participantimportchunk_set.all().delete()
+			raise
+		self.participantimportchunk_set.all().delete()
+		return counts
+
+	def error_rows(self):
+		""" (line number, reason, row dict) for each failed row, in file order
+		"""
+		row_errors = self.participantimportrowerror_set.order_by('line_number').values_list('line_number', 'reason', 'row')
+		for line_number, reason, row in row_errors.iterator(chunk_size=ASSIGNMENT_BATCH_SIZE):
+			yield line_number, reason, json.loads(row)
+
+
+class ParticipantImportChunk(models.Model):
+	""" One chunk of an uploaded participant CSV file, as received
+	"""
+	participant_import = models.ForeignKey(ParticipantImport, on_delete=models.CASCADE)
+	index = models.PositiveIntegerField()
+	data = models.BinaryField()
+
+	class Meta:
+		unique_together = ['participant_import', 'index']
+
+
+class ParticipantImportRowError(models.Model):
+	""" A row of a participant CSV file that could not be imported, and why
+	"""
+	participant_import = models.ForeignKey(ParticipantImport, on_delete=models.CASCADE)
+	line_number = models.PositiveIntegerField()
+	reason = models.CharField(max_length=50)
+	row = models.TextField()
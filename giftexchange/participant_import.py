@@ -0,0 +1,137 @@
+import codecs
+import csv
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+
+
+PARTICIPANT_CSV_HEADER = ['first_name', 'last_name', 'email', 'shipping_address', 'likes', 'dislikes', 'allergies', 'other']
+REQUIRED_CSV_COLUMNS = ['first_name', 'last_name', 'email']
+IMPORT_BATCH_SIZE = 1000
+
+
+class ParticipantImportError(Exception):
+	pass
+
+
+def participant_values(row):
+	""" Maps a CSV row to the participant field values Participant.bulk_upsert
+		takes, treating optional columns missing from the file as blank
+	"""
+	def value(column):
+		return (row.get(column) or '').strip()
+
+	return {
+		'email': value('email'),
+		'first_name': value('first_name'),
+		'last_name': value('last_name'),
+		'likes': value('likes'),
+		'dislikes': value('dislikes'),
+		'allergies_sensitivities': value('allergies'),
+		'shipping_address': value('shipping_address'),
+		'additional_info': value('other'),
+	}
+
+
+def row_problem(values, seen_emails):
+	""" Returns why participant values can not be imported, or None if they can
+
+		seen_emails collects the emails of the accepted rows so later rows
+		repeating one are reported as duplicates
+	"""
+	if not values['first_name'] or not values['last_name']:
+		return 'missing name'
+	try:
+		validate_email(values['email'])
+	except ValidationError:
+		return 'bad email'
+	email_key = values['email'].lower()
+	if email_key in seen_emails:
+		return 'duplicate in file'
+	seen_emails.add(email_key)
+	return None
+
+
+def batched(items, batch_size=IMPORT_BATCH_SIZE):
+	""" Yields lists of at most batch_size items
+	"""
+	batch = []
+	for item in items:
+		batch.append(item)
+		if len(batch) == batch_size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+
+def iter_decoded_lines(chunks, encoding='utf-8-sig'):
+	""" Decodes an iterable of byte chunks, such as UploadedFile.chunks(), into
+		lines of text without ever holding more than one chunk and one line
+	"""
+	decoder = codecs.getincrementaldecoder(encoding)()
+	pending = ''
+	for chunk in chunks:
+		try:
+			pending += decoder.decode(chunk)
+		except UnicodeDecodeError:
+			raise ParticipantImportError('File must be UTF-8 encoded text')
+		lines = pending.split('\n')
+		pending = lines.pop()
+		for line in lines:
+			yield line + '\n'
+	try:
+		pending += decoder.decode(b'', final=True)
+	except UnicodeDecodeError:
+		raise ParticipantImportError('File must be UTF-8 encoded text')
+	if pending:
+		yield pending
+
+
+class ParticipantCSVReader(object):
+	""" Reads participant rows from an uploaded CSV file as it is streamed
+
+		The header is checked for the required columns as soon as the reader is
+		created, then rows are parsed lazily so any size of file can be imported
+		in fixed size batches. Column names are matched ignoring case and
+		surrounding spaces, and columns the import does not know are ignored.
+	"""
+	def __init__(self, chunks, required_columns=REQUIRED_CSV_COLUMNS):
+		self.reader = csv.DictReader(
+			iter_decoded_lines(chunks),
+			delimiter=',',
+			quotechar='"',
+			skipinitialspace=True
+		)
+		try:
+			fieldnames = self.reader.fieldnames
+		except csv.Error as error:
+			raise ParticipantImportError('Could not read CSV header: {}'.format(error))
+		if not fieldnames:
+			raise ParticipantImportError('The file is empty')
+		self.reader.fieldnames = [name.strip().lower() for name in fieldnames]
+		missing_columns = [column for column in required_columns if column not in self.reader.fieldnames]
+		if missing_columns:
+			raise ParticipantImportError('Invalid header, missing columns: {}'.format(', '.join(missing_columns)))
+
+	@property
+	def line_num(self):
+		return self.reader.line_num
+
+	def __iter__(self):
+		for line_number, row in self.numbered_rows():
+			yield row
+
+	def numbered_rows(self):
+		""" Yields (line number, row) pairs, numbered by the line each row ends on
+		"""
+		try:
+			for row in self.reader:
+				yield self.reader.line_num, row
+		except csv.Error as error:
+			raise ParticipantImportError('Could not read line {}: {}'.format(self.reader.line_num, error))
+
+	def batches(self, batch_size=IMPORT_BATCH_SIZE):
+		""" Yields lists of at most batch_size rows
+		"""
+		return batched(self, batch_size)
@@ -0,0 +1,280 @@
+import gzip
+import json
+import zlib
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from giftexchange.models import (
+	ASSIGNMENT_BATCH_SIZE,
+	AppUser,
+	ExchangeAssignment,
+	ExclusionGroup,
+	ExclusionPair,
+	GiftExchange,
+	Participant,
+	bulk_batch_size,
+)
+
+
+SNAPSHOT_FORMAT = 'gifterator-snapshot'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_CHUNK_SIZE = 2000
+# every record after the header is a JSON array: the table name, then the values of its columns
+SNAPSHOT_TABLES = {
+	'giftexchange': [
+		'title', 'date', 'location', 'description', 'spending_limit',
+		'assignments_locked', 'ship_gifts_allowed', 'assignment_seed',
+	],
+	'admin': ['email'],
+	'participant': [
+		'id', 'email', 'first_name', 'last_name', 'status', 'likes', 'dislikes',
+		'allergies_sensitivities', 'shipping_address', 'additional_info', 'gift', 'appuser_email',
+	],
+	'exclusion_pair': ['giver_id', 'reciever_id', 'both_ways'],
+	'exclusion_group': ['name', 'member_ids'],
+	'assignment': ['giver_id', 'reciever_id', 'position', 'email_sent'],
+}
+PARTICIPANT_SNAPSHOT_FIELDS = [
+	'pk', 'email', 'first_name', 'last_name', 'status', 'likes', 'dislikes',
+	'allergies_sensitivities', 'shipping_address', 'additional_info', 'gift', '_appuser__djangouser__email',
+]
+
+
+class SnapshotError(Exception):
+	pass
+
+
+def snapshot_records(giftexchange):
+	""" Yields the header and then every record of a gift exchange snapshot,
+		reading participants and assignments with server side cursors
+	"""
+	yield {
+		'format': SNAPSHOT_FORMAT,
+		'version': SNAPSHOT_VERSION,
+		'created_at': timezone.now().isoformat(),
+		'tables': SNAPSHOT_TABLES,
+	}
+	yield ['giftexchange'] + [
+		giftexchange.date.isoformat() if column == 'date' and giftexchange.date else getattr(giftexchange, column)
+		for column in SNAPSHOT_TABLES['giftexchange']
+	]
+	for email in giftexchange.admin_appuser.order_by('pk').values_list('djangouser__email', flat=True):
+		yield ['admin', email]
+	participants = giftexchange.participant_set.order_by('pk').values_list(*PARTICIPANT_SNAPSHOT_FIELDS)
+	for participant in participants.iterator(chunk_size=SNAPSHOT_CHUNK_SIZE):
+		yield ['participant'] + list(participant)
+	for pair in giftexchange.exclusionpair_set.order_by('pk').values_list('giver_id', 'reciever_id', 'both_ways'):
+		yield ['exclusion_pair'] + list(pair)
+	for group in giftexchange.exclusiongroup_set.order_by('pk').prefetch_related('members'):
+		yield ['exclusion_group', group.name, sorted(member.pk for member in group.members.all())]
+	assignments = giftexchange.exchangeassignment_set.order_by('position', 'pk').values_list(
+		'giver_id', 'reciever_id', 'position', 'email_sent'
+	)
+	for assignment in assignments.iterator(chunk_size=SNAPSHOT_CHUNK_SIZE):
+		yield ['assignment'] + list(assignment)
+
+
+def snapshot_chunks(giftexchange, compresslevel=6):
+	""" Streams a gzip compressed JSON Lines snapshot of a gift exchange, for
+		writing to a file or sending as a download
+	"""
+	compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+	lines = []
+	for record in snapshot_records(giftexchange):
+		lines.append(json.dumps(record, separators=(',', ':')))
+		if len(lines) == SNAPSHOT_CHUNK_SIZE:
+			yield compressor.compress(('\n'.join(lines) + '\n').encode('utf-8'))
+			lines = []
+	yield compressor.compress(('\n'.join(lines) + '\n').encode('utf-8') if lines else b'')
+	yield compressor.flush()
+
+
+def write_snapshot(giftexchange, path):
+	with open(path, 'wb') as snapshot_file:
+		for chunk in snapshot_chunks(giftexchange):
+			snapshot_file.write(chunk)
+
+
+def read_snapshot(fileobj):
+	""" Yields the header and records of a snapshot from a binary file object
+	"""
+	with gzip.open(fileobj, 'rt', encoding='utf-8') as lines:
+		for line in lines:
+			if line.strip():
+				yield json.loads(line)
+
+
+class SnapshotRestorer(object):
+	""" Creates a new gift exchange from snapshot records with bulk inserts
+
+		Participant ids in the snapshot are mapped to the new participants as
+		each batch is inserted, and assignments and exclusions are written
+		against the new ids. With clone=True the participants, admins and
+		exclusion rules are copied while assignments, gifts, the assignment
+		seed and the lock are left behind, ready for a new season.
+	"""
+	def __init__(self, title=None, clone=False, batch_size=ASSIGNMENT_BATCH_SIZE):
+		self.title = title
+		self.clone = clone
+		self.batch_size = batch_size
+		self.giftexchange = None
+		self.participant_ids = {}
+		self.counts = {'participants': 0, 'assignments': 0, 'admins': 0, 'missing_admins': 0}
+
+	def restore(self, records):
+		records = iter(records)
+		self._check_header(next(records, None))
+		with transaction.atomic():
+			participants = []
+			assignments = []
+			for record in records:
+				table, values = record[0], record[1:]
+				if table == 'participant':
+					participants.append(values)
+					if len(participants) == self.batch_size:
+						self._insert_participants(participants)
+						participants = []
+					continue
+				if participants:
+					self._insert_participants(participants)
+					participants = []
+				if table == 'assignment':
+					if not self.clone:
+						assignments.append(values)
+						if len(assignments) == self.batch_size:
+							self._insert_assignments(assignments)
+							assignments = []
+				elif table == 'giftexchange':
+					self._create_giftexchange(values)
+				elif table == 'admin':
+					self._add_admin(values[0])
+				elif table == 'exclusion_pair':
+					self._add_exclusion_pair(values)
+				elif table == 'exclusion_group':
+					self._add_exclusion_group(values)
+				else:
+					raise SnapshotError('Unknown snapshot record "{}"'.format(table))
+			if participants:
+				self._insert_participants(participants)
+			if assignments:
+				self._insert_assignments(assignments)
+			if self.giftexchange is None:
+				raise SnapshotError('The snapshot has no gift exchange')
+		return self.giftexchange
+
+	def _check_header(self, header):
+		if not isinstance(header, dict) or header.get('format') != SNAPSHOT_FORMAT:
+			raise SnapshotError('Not a gift exchange snapshot')
+		if header.get('version') != SNAPSHOT_VERSION:
+			raise SnapshotError('Unsupported snapshot version {}, expected {}'.format(header.get('version'), SNAPSHOT_VERSION))
+
+	def _require_giftexchange(self):
+		if self.giftexchange is None:
+			raise SnapshotError('The snapshot lists records before its gift exchange')
+		return self.giftexchange
+
+	def _create_giftexchange(self, values):
+		details = dict(zip(SNAPSHOT_TABLES['giftexchange'], values))
+		details['date'] = parse_date(details['date']) if details['date'] else None
+		if self.title:
+			details['title'] = self.title
+		if self.clone:
+			details.update(assignments_locked=False, assignment_seed=None)
+		if GiftExchange.objects.filter(title=details['title']).exists():
+			raise SnapshotError('A gift exchange titled "{}" already exists'.format(details['title']))
+		self.giftexchange = GiftExchange.objects.create(**details)
+
+	def _add_admin(self, email):
+		appuser = AppUser.objects.filter(djangouser__email=email).first()
+		if appuser:
+			self._require_giftexchange().admin_appuser.add(appuser)
+			self.counts['admins'] += 1
+		else:
+			self.counts['missing_admins'] += 1
+
+	def _insert_participants(self, rows):
+		giftexchange = self._require_giftexchange()
+		appuser_emails = set(row[-1] for row in rows if row[-1])
+		appusers = dict(
+			AppUser.objects.filter(djangouser__email__in=appuser_emails).values_list('djangouser__email', 'pk')
+		)
+		last_pk = giftexchange.participant_set.order_by('-pk').values_list('pk', flat=True).first() or 0
+		participants = []
+		for row in rows:
+			values = dict(zip(SNAPSHOT_TABLES['participant'], row))
+			values.pop('id')
+			values['_appuser_id'] = appusers.get(values.pop('appuser_email'))
+			if self.clone:
+				values['gift'] = None
+			participants.append(Participant(giftexchange=giftexchange, **values))
+		Participant.objects.bulk_create(
+			participants,
+			batch_size=bulk_batch_size(Participant, participants, self.batch_size)
+		)
+		# ids are read back in insertion order as not every database returns them from bulk_create
+		new_ids = giftexchange.participant_set.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)
+		for row, new_id in zip(rows, new_ids):
+			self.participant_ids[row[0]] = new_id
+		self.counts['participants'] += len(participants)
+
+	def _new_participant_id(self, old_id):
+		try:
+			return self.participant_ids[old_id]
+		except KeyError:
+			raise SnapshotError('The snapshot refers to participant {} which it does not contain'.format(old_id))
+
+	def _insert_assignments(self, rows):
+		giftexchange = self._require_giftexchange()
+		assignments = [
+			ExchangeAssignment(
+				giftexchange=giftexchange,
+				giver_id=self._new_participant_id(giver_id),
+				reciever_id=self._new_participant_id(reciever_id),
+				position=position,
+				email_sent=email_sent
+			) for giver_id, reciever_id, position, email_sent in rows
+		]
+		ExchangeAssignment.objects.bulk_create(
+			assignments,
+			batch_size=bulk_batch_size(ExchangeAssignment, assignments, self.batch_size)
+		)
+		self.counts['assignments'] += len(assignments)
+
+	def _add_exclusion_pair(self, values):
+		giver_id, reciever_id, both_ways = values
+		ExclusionPair.objects.create(
+			giftexchange=self._require_giftexchange(),
+			giver_id=self._new_participant_id(giver_id),
+			reciever_id=self._new_participant_id(reciever_id),
+			both_ways=both_ways
+		)
+
+	def _add_exclusion_group(self, values):
+		name, member_ids = values
+		group = ExclusionGroup.objects.create(giftexchange=self._require_giftexchange(), name=name)
+		group.members.set([self._new_participant_id(member_id) for member_id in member_ids])
+
+
+def restore_snapshot(fileobj, title=None, clone=False):
+	""" Restores a snapshot file as a new gift exchange
+		Returns the SnapshotRestorer, with the new giftexchange and counts of what was restored
+	"""
+	restorer = SnapshotRestorer(title=title, clone=clone)
+	try:
+		restorer.restore(read_snapshot(fileobj))
+	except (OSError, EOFError, ValueError) as error:
+		raise SnapshotError('Could not read snapshot: {}'.format(error))
+	return restorer
+
+
+def clone_giftexchange(giftexchange, title, exclude_repeats=False):
+	""" Copies a gift exchange's details, admins, participants and exclusion
+		rules into a new gift exchange, without writing a snapshot file
+	"""
+	restorer = SnapshotRestorer(title=title, clone=True)
+	restorer.restore(snapshot_records(giftexchange))
+	if exclude_repeats:
+		restorer.giftexchange.exclude_repeats_from.add(giftexchange)
+	return restorer
@@ -0,0 +1,38 @@
+import threading
+import time
+
+
+class SuppressionCache(object):
+	""" In-process set of suppressed email addresses
+
+		The set is reloaded with `load` at most every `ttl` seconds, so checking
+		an address is a set lookup rather than a query per send. Addresses are
+		compared lower cased.
+	"""
+	def __init__(self, load, ttl, clock=time.monotonic):
+		self.load = load
+		self.ttl = ttl
+		self.clock = clock
+		self.emails = frozenset()
+		self.loaded_at = None
+		self.lock = threading.Lock()
+
+	def _current(self):
+		if self.loaded_at is None or self.clock() - self.loaded_at >= self.ttl:
+			with self.lock:
+				if self.loaded_at is None or self.clock() - self.loaded_at >= self.ttl:
+					self.emails = frozenset(email.lower() for email in self.load())
+					self.loaded_at = self.clock()
+		return self.emails
+
+	def __contains__(self, email):
+		return email.lower() in self._current()
+
+	def add(self, emails):
+		""" Adds addresses this process just suppressed without waiting for a reload
+		"""
+		with self.lock:
+			self.emails = self.emails.union(email.lower() for email in emails)
+
+	def invalidate(self):
+		self.loaded_at = None
@@ -1,10 +1,17 @@
+from django.conf import settings
+from django.core.cache import caches
 from django.test import TestCase
 from django.test import Client
 
+from giftexchange.models import suppressed_emails
+
 
 class TestBase(TestCase):
 	def setUp(self):
 		self.client = Client(enforce_csrf_checks=False)
+		for alias in settings.CACHES:
+			caches[alias].clear()
+		suppressed_emails.invalidate()
 
 	def assertMessages(self, client_result, expected_messages):
 		context_messages = list(client_result.context['messages'])
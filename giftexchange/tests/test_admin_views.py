@@ -0,0 +1,122 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.urls import reverse
+
+from giftexchange.assignments import AssignmentInfeasible
+from giftexchange.models import ASSIGNMENT_POSITION_STEP, AppUser, GiftExchange, Participant
+from giftexchange.tests.helpers import TestBase
+
+
+class AdminViewTestCase(TestBase):
+	def setUp(self):
+		super(AdminViewTestCase, self).setUp()
+		self.djangouser = User.objects.create(
+			email='admin@example.com',
+			username='admin@example.com',
+			first_name='Admin',
+			last_name='User'
+		)
+		self.appuser = AppUser.create(djangouser=self.djangouser)
+		self.giftexchange = GiftExchange.objects.create(title='Admin Test Exchange', location='Washington, DC')
+		self.giftexchange.admin_appuser.add(self.appuser)
+		self.client.force_login(self.djangouser)
+
+	def _add_participants(self, participant_count):
+		Participant.objects.bulk_create([
+			Participant(
+				giftexchange=self.giftexchange,
+				first_name='Tester{}'.format(i),
+				last_name='User',
+				email='tester{}@example.com'.format(i),
+				status='active'
+			) for i in range(participant_count)
+		])
+
+
+class TestViewAssignments(AdminViewTestCase):
+	def test_assignments_are_paginated(self):
+		self._add_participants(60)
+		self.giftexchange.generate_assignemnts()
+		url = reverse('giftexchange_manage_assignments', kwargs={'giftexchange_id': self.giftexchange.pk})
+
+		result = self.client.get(url)
+		self.assertEqual(len(result.context['assignments']), 50)
+		self.assertContains(result, 'Page 1 of 2')
+
+		result = self.client.get(url, {'page': 2})
+		self.assertEqual(len(result.context['assignments']), 10)
+		self.assertEqual(result.context['assignments'][0].position, 50 * ASSIGNMENT_POSITION_STEP)
+
+
+class TestRemoveParticipant(AdminViewTestCase):
+	def test_remove_participant_keeps_loop_closed(self):
+		self._add_participants(5)
+		self.giftexchange.generate_assignemnts()
+		self.giftexchange.exchangeassignment_set.update(email_sent=True)
+		leaving = self.giftexchange.participant_set.first()
+		url = reverse('giftexchange_remove_participant', kwargs={
+			'giftexchange_id': self.giftexchange.pk,
+			'participant_id': leaving.pk
+		})
+		result = self.client.post(url, follow=True)
+		self.assertEqual(self.giftexchange.exchangeassignment_set.count(), 4)
+		self.assertEqual(len(self.giftexchange.ordered_assignments), 4)
+		changed_giver = self.giftexchange.exchangeassignment_set.get(email_sent=False).giver
+		self.assertMessages(result, [
+			('success', 'Participant removed from gift exchange'),
+			('info', '{} has a new assignment and needs a new assignment email'.format(changed_giver.name)),
+		])
+
+
+class TestAddSingleUser(AdminViewTestCase):
+	def _add_user(self):
+		url = reverse('giftexchange_add_single_user', kwargs={'giftexchange_id': self.giftexchange.pk})
+		return self.client.post(url, {
+			'first_name': 'Late',
+			'last_name': 'Joiner',
+			'email': 'late@example.com',
+		}, follow=True)
+
+	def test_late_joiner_is_spliced_into_locked_loop(self):
+		self._add_participants(5)
+		self.giftexchange.generate_assignemnts()
+		self.giftexchange.exchangeassignment_set.update(email_sent=True)
+		self.giftexchange.assignments_locked = True
+		self.giftexchange.save()
+
+		result = self._add_user()
+		joiner = self.giftexchange.participant_set.get(email='late@example.com')
+		self.assertEqual(len(self.giftexchange.ordered_assignments), 6)
+		self.assertEqual(self.giftexchange.audit_assignments(), [])
+		unsent = self.giftexchange.exchangeassignment_set.filter(email_sent=False).select_related('giver')
+		self.assertEqual(len(unsent), 2)
+		self.assertIn(joiner, [assignment.giver for assignment in unsent])
+		self.assertEqual(
+			sorted(message.message for message in result.context['messages'] if message.level_tag == 'info'),
+			sorted('{} has a new assignment and needs a new assignment email'.format(assignment.giver.name) for assignment in unsent)
+		)
+
+	def test_admin_is_told_when_joiner_can_not_be_assigned(self):
+		self._add_participants(2)
+		self.giftexchange.generate_assignemnts()
+		with mock.patch.object(GiftExchange, 'splice_in_participant', side_effect=AssignmentInfeasible(['no room'])):
+			result = self._add_user()
+		self.assertTrue(any(
+			message.level_tag == 'warning' and 'has no assignment yet' in message.message
+			for message in result.context['messages']
+		))
+
+
+class TestAuditAssignments(AdminViewTestCase):
+	def test_audit_reports_broken_loop(self):
+		self._add_participants(4)
+		self.giftexchange.generate_assignemnts()
+		url = reverse('giftexchange_audit_assignments', kwargs={'giftexchange_id': self.giftexchange.pk})
+
+		result = self.client.get(url, follow=True)
+		self.assertMessages(result, [('success', 'Assignments passed the audit.')])
+
+		self.giftexchange.exchangeassignment_set.order_by('position').first().delete()
+		result = self.client.get(url, follow=True)
+		self.assertEqual(len(list(result.context['messages'])), 2)
@@ -0,0 +1,509 @@
+import json
+import os
+import random
+import tempfile
+from io import StringIO
+from unittest import mock, skipIf
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from giftexchange.assignments import (
+	AssignmentError,
+	AssignmentInfeasible,
+	AssignmentViolation,
+	build_assignment_cycle,
+	build_constrained_assignment_cycle,
+	verify_assignments,
+)
+from giftexchange.management.commands.generate_assignments import exchange_seed
+from giftexchange.models import (
+	ASSIGNMENT_POSITION_STEP,
+	AppUser,
+	ExchangeAssignment,
+	ExclusionGroup,
+	ExclusionPair,
+	GiftExchange,
+	Participant,
+)
+
+
+class AssignmentTestBase(TestCase):
+	def _create_exchange(self, participant_count, title='Test Gift Exchange'):
+		giftexchange = GiftExchange.objects.create(title=title, location='Washington, DC')
+		Participant.objects.bulk_create([
+			Participant(
+				giftexchange=giftexchange,
+				first_name='Tester{}'.format(i),
+				last_name='User',
+				email='tester{}@example.com'.format(i),
+				status='active'
+			) for i in range(participant_count)
+		])
+		return giftexchange
+
+	def assertSingleLoop(self, pairs, participant_ids):
+		successors = dict(pairs)
+		self.assertEqual(sorted(successors.keys()), sorted(participant_ids))
+		self.assertEqual(sorted(successors.values()), sorted(participant_ids))
+		start = pairs[0][0]
+		current = successors[start]
+		steps = 1
+		while current != start:
+			current = successors[current]
+			steps += 1
+		self.assertEqual(steps, len(participant_ids))
+
+
+class TestBuildAssignmentCycle(AssignmentTestBase):
+	def test_cycle_is_single_closed_loop(self):
+		participant_ids = list(range(1, 501))
+		pairs = build_assignment_cycle(participant_ids, rng=random.Random(3))
+		self.assertSingleLoop(pairs, participant_ids)
+		for giver_id, reciever_id in pairs:
+			self.assertNotEqual(giver_id, reciever_id)
+
+	def test_two_participants_swap(self):
+		pairs = build_assignment_cycle([1, 2])
+		self.assertEqual(sorted(pairs), [(1, 2), (2, 1)])
+
+	def test_too_few_participants(self):
+		with self.assertRaises(AssignmentError):
+			build_assignment_cycle([1])
+
+
+class TestConstrainedAssignmentCycle(AssignmentTestBase):
+	def test_excluded_pairs_and_groups_are_respected(self):
+		participant_ids = list(range(60))
+		households = [participant_ids[i:i + 3] for i in range(0, 60, 3)]
+		excluded_pairs = [(i, (i + 1) % 60) for i in participant_ids]
+		pairs = build_constrained_assignment_cycle(
+			participant_ids,
+			excluded_pairs=excluded_pairs,
+			excluded_groups=households,
+			rng=random.Random(7)
+		)
+		self.assertSingleLoop(pairs, participant_ids)
+		for giver_id, reciever_id in pairs:
+			self.assertNotIn((giver_id, reciever_id), excluded_pairs)
+			self.assertNotEqual(giver_id // 3, reciever_id // 3)
+
+	def test_group_too_large_is_infeasible(self):
+		with self.assertRaises(AssignmentInfeasible) as raised:
+			build_constrained_assignment_cycle([1, 2, 3, 4, 5], excluded_groups=[[1, 2, 3]])
+		self.assertIn('A group of 3 participants', raised.exception.problems[0])
+
+	def test_participant_excluded_from_everyone_is_infeasible(self):
+		excluded_pairs = [(1, 2), (1, 3)]
+		with self.assertRaises(AssignmentInfeasible) as raised:
+			build_constrained_assignment_cycle([1, 2, 3], excluded_pairs=excluded_pairs)
+		self.assertEqual(raised.exception.problems, ['1 is excluded from giving to everyone'])
+
+	def test_exhausted_search_is_infeasible(self):
+		# 1 and 2 may only give to 3, which can only receive once
+		excluded_pairs = [(1, 2), (1, 4), (2, 1), (2, 4)]
+		with self.assertRaises(AssignmentInfeasible):
+			build_constrained_assignment_cycle([1, 2, 3, 4], excluded_pairs=excluded_pairs)
+
+
+class TestGenerateAssignments(AssignmentTestBase):
+	def test_generate_assignments(self):
+		giftexchange = self._create_exchange(25)
+		Participant.objects.filter(giftexchange=giftexchange, first_name='Tester0').update(status='declined')
+		active_ids = list(giftexchange.participant_set.filter(status='active').values_list('pk', flat=True))
+
+		assignments = giftexchange.generate_assignemnts()
+
+		self.assertEqual(len(assignments), 24)
+		pairs = list(giftexchange.exchangeassignment_set.values_list('giver_id', 'reciever_id'))
+		self.assertSingleLoop(pairs, active_ids)
+
+	def test_generate_assignments_locked(self):
+		giftexchange = self._create_exchange(5)
+		giftexchange.lock()
+		with self.assertRaises(AssignmentError):
+			giftexchange.generate_assignemnts()
+		self.assertEqual(len(giftexchange.generate_assignemnts(override_lock=True)), 5)
+
+	def test_failed_verification_is_an_assignment_error(self):
+		giftexchange = self._create_exchange(5)
+		violation = AssignmentViolation('self_assignment', 1, 1, 'Tester0 User gives to themselves')
+		with mock.patch('giftexchange.models.verify_assignments', return_value=[violation]):
+			with self.assertRaises(AssignmentError) as raised:
+				giftexchange.generate_assignemnts()
+		self.assertEqual(raised.exception.problems, ['Generated assignments failed verification: Tester0 User gives to themselves'])
+		self.assertFalse(giftexchange.has_assignments)
+
+	def test_generate_assignments_bulk_insert(self):
+		giftexchange = self._create_exchange(2500)
+		with CaptureQueriesContext(connection) as queries:
+			giftexchange.generate_assignemnts()
+		# inserts are batched, so the query count does not grow per participant
+		self.assertLess(len(queries), 50)
+		self.assertEqual(giftexchange.exchangeassignment_set.count(), 2500)
+
+	def test_failed_regeneration_keeps_previous_assignments(self):
+		giftexchange = self._create_exchange(10)
+		giftexchange.generate_assignemnts()
+		previous_pairs = sorted(giftexchange.exchangeassignment_set.values_list('giver_id', 'reciever_id'))
+		with mock.patch.object(ExchangeAssignment.objects, 'bulk_create', side_effect=RuntimeError):
+			with self.assertRaises(RuntimeError):
+				giftexchange.generate_assignemnts()
+		current_pairs = sorted(giftexchange.exchangeassignment_set.values_list('giver_id', 'reciever_id'))
+		self.assertEqual(previous_pairs, current_pairs)
+
+	def test_generate_assignments_with_exclusions(self):
+		giftexchange = self._create_exchange(6)
+		participants = list(giftexchange.participant_set.order_by('pk'))
+		ExclusionPair.objects.create(giftexchange=giftexchange, giver=participants[0], reciever=participants[1])
+		household = ExclusionGroup.objects.create(giftexchange=giftexchange, name='Household')
+		household.members.add(participants[2], participants[3], participants[4])
+		previous_exchange = self._create_exchange(6, title='Last Year')
+		previous_participants = list(previous_exchange.participant_set.order_by('pk'))
+		ExchangeAssignment.objects.create(
+			giftexchange=previous_exchange,
+			giver=previous_participants[5],
+			reciever=previous_participants[0]
+		)
+		giftexchange.exclude_repeats_from.add(previous_exchange)
+
+		household_ids = {participants[i].pk for i in (2, 3, 4)}
+		for attempt in range(10):
+			giftexchange.generate_assignemnts()
+			pairs = set(giftexchange.exchangeassignment_set.values_list('giver_id', 'reciever_id'))
+			self.assertNotIn((participants[0].pk, participants[1].pk), pairs)
+			self.assertNotIn((participants[1].pk, participants[0].pk), pairs)
+			self.assertNotIn((participants[5].pk, participants[0].pk), pairs)
+			for giver_id, reciever_id in pairs:
+				self.assertFalse(giver_id in household_ids and reciever_id in household_ids)
+
+
+class TestOrderedAssignments(AssignmentTestBase):
+	def test_ordered_assignments_single_query(self):
+		giftexchange = self._create_exchange(30)
+		giftexchange.generate_assignemnts()
+		with self.assertNumQueries(1):
+			assignments = giftexchange.ordered_assignments
+			names = [(assignment.giver.name, assignment.reciever.name) for assignment in assignments]
+		self.assertEqual(len(assignments), 30)
+		for previous, current in zip(assignments, assignments[1:] + assignments[:1]):
+			self.assertEqual(previous.reciever_id, current.giver_id)
+
+	def test_iter_ordered_assignments_matches_list(self):
+		giftexchange = self._create_exchange(30)
+		giftexchange.generate_assignemnts()
+		streamed = [assignment.pk for assignment in giftexchange.iter_ordered_assignments(chunk_size=7)]
+		self.assertEqual(streamed, [assignment.pk for assignment in giftexchange.ordered_assignments])
+
+	def test_ordered_assignments_empty(self):
+		giftexchange = self._create_exchange(3)
+		self.assertEqual(giftexchange.ordered_assignments, [])
+		self.assertEqual(list(giftexchange.iter_ordered_assignments()), [])
+
+	def test_generated_assignments_store_loop_position(self):
+		giftexchange = self._create_exchange(12)
+		giftexchange.generate_assignemnts()
+		assignments = list(giftexchange.exchangeassignment_set.order_by('position'))
+		self.assertEqual(
+			[assignment.position for assignment in assignments],
+			[index * ASSIGNMENT_POSITION_STEP for index in range(12)]
+		)
+		for previous, current in zip(assignments, assignments[1:] + assignments[:1]):
+			self.assertEqual(previous.reciever_id, current.giver_id)
+
+	def test_assignments_page(self):
+		giftexchange = self._create_exchange(120)
+		giftexchange.generate_assignemnts()
+		ordered_ids = [assignment.pk for assignment in giftexchange.ordered_assignments]
+		with self.assertNumQueries(3):
+			page = giftexchange.assignments_page(2)
+			page_ids = [assignment.pk for assignment in page]
+		self.assertEqual(page_ids, ordered_ids[50:100])
+
+	def test_unpositioned_assignments_fall_back_to_walking_the_loop(self):
+		giftexchange = self._create_exchange(20)
+		giftexchange.generate_assignemnts()
+		expected_pairs = sorted(giftexchange.exchangeassignment_set.values_list('giver_id', 'reciever_id'))
+		giftexchange.exchangeassignment_set.update(position=None)
+		assignments = giftexchange.ordered_assignments
+		self.assertEqual(sorted((a.giver_id, a.reciever_id) for a in assignments), expected_pairs)
+		for previous, current in zip(assignments, assignments[1:] + assignments[:1]):
+			self.assertEqual(previous.reciever_id, current.giver_id)
+		streamed = [assignment.pk for assignment in giftexchange.iter_ordered_assignments(chunk_size=6)]
+		self.assertEqual(streamed, [assignment.pk for assignment in assignments])
+
+
+class TestSpliceAssignments(AssignmentTestBase):
+	def assertLoopIsClosed(self, giftexchange):
+		assignments = giftexchange.ordered_assignments
+		participant_ids = list(giftexchange.participant_set.filter(status='active').values_list('pk', flat=True))
+		self.assertSingleLoop([(a.giver_id, a.reciever_id) for a in assignments], participant_ids)
+		for previous, current in zip(assignments, assignments[1:] + assignments[:1]):
+			self.assertEqual(previous.reciever_id, current.giver_id)
+
+	def test_splice_in_participant(self):
+		giftexchange = self._create_exchange(10)
+		giftexchange.generate_assignemnts()
+		giftexchange.exchangeassignment_set.update(email_sent=True)
+		participant = Participant.objects.create(
+			giftexchange=giftexchange,
+			first_name='Late',
+			last_name='Joiner',
+			email='late@example.com',
+			status='active'
+		)
+
+		changed_givers = giftexchange.splice_in_participant(participant)
+
+		self.assertEqual(len(changed_givers), 2)
+		self.assertIn(participant, changed_givers)
+		self.assertLoopIsClosed(giftexchange)
+		unsent_givers = set(giftexchange.exchangeassignment_set.filter(email_sent=False).values_list('giver_id', flat=True))
+		self.assertEqual(unsent_givers, {giver.pk for giver in changed_givers})
+
+	def test_splice_in_respects_exclusions(self):
+		giftexchange = self._create_exchange(4)
+		giftexchange.generate_assignemnts()
+		participants = list(giftexchange.participant_set.order_by('pk'))
+		participant = Participant.objects.create(
+			giftexchange=giftexchange,
+			first_name='Late',
+			last_name='Joiner',
+			email='late@example.com',
+			status='active'
+		)
+		household = ExclusionGroup.objects.create(giftexchange=giftexchange, name='Household')
+		household.members.add(participant, *participants[:3])
+
+		with self.assertRaises(AssignmentInfeasible):
+			giftexchange.splice_in_participant(participant)
+
+	def test_splice_in_renumbers_when_positions_are_full(self):
+		giftexchange = self._create_exchange(5)
+		giftexchange.generate_assignemnts()
+		for assignment in giftexchange.exchangeassignment_set.all():
+			assignment.position //= ASSIGNMENT_POSITION_STEP
+			assignment.save()
+		participant = Participant.objects.create(
+			giftexchange=giftexchange,
+			first_name='Late',
+			last_name='Joiner',
+			email='late@example.com',
+			status='active'
+		)
+		giftexchange.splice_in_participant(participant, rng=random.Random(1))
+		self.assertLoopIsClosed(giftexchange)
+
+	def test_splice_out_participant(self):
+		giftexchange = self._create_exchange(10)
+		giftexchange.generate_assignemnts()
+		leaving = giftexchange.participant_set.first()
+		expected_giver = giftexchange.exchangeassignment_set.get(reciever=leaving).giver
+
+		changed_givers = giftexchange.splice_out_participant(leaving)
+		leaving.delete()
+
+		self.assertEqual(changed_givers, [expected_giver])
+		self.assertEqual(giftexchange.exchangeassignment_set.count(), 9)
+		self.assertLoopIsClosed(giftexchange)
+
+	def test_splice_out_of_two_person_loop_clears_assignments(self):
+		giftexchange = self._create_exchange(2)
+		giftexchange.generate_assignemnts()
+		self.assertEqual(giftexchange.splice_out_participant(giftexchange.participant_set.first()), [])
+		self.assertFalse(giftexchange.has_assignments)
+
+	def test_deleting_a_participant_closes_the_loop(self):
+		giftexchange = self._create_exchange(10)
+		giftexchange.generate_assignemnts()
+		giftexchange.exchangeassignment_set.update(email_sent=True)
+		leaving = giftexchange.participant_set.first()
+		expected_giver = giftexchange.exchangeassignment_set.get(reciever=leaving).giver
+
+		leaving.delete()
+
+		self.assertEqual(giftexchange.exchangeassignment_set.count(), 9)
+		self.assertLoopIsClosed(giftexchange)
+		self.assertEqual(giftexchange.exchangeassignment_set.get(email_sent=False).giver, expected_giver)
+
+	def test_add_participant_splices_active_participants_into_loop(self):
+		giftexchange = self._create_exchange(5)
+		giftexchange.generate_assignemnts()
+		invited_user = User.objects.create(email='invited@example.com', username='invited@example.com', first_name='Invited', last_name='Guest')
+		active_user = User.objects.create(email='late@example.com', username='late@example.com', first_name='Late', last_name='Joiner')
+
+		invited, created = giftexchange.add_participant(AppUser.objects.create(djangouser=invited_user), splice_assignments=True)
+		self.assertEqual((created, invited.status), (True, 'invited'))
+		self.assertEqual(giftexchange.exchangeassignment_set.count(), 5)
+		self.assertEqual(giftexchange.audit_assignments(), [])
+
+		appuser = AppUser.objects.create(djangouser=active_user)
+		participant, created = giftexchange.add_participant(appuser, splice_assignments=True, status='active')
+		self.assertTrue(created)
+		self.assertEqual((participant.name, participant.appuser), ('Late Joiner', appuser))
+		self.assertEqual(giftexchange.exchangeassignment_set.count(), 6)
+		self.assertLoopIsClosed(giftexchange)
+		self.assertEqual(giftexchange.audit_assignments(), [])
+		self.assertEqual(giftexchange.add_participant(appuser, splice_assignments=True), (participant, False))
+		self.assertEqual(giftexchange.exchangeassignment_set.count(), 6)
+
+class TestBenchmarkAssignments(AssignmentTestBase):
+	def test_benchmark_writes_results(self):
+		with tempfile.TemporaryDirectory() as output_dir:
+			output = os.path.join(output_dir, 'results.json')
+			call_command('benchmark_assignments', sizes=[10, 20], output=output, stdout=StringIO())
+			with open(output) as output_file:
+				results = json.load(output_file)
+		stages = [(result['participants'], result['stage']) for result in results]
+		self.assertIn((20, 'persist'), stages)
+		self.assertIn((10, 'ordered_assignments'), stages)
+		self.assertFalse(GiftExchange.objects.exists())
+
+
+class TestGenerateAssignmentsCommand(AssignmentTestBase):
+	def test_generate_for_many_exchanges(self):
+		first = self._create_exchange(5, title='First')
+		second = self._create_exchange(6, title='Second')
+		locked = self._create_exchange(4, title='Locked')
+		locked.lock()
+		output = StringIO()
+		call_command('generate_assignments', first.pk, second.pk, locked.pk, stdout=output)
+		self.assertEqual(first.exchangeassignment_set.count(), 5)
+		self.assertEqual(second.exchangeassignment_set.count(), 6)
+		self.assertFalse(locked.has_assignments)
+		self.assertIn('assignments are locked', output.getvalue())
+		self.assertIn('Generated assignments for 2 of 3 gift exchanges', output.getvalue())
+
+	def test_seed_is_derived_per_exchange(self):
+		first = self._create_exchange(30, title='First')
+		second = self._create_exchange(30, title='Second')
+		call_command('generate_assignments', first.pk, second.pk, '--seed', '7', stdout=StringIO())
+		first.refresh_from_db()
+		second.refresh_from_db()
+		self.assertEqual(first.assignment_seed, exchange_seed(7, first.pk))
+		self.assertNotEqual(first.assignment_seed, second.assignment_seed)
+
+		pairs = sorted(first.exchangeassignment_set.values_list('giver_id', 'reciever_id'))
+		call_command('generate_assignments', first.pk, second.pk, '--seed', '7', stdout=StringIO())
+		self.assertEqual(sorted(first.exchangeassignment_set.values_list('giver_id', 'reciever_id')), pairs)
+
+	@skipIf(connection.vendor != 'sqlite', 'only SQLite falls back to a single process')
+	def test_workers_fall_back_to_one_process_on_sqlite(self):
+		first = self._create_exchange(5, title='First')
+		second = self._create_exchange(6, title='Second')
+		output = StringIO()
+		call_command('generate_assignments', first.pk, second.pk, '--workers', '2', stdout=output)
+		self.assertIn('generating in a single process', output.getvalue())
+		self.assertIn('Generated assignments for 2 of 2 gift exchanges', output.getvalue())
+
+	def test_generate_pending_exchanges(self):
+		pending = self._create_exchange(5, title='Pending')
+		done = self._create_exchange(5, title='Done')
+		done.generate_assignemnts()
+		done_pairs = sorted(done.exchangeassignment_set.values_list('pk', flat=True))
+		self._create_exchange(5, title='Locked').lock()
+		output = StringIO()
+		call_command('generate_assignments', pending=True, stdout=output)
+		self.assertTrue(pending.has_assignments)
+		self.assertEqual(sorted(done.exchangeassignment_set.values_list('pk', flat=True)), done_pairs)
+		self.assertIn('Generated assignments for 1 of 1 gift exchanges', output.getvalue())
+
+
+
+@skipIf(connection.vendor == 'sqlite', 'SQLite runs the command in a single process')
+class TestGenerateAssignmentsCommandWorkers(TransactionTestCase):
+	def test_generate_with_worker_processes(self):
+		giftexchanges = []
+		for title in ['First', 'Second', 'Third']:
+			giftexchange = GiftExchange.objects.create(title=title)
+			Participant.objects.bulk_create([
+				Participant(
+					giftexchange=giftexchange,
+					first_name='Tester{}'.format(i),
+					last_name='User',
+					email='tester{}@example.com'.format(i),
+					status='active'
+				) for i in range(20)
+			])
+			giftexchanges.append(giftexchange)
+		output = StringIO()
+		call_command('generate_assignments', *[giftexchange.pk for giftexchange in giftexchanges], '--workers', '2', stdout=output)
+		self.assertIn('Generated assignments for 3 of 3 gift exchanges', output.getvalue())
+		for giftexchange in giftexchanges:
+			self.assertEqual(giftexchange.audit_assignments(), [])
+			self.assertEqual(giftexchange.exchangeassignment_set.count(), 20)
+
+class TestSeededAssignments(AssignmentTestBase):
+	def test_seed_is_stored_and_reproducible(self):
+		giftexchange = self._create_exchange(40)
+		ExclusionPair.objects.create(
+			giftexchange=giftexchange,
+			giver=giftexchange.participant_set.first(),
+			reciever=giftexchange.participant_set.last()
+		)
+		giftexchange.generate_assignemnts()
+		seed = GiftExchange.objects.get(pk=giftexchange.pk).assignment_seed
+		self.assertIsNotNone(seed)
+		first_pairs = list(giftexchange.exchangeassignment_set.order_by('position').values_list('giver_id', 'reciever_id'))
+
+		giftexchange.generate_assignemnts(seed=seed + 1)
+		giftexchange.generate_assignemnts(seed=seed)
+
+		pairs = list(giftexchange.exchangeassignment_set.order_by('position').values_list('giver_id', 'reciever_id'))
+		self.assertEqual(pairs, first_pairs)
+		self.assertEqual(GiftExchange.objects.get(pk=giftexchange.pk).assignment_seed, seed)
+
+
+class TestVerifyAssignments(AssignmentTestBase):
+	def _codes(self, violations):
+		return sorted(violation.code for violation in violations)
+
+	def test_valid_loop(self):
+		self.assertEqual(verify_assignments([(1, 2), (2, 3), (3, 1)], [1, 2, 3]), [])
+
+	def test_two_loops(self):
+		violations = verify_assignments([(1, 2), (2, 1), (3, 4), (4, 3)], [1, 2, 3, 4])
+		self.assertEqual(self._codes(violations), ['multiple_loops'])
+		self.assertEqual(violations[0].message, 'Assignments form 2 separate loops instead of one')
+
+	def test_structural_violations(self):
+		violations = verify_assignments([(1, 1), (2, 3), (2, 4), (4, 3), (5, 2)], [1, 2, 3, 4])
+		self.assertEqual(self._codes(violations), [
+			'does_not_give',
+			'does_not_recieve',
+			'gives_more_than_once',
+			'recieves_more_than_once',
+			'self_assignment',
+			'unknown_giver',
+		])
+
+	def test_excluded_pairs_and_groups(self):
+		violations = verify_assignments(
+			[(1, 2), (2, 3), (3, 4), (4, 1)],
+			[1, 2, 3, 4],
+			excluded_pairs=[(1, 2)],
+			excluded_groups=[[3, 4]]
+		)
+		self.assertEqual(
+			[(violation.code, violation.giver_id, violation.reciever_id) for violation in violations],
+			[('excluded_pair', 1, 2), ('excluded_pair', 3, 4)]
+		)
+
+	def test_audit_stored_assignments(self):
+		giftexchange = self._create_exchange(6)
+		giftexchange.generate_assignemnts()
+		self.assertEqual(giftexchange.audit_assignments(), [])
+		giftexchange.participant_set.create(
+			first_name='Late',
+			last_name='Joiner',
+			email='late@example.com',
+			status='active'
+		)
+		violations = giftexchange.audit_assignments()
+		self.assertEqual(
+			[violation.message for violation in violations],
+			['Late Joiner does not give a gift', 'Late Joiner does not receive a gift']
+		)
@@ -0,0 +1,610 @@
+import json
+import mailbox
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import StringIO
+from unittest import mock
+
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from giftexchange.email_dispatch import CircuitBreaker, CircuitOpen, EmailDispatcher, TokenBucket
+from giftexchange.email_rendering import AssignmentEmailRenderer
+from giftexchange.suppression import SuppressionCache
+from giftexchange.email_transports import (
+	SENDGRID_MAX_SUBSTITUTION_BYTES,
+	DjangoEmailTransport,
+	FileTransport,
+	SendGridTransport,
+)
+from giftexchange.jobs import enqueue_job
+from giftexchange.models import (
+	OUTBOX_RETRY_BASE_SECONDS,
+	EmailDeliveryStatus,
+	SuppressedEmail,
+	send_email,
+	suppressed_emails,
+	EmailSendRun,
+	GiftExchange,
+	Job,
+	OutboundEmail,
+	Participant,
+	queue_email,
+)
+from giftexchange.tests.test_admin_views import AdminViewTestCase
+
+
+@override_settings(JOBS_RUN_INLINE=True)
+class TestOutbox(AdminViewTestCase):
+	def _send_all(self):
+		url = reverse('giftexchange_send_assignment_email_all', kwargs={'giftexchange_id': self.giftexchange.pk})
+		return self.client.post(url, follow=True)
+
+	def test_send_all_queues_without_sending(self):
+		self._add_participants(5)
+		self.giftexchange.generate_assignemnts()
+		with mock.patch('giftexchange.models.send_email_batch') as send_email_batch:
+			result = self._send_all()
+		send_email_batch.assert_not_called()
+		job_id = OutboundEmail.objects.first().job_id
+		self.assertMessages(result, [
+			('success', '5 assignment emails queued for active users, 0 already sent or queued were skipped (run {}).'.format(job_id)),
+		])
+		self.assertEqual(OutboundEmail.objects.filter(job_id=job_id, status='pending').count(), 5)
+		self.assertFalse(self.giftexchange.exchangeassignment_set.filter(email_sent=True).exists())
+
+	def test_worker_sets_email_sent_on_delivery(self):
+		self._add_participants(3)
+		self.giftexchange.generate_assignemnts()
+		self._send_all()
+		with mock.patch('giftexchange.models.send_email_batch', return_value=[]) as send_email_batch:
+			call_command('send_queued_emails', '--once', stdout=StringIO())
+		self.assertEqual(send_email_batch.call_count, 1)
+		self.assertEqual(len(send_email_batch.call_args[0][0]), 3)
+		self.assertEqual(OutboundEmail.objects.filter(status='sent').count(), 3)
+		self.assertEqual(self.giftexchange.exchangeassignment_set.filter(email_sent=True).count(), 3)
+
+	def test_failures_back_off_then_fail(self):
+		outbound_email = queue_email('Subject', '<p>Body</p>', 'someone@example.com')
+		def fail_all(emails):
+			return [(email, Exception('SendGrid is down')) for email in emails]
+
+		with mock.patch('giftexchange.models.send_email_batch', side_effect=fail_all):
+			OutboundEmail.send_due(max_attempts=2)
+			outbound_email.refresh_from_db()
+			self.assertEqual(outbound_email.status, 'pending')
+			self.assertEqual(outbound_email.attempts, 1)
+			self.assertEqual(outbound_email.last_error, 'SendGrid is down')
+			self.assertGreater(
+				outbound_email.next_attempt_at,
+				timezone.now() + timedelta(seconds=OUTBOX_RETRY_BASE_SECONDS - 5)
+			)
+
+			self.assertEqual(OutboundEmail.send_due(max_attempts=2), 0)
+			OutboundEmail.objects.update(next_attempt_at=timezone.now())
+			OutboundEmail.send_due(max_attempts=2)
+		outbound_email.refresh_from_db()
+		self.assertEqual(outbound_email.status, 'failed')
+		self.assertEqual(outbound_email.attempts, 2)
+
+
+class TestEmailSendRun(AdminViewTestCase):
+	def setUp(self):
+		super(TestEmailSendRun, self).setUp()
+		self._add_participants(6)
+		self.giftexchange.generate_assignemnts()
+
+	def test_send_all_skips_sent_and_queued_assignments(self):
+		assignments = list(self.giftexchange.exchangeassignment_set.order_by('pk'))
+		assignments[0].email_sent = True
+		assignments[0].save()
+		assignments[1].send_assignment_email()
+
+		send_run = EmailSendRun.start(self.giftexchange)
+		send_run.enqueue(chunk_size=4)
+		self.assertEqual((send_run.status, send_run.queued_count, send_run.skipped_count), ('queued', 4, 2))
+		self.assertEqual(send_run.cursor, assignments[-1].pk)
+		self.assertEqual(OutboundEmail.objects.filter(assignment=assignments[1]).count(), 1)
+
+	def test_concurrent_enqueues_queue_each_assignment_once(self):
+		send_run = EmailSendRun.start(self.giftexchange)
+		other_worker_run = EmailSendRun.start(self.giftexchange)
+		self.assertEqual(other_worker_run, send_run)
+
+		send_run.enqueue(chunk_size=4)
+		other_worker_run.enqueue(chunk_size=4)
+		self.assertEqual(OutboundEmail.objects.count(), 6)
+		self.assertEqual((other_worker_run.queued_count, other_worker_run.skipped_count), (6, 0))
+
+		EmailSendRun.objects.filter(pk=send_run.pk).update(status='queuing', cursor=0)
+		EmailSendRun.start(self.giftexchange).enqueue()
+		self.assertEqual(OutboundEmail.objects.count(), 6)
+
+	def test_interrupted_run_resumes_from_cursor(self):
+		send_run = EmailSendRun.start(self.giftexchange)
+		bulk_create = OutboundEmail.objects.bulk_create
+		bulk_create_calls = []
+
+		def interrupted_bulk_create(*args, **kwargs):
+			bulk_create_calls.append(args)
+			if len(bulk_create_calls) > 1:
+				raise Exception('Worker died')
+			return bulk_create(*args, **kwargs)
+
+		with mock.patch.object(OutboundEmail.objects, 'bulk_create', side_effect=interrupted_bulk_create):
+			with self.assertRaises(Exception):
+				send_run.enqueue(chunk_size=2)
+		send_run.refresh_from_db()
+		self.assertEqual((send_run.status, send_run.queued_count), ('queuing', 2))
+		self.assertEqual(EmailSendRun.start(self.giftexchange), send_run)
+
+		url = reverse('giftexchange_resume_email_send_run', kwargs={'giftexchange_id': self.giftexchange.pk, 'run_id': send_run.pk})
+		self.assertTrue(send_run.is_interrupted)
+		self.client.post(url)
+		self.assertEqual(send_run.outbound_emails().count(), 2)
+		job = Job.objects.get(kind='resume_email_send_run')
+		self.assertEqual(job.get_params(), {'run_id': send_run.pk})
+		self.assertFalse(send_run.is_interrupted)
+
+		result = self.client.post(url, follow=True)
+		self.assertEqual(Job.objects.filter(kind='resume_email_send_run').count(), 1)
+		self.assertIn(
+			'Email run {} is still in progress and can not be resumed.'.format(send_run.job_id),
+			[message.message for message in result.context['messages'] if message.level_tag == 'warning']
+		)
+
+		call_command('run_workers', '--once', '--concurrency', '1', stdout=StringIO())
+		send_run.refresh_from_db()
+		self.assertEqual((send_run.status, send_run.queued_count), ('queued', 6))
+		self.assertEqual(send_run.outbound_emails().count(), 6)
+		self.assertEqual(Job.objects.get(pk=job.pk).status, 'succeeded')
+
+	def test_run_with_a_stale_job_lease_is_interrupted(self):
+		send_run = EmailSendRun.start(self.giftexchange)
+		job = enqueue_job('send_assignment_emails', giftexchange=self.giftexchange)
+		job.start()
+		self.assertFalse(send_run.is_interrupted)
+		self.assertFalse(send_run.progress()['resumable'])
+		Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+		self.assertTrue(send_run.is_interrupted)
+
+	def test_status_reports_progress_and_failed_runs_retry(self):
+		send_run = EmailSendRun.start(self.giftexchange)
+		send_run.enqueue()
+		send_run.outbound_emails().filter(pk__in=send_run.outbound_emails().values('pk')[:2]).update(status='failed')
+		with mock.patch('giftexchange.models.send_email_batch', return_value=[]):
+			OutboundEmail.send_due()
+		url = reverse('giftexchange_email_send_run_status', kwargs={'giftexchange_id': self.giftexchange.pk, 'run_id': send_run.pk})
+
+		progress = self.client.get(url).json()
+		self.assertEqual((progress['status'], progress['sent'], progress['failed'], progress['percent']), ('failed', 4, 2, 66))
+
+		send_run.refresh_from_db()
+		send_run.resume()
+		self.assertEqual(send_run.outbound_emails().filter(status='pending').count(), 2)
+		self.assertEqual(self.client.get(url).json()['status'], 'queued')
+
+
+@override_settings(JOBS_RUN_INLINE=True)
+class TestAssignmentEmailRendering(AdminViewTestCase):
+	def setUp(self):
+		super(TestAssignmentEmailRendering, self).setUp()
+		self._add_participants(20)
+		self.giftexchange.generate_assignemnts()
+		self.giftexchange.assignments_locked = True
+		self.giftexchange.save()
+
+	def _preview_all(self):
+		url = reverse('giftexchange_preview_assignment_email_all', kwargs={'giftexchange_id': self.giftexchange.pk})
+		return self.client.get(url)
+
+	def test_repeated_previews_render_each_email_once(self):
+		with mock.patch.object(AssignmentEmailRenderer, '_render', side_effect=AssignmentEmailRenderer._render, autospec=True) as render:
+			with CaptureQueriesContext(connection) as queries:
+				result = self._preview_all()
+			self.assertEqual(len(result.context['emails']), 20)
+			self.assertLess(len(queries), 15)
+			self.assertEqual(render.call_count, 20)
+
+			self._preview_all()
+			self.assertEqual(render.call_count, 20)
+
+	def test_participant_changes_invalidate_rendered_emails(self):
+		self._preview_all()
+		reciever = self.giftexchange.exchangeassignment_set.first().reciever
+		reciever.likes = 'Board games'
+		reciever.save()
+		result = self._preview_all()
+		self.assertIn('Board games', ''.join(email['html_body'] for email in result.context['emails']))
+
+
+	def test_email_version_tracks_the_database(self):
+		self.giftexchange.assignments_locked = False
+		self.giftexchange.generate_assignemnts(override_lock=True)
+		stored_version = GiftExchange.objects.get(pk=self.giftexchange.pk).email_version
+		self.assertEqual(self.giftexchange.email_version, stored_version)
+
+		assignment = self.giftexchange._assignment_queryset().first()
+		Participant.objects.filter(pk=assignment.reciever_id).update(likes='cats')
+		assignment.reciever.refresh_from_db()
+		self.assertIn('cats', AssignmentEmailRenderer(self.giftexchange).render(assignment)['html_body'])
+		assignment.reciever.likes = 'DOGS'
+		assignment.reciever.save()
+		giftexchange = GiftExchange.objects.get(pk=self.giftexchange.pk)
+		self.assertIn('DOGS', AssignmentEmailRenderer(giftexchange).render(assignment)['html_body'])
+
+		stale = GiftExchange.objects.get(pk=self.giftexchange.pk)
+		self.giftexchange.title = 'Renamed'
+		self.giftexchange.save()
+		stale.save()
+		self.assertEqual(stale.email_version, stored_version + 2)
+
+	def test_only_email_field_changes_bump_the_version(self):
+		version = GiftExchange.objects.get(pk=self.giftexchange.pk).email_version
+		participant = self.giftexchange.participant_set.first()
+		with self.assertNumQueries(1):
+			participant.set_gift('A scarf')
+		with self.assertNumQueries(1):
+			self.giftexchange.save(update_fields=['assignments_locked'])
+		self.appuser.default_likes = 'Tea'
+		self.appuser.save()
+		self.assertEqual(GiftExchange.objects.get(pk=self.giftexchange.pk).email_version, version)
+
+		participant.likes = 'Socks'
+		participant.save()
+		self.giftexchange.spending_limit = 50
+		self.giftexchange.save(update_fields=['spending_limit'])
+		self.assertEqual(self.giftexchange.email_version, version + 2)
+
+	def test_saving_an_unsaved_exchange_with_a_pk_inserts_it(self):
+		GiftExchange(pk=9999, title='Loaded', location='Here', email_version=4).save()
+		self.assertEqual(GiftExchange.objects.get(pk=9999).email_version, 5)
+
+
+class TestPreviewAssignmentEmail(AdminViewTestCase):
+	def setUp(self):
+		super(TestPreviewAssignmentEmail, self).setUp()
+		self._add_participants(30)
+		self.giftexchange.generate_assignemnts()
+		self.url = reverse('giftexchange_preview_assignment_email_all', kwargs={'giftexchange_id': self.giftexchange.pk})
+
+	def test_preview_is_paginated(self):
+		result = self.client.get(self.url)
+		self.assertEqual(len(result.context['emails']), 25)
+		self.assertContains(result, 'Page 1 of 2')
+		result = self.client.get(self.url, {'page': 2})
+		self.assertEqual(len(result.context['emails']), 5)
+
+	def test_preview_streams_every_email(self):
+		with CaptureQueriesContext(connection) as queries:
+			result = self.client.get(self.url, {'stream': 1})
+			content = b''.join(result.streaming_content).decode('utf-8')
+		self.assertEqual(content.count('SUBJECT: You have been given an assignment'), 30)
+		self.assertTrue(content.rstrip().endswith('</body>'))
+		self.assertLess(len(queries), 15)
+
+
+@override_settings(DELIVERY_WEBHOOK_TOKEN='secret')
+class TestDeliveryEventWebhook(AdminViewTestCase):
+	def setUp(self):
+		super(TestDeliveryEventWebhook, self).setUp()
+		self._add_participants(3)
+		self.giftexchange.generate_assignemnts()
+		self.url = reverse('email_delivery_event_webhook')
+
+	def _post_events(self, events, url=None):
+		return self.client.post(url or self.url + '?token=secret', data=json.dumps(events), content_type='application/json')
+
+	def test_events_update_recipients_and_assignments(self):
+		assignments = list(self.giftexchange.exchangeassignment_set.select_related('giver').order_by('pk'))
+		outbound_email = assignments[2].send_assignment_email()
+		result = self._post_events([
+			{'email': assignments[0].giver.email, 'event': 'delivered', 'timestamp': 100, 'assignment_id': str(assignments[0].pk)},
+			{'email': assignments[0].giver.email, 'event': 'open', 'timestamp': 200, 'assignment_id': str(assignments[0].pk)},
+			{'email': assignments[1].giver.email, 'event': 'bounce', 'timestamp': 100, 'reason': 'Mailbox full', 'assignment_id': str(assignments[1].pk)},
+			{'email': assignments[2].giver.email, 'event': 'dropped', 'timestamp': 100, 'outbound_email_id': str(outbound_email.pk)},
+			{'email': 'other@example.com', 'event': 'processed', 'timestamp': 100},
+		])
+		self.assertEqual(result.status_code, 204)
+		self.assertEqual(
+			[assignment.delivery_status for assignment in self.giftexchange.exchangeassignment_set.order_by('pk')],
+			['open', 'bounce', 'dropped']
+		)
+		self.assertEqual(EmailDeliveryStatus.objects.get(email=assignments[1].giver.email).reason, 'Mailbox full')
+		self.assertFalse(EmailDeliveryStatus.objects.filter(email='other@example.com').exists())
+
+		self._post_events([
+			{'email': assignments[0].giver.email, 'event': 'delivered', 'timestamp': 150, 'assignment_id': str(assignments[0].pk)},
+		])
+		self.assertEqual(EmailDeliveryStatus.objects.get(email=assignments[0].giver.email).status, 'open')
+
+		url = reverse('giftexchange_manage_assignments', kwargs={'giftexchange_id': self.giftexchange.pk})
+		self.assertContains(self.client.get(url), 'badge-danger', count=2)
+
+	def test_large_payload_uses_bulk_queries(self):
+		events = [
+			{'email': 'recipient{}@example.com'.format(i % 500), 'event': 'delivered', 'timestamp': i}
+			for i in range(2000)
+		]
+		with CaptureQueriesContext(connection) as queries:
+			self._post_events(events)
+		self.assertEqual(EmailDeliveryStatus.objects.count(), 500)
+		self.assertLess(len(queries), 15)
+
+	def test_malformed_events_are_skipped(self):
+		assignment = self.giftexchange.exchangeassignment_set.select_related('giver').order_by('pk').first()
+		result = self._post_events([
+			{'email': 'bad-id@example.com', 'event': 'delivered', 'timestamp': 100, 'assignment_id': 'abc'},
+			{'email': 'bad-outbound@example.com', 'event': 'delivered', 'timestamp': 100, 'outbound_email_id': [1]},
+			{'email': 'bad-time@example.com', 'event': 'bounce', 'timestamp': 'yesterday'},
+			{'email': ['not', 'an', 'email'], 'event': 'delivered', 'timestamp': 100},
+			'not an event',
+			{'email': assignment.giver.email, 'event': 'delivered', 'timestamp': 100, 'assignment_id': str(assignment.pk)},
+		])
+		self.assertEqual(result.status_code, 204)
+		self.assertEqual(list(EmailDeliveryStatus.objects.values_list('email', flat=True)), [assignment.giver.email])
+		assignment.refresh_from_db()
+		self.assertEqual(assignment.delivery_status, 'delivered')
+
+	def test_token_is_required(self):
+		self.assertEqual(self._post_events([]).status_code, 204)
+		self.assertEqual(self._post_events([], url=self.url).status_code, 403)
+		self.assertEqual(self._post_events([], url=self.url + '?token=wrong').status_code, 403)
+		with override_settings(DELIVERY_WEBHOOK_TOKEN=None):
+			result = self._post_events([{'email': 'anyone@example.com', 'event': 'spamreport', 'timestamp': 1}], url=self.url)
+			self.assertEqual(result.status_code, 403)
+		self.assertFalse(SuppressedEmail.objects.exists())
+
+
+class TestSuppression(AdminViewTestCase):
+	def test_cache_reloads_after_ttl(self):
+		clock = FakeClock()
+		loads = []
+
+		def load():
+			loads.append(clock.now)
+			return ['Bounced@Example.com']
+
+		suppression = SuppressionCache(load, ttl=60, clock=clock)
+		self.assertIn('bounced@example.com', suppression)
+		self.assertNotIn('other@example.com', suppression)
+		clock.now += 59
+		self.assertIn('BOUNCED@example.com', suppression)
+		self.assertEqual(loads, [0])
+		clock.now += 1
+		self.assertIn('bounced@example.com', suppression)
+		self.assertEqual(loads, [0, 60])
+
+	@override_settings(SEND_EMAILS=True)
+	def test_suppressed_addresses_are_not_sent(self):
+		SuppressedEmail.objects.create(email='Bounced@example.com', reason='bounce')
+		queue_email('Subject', '<p>Body</p>', 'bounced@example.com')
+		queue_email('Subject', '<p>Body</p>', 'fine@example.com')
+		with mock.patch('giftexchange.models.get_dispatcher') as get_dispatcher:
+			get_dispatcher.return_value.send_many.return_value = []
+			OutboundEmail.send_due()
+			self.assertFalse(send_email('Login link', '<p>Link</p>', 'bounced@example.com'))
+			with self.assertNumQueries(0):
+				self.assertIn('bounced@example.com', suppressed_emails)
+		sent = get_dispatcher.return_value.send_many.call_args[0][0]
+		self.assertEqual([email.to_email for email in sent], ['fine@example.com'])
+		get_dispatcher.return_value.send.assert_not_called()
+		suppressed = OutboundEmail.objects.get(to_email='bounced@example.com')
+		self.assertEqual((suppressed.status, suppressed.attempts), ('failed', 1))
+
+	@override_settings(DELIVERY_WEBHOOK_TOKEN='secret')
+	def test_hard_bounces_and_complaints_are_suppressed(self):
+		url = reverse('email_delivery_event_webhook') + '?token=secret'
+		self.client.post(url, content_type='application/json', data=json.dumps([
+			{'email': 'hard@example.com', 'event': 'bounce', 'type': 'bounce', 'timestamp': 1},
+			{'email': 'soft@example.com', 'event': 'bounce', 'type': 'blocked', 'timestamp': 1},
+			{'email': 'Spam@example.com', 'event': 'spamreport', 'timestamp': 1},
+		]))
+		self.assertEqual(
+			sorted(SuppressedEmail.objects.values_list('email', 'reason')),
+			[('hard@example.com', 'bounce'), ('spam@example.com', 'complaint')]
+		)
+		self.assertIn('hard@example.com', suppressed_emails)
+		self.assertNotIn('soft@example.com', suppressed_emails)
+
+
+class FakeSendGridHandler(BaseHTTPRequestHandler):
+	def do_POST(self):
+		body = self.rfile.read(int(self.headers['Content-Length']))
+		request_body = json.loads(body.decode('utf-8'))
+		self.server.requests.append((self.path, request_body))
+		recipients = [personalization['to'][0]['email'] for personalization in request_body['personalizations']]
+		rejected = any(recipient in self.server.rejected_emails for recipient in recipients)
+		self.send_response(400 if rejected else self.server.status_code)
+		self.send_header('Content-Length', '0')
+		self.end_headers()
+
+	def log_message(self, format, *args):
+		pass
+
+
+class FakeSendGridTestCase(TestCase):
+	def setUp(self):
+		self.server = HTTPServer(('127.0.0.1', 0), FakeSendGridHandler)
+		self.server.requests = []
+		self.server.rejected_emails = set()
+		self.server.status_code = 202
+		self.host = 'http://127.0.0.1:{}'.format(self.server.server_port)
+		thread = threading.Thread(target=self.server.serve_forever)
+		thread.daemon = True
+		thread.start()
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+
+class TestSendGridTransport(FakeSendGridTestCase):
+	def test_batch_is_one_request_with_personalizations(self):
+		emails = [
+			OutboundEmail(pk=i, to_email='person{}@example.com'.format(i), subject='Hi {}'.format(i), html_body='<p>{}</p>'.format(i))
+			for i in range(1, 6)
+		]
+		transport = SendGridTransport('test-key', host=self.host, max_personalizations=2)
+		batches = list(transport.chunk(emails))
+		self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+		for batch in batches:
+			transport.send_batch(batch)
+		self.assertEqual(len(self.server.requests), 3)
+		path, body = self.server.requests[0]
+		self.assertEqual(path, '/v3/mail/send')
+		self.assertEqual(body['content'], [{'type': 'text/html', 'value': '-body-'}])
+		self.assertEqual(body['personalizations'][1], {
+			'to': [{'email': 'person2@example.com'}],
+			'subject': 'Hi 2',
+			'substitutions': {'-body-': '<p>2</p>'},
+			'custom_args': {'outbound_email_id': '2'},
+		})
+
+	def test_large_body_is_sent_alone(self):
+		large_body = 'x' * (SENDGRID_MAX_SUBSTITUTION_BYTES + 1)
+		emails = [
+			OutboundEmail(to_email='small@example.com', subject='Small', html_body='<p>small</p>'),
+			OutboundEmail(to_email='large@example.com', subject='Large', html_body=large_body),
+		]
+		transport = SendGridTransport('test-key', host=self.host)
+		batches = list(transport.chunk(emails))
+		self.assertEqual([[email.to_email for email in batch] for batch in batches], [['large@example.com'], ['small@example.com']])
+		self.assertEqual(transport.request_body(batches[0])['content'][0]['value'], large_body)
+
+	def test_worker_sends_through_transport(self):
+		queue_email('Subject', '<p>One</p>', 'one@example.com')
+		queue_email('Subject', '<p>Two</p>', 'two@example.com')
+		queue_email('Subject', '<p>Test</p>', 'someone@gifterator3ktest.com')
+		with override_settings(SEND_EMAILS=True, SENDGRID_API_KEY='test-key', SENDGRID_API_HOST=self.host):
+			OutboundEmail.send_due()
+		self.assertEqual(len(self.server.requests), 1)
+		self.assertEqual(len(self.server.requests[0][1]['personalizations']), 2)
+		self.assertEqual(OutboundEmail.objects.filter(status='sent').count(), 3)
+
+	def test_rejected_request_only_charges_the_bad_email(self):
+		for i in range(8):
+			queue_email('Subject', '<p>Hi</p>', 'person{}@example.com'.format(i))
+		self.server.rejected_emails.add('person5@example.com')
+		with override_settings(SEND_EMAILS=True, SENDGRID_API_KEY='test-key', SENDGRID_API_HOST=self.host):
+			OutboundEmail.send_due()
+		self.assertEqual(OutboundEmail.objects.filter(status='sent').count(), 7)
+		rejected = OutboundEmail.objects.get(status='pending')
+		self.assertEqual((rejected.to_email, rejected.attempts), ('person5@example.com', 1))
+		self.assertIn('400', rejected.last_error)
+		# 8 -> 4 -> 2 -> 1, with the accepted halves sent on the way down
+		self.assertEqual(len(self.server.requests), 7)
+
+
+class FakeClock(object):
+	def __init__(self):
+		self.now = 0.0
+
+	def __call__(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.now += seconds
+
+
+class TestTokenBucket(TestCase):
+	def test_waits_for_tokens_after_burst(self):
+		clock = FakeClock()
+		bucket = TokenBucket(rate=2, capacity=3, clock=clock, sleep=clock.sleep)
+		for i in range(3):
+			bucket.acquire()
+		self.assertEqual(clock.now, 0)
+		bucket.acquire()
+		self.assertAlmostEqual(clock.now, 0.5)
+		bucket.acquire()
+		self.assertAlmostEqual(clock.now, 1.0)
+
+	def test_rate_of_zero_is_unlimited(self):
+		clock = FakeClock()
+		for rate in (0, -1, None):
+			bucket = TokenBucket(rate=rate, clock=clock, sleep=clock.sleep)
+			for i in range(100):
+				bucket.acquire()
+		self.assertEqual(clock.now, 0)
+
+
+class TestEmailDispatcher(FakeSendGridTestCase):
+	def _dispatcher(self, clock):
+		return EmailDispatcher(
+			SendGridTransport('test-key', host=self.host, max_personalizations=2),
+			max_workers=3,
+			rate_limiter=TokenBucket(rate=1000),
+			circuit_breaker=CircuitBreaker(failure_threshold=2, reset_seconds=30, clock=clock)
+		)
+
+	def test_send_many_sends_every_batch(self):
+		emails = [OutboundEmail(to_email='person{}@example.com'.format(i), subject='Hi', html_body='<p>Hi</p>') for i in range(7)]
+		failures = self._dispatcher(FakeClock()).send_many(emails)
+		self.assertEqual(failures, [])
+		self.assertEqual(len(self.server.requests), 4)
+		recipients = sorted(
+			personalization['to'][0]['email']
+			for path, body in self.server.requests for personalization in body['personalizations']
+		)
+		self.assertEqual(recipients, sorted(email.to_email for email in emails))
+
+	def test_auth_errors_are_not_split(self):
+		self.server.status_code = 401
+		emails = [OutboundEmail(to_email='person{}@example.com'.format(i), subject='Hi', html_body='<p>Hi</p>') for i in range(2)]
+		failures = self._dispatcher(FakeClock()).send_many(emails)
+		self.assertEqual([email for email, error in failures], emails)
+		self.assertEqual(len(self.server.requests), 1)
+
+	def test_circuit_opens_on_rate_limit_responses(self):
+		clock = FakeClock()
+		dispatcher = self._dispatcher(clock)
+		self.server.status_code = 429
+		for i in range(2):
+			with self.assertRaises(Exception):
+				dispatcher.send('Subject', '<p>Body</p>', 'someone@example.com')
+		with self.assertRaises(CircuitOpen):
+			dispatcher.send('Subject', '<p>Body</p>', 'someone@example.com')
+		self.assertEqual(len(self.server.requests), 2)
+
+		clock.now += 31
+		self.server.status_code = 202
+		dispatcher.send('Subject', '<p>Body</p>', 'someone@example.com')
+		self.assertEqual(len(self.server.requests), 3)
+		self.assertFalse(dispatcher.circuit_breaker.is_open)
+
+
+class TestLocalTransports(TestCase):
+	def _emails(self, count):
+		return [OutboundEmail(to_email='person{}@example.com'.format(i), subject='Hi {}'.format(i), html_body='<p>{}</p>'.format(i)) for i in range(count)]
+
+	def test_file_transport_appends_to_mbox(self):
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, 'sent.mbox')
+			transport = FileTransport(path, batch_size=2)
+			for batch in transport.chunk(self._emails(3)):
+				transport.send_batch(batch)
+			messages = list(mailbox.mbox(path))
+		self.assertEqual([message['To'] for message in messages], ['person0@example.com', 'person1@example.com', 'person2@example.com'])
+		self.assertEqual(messages[2]['Subject'], 'Hi 2')
+
+	def test_django_transport_uses_email_backend(self):
+		DjangoEmailTransport().send_batch(self._emails(2))
+		self.assertEqual([message.to for message in mail.outbox], [['person0@example.com'], ['person1@example.com']])
+		self.assertEqual(mail.outbox[0].content_subtype, 'html')
+
+	def test_throughput_benchmark(self):
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, 'sent.mbox')
+			output = StringIO()
+			with override_settings(EMAIL_TRANSPORT_FILE_PATH=path):
+				call_command('benchmark_email_throughput', '--participants', '25', '--chunk-size', '10', stdout=output)
+			self.assertEqual(len(mailbox.mbox(path)), 25)
+		self.assertIn('Sent 25 emails (0 failed) through file', output.getvalue())
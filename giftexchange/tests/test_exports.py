@@ -0,0 +1,64 @@
+import csv
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.urls import reverse
+
+from giftexchange.models import Participant
+from giftexchange.tests.test_admin_views import AdminViewTestCase
+
+
+class TestExports(AdminViewTestCase):
+	def setUp(self):
+		super(TestExports, self).setUp()
+		self._add_participants(5)
+		Participant.objects.filter(email='tester0@example.com').update(likes='cats, "quotes"', allergies_sensitivities='nuts')
+
+	def _export(self, export_name, export_format):
+		url = reverse('giftexchange_export', kwargs={'giftexchange_id': self.giftexchange.pk, 'export_name': export_name})
+		result = self.client.get(url, {'format': export_format})
+		self.assertTrue(result.streaming)
+		return b''.join(result.streaming_content).decode('utf-8')
+
+	def test_participants_csv_uses_upload_columns(self):
+		rows = list(csv.DictReader(StringIO(self._export('participants', 'csv'))))
+		self.assertEqual(len(rows), 5)
+		self.assertEqual(
+			(rows[0]['email'], rows[0]['likes'], rows[0]['allergies'], rows[0]['status']),
+			('tester0@example.com', 'cats, "quotes"', 'nuts', 'active')
+		)
+
+	def test_assignments_follow_the_loop(self):
+		self.giftexchange.generate_assignemnts()
+		rows = [json.loads(line) for line in self._export('assignments', 'jsonl').splitlines()]
+		self.assertEqual([row['loop_index'] for row in rows], list(range(5)))
+		for previous, current in zip(rows, rows[1:] + rows[:1]):
+			self.assertEqual(previous['reciever_email'], current['giver_email'])
+
+	def test_gifts(self):
+		self.giftexchange.generate_assignemnts()
+		Participant.objects.filter(email='tester1@example.com').update(gift='Socks')
+		rows = list(csv.DictReader(StringIO(self._export('gifts', 'csv'))))
+		gifts = {row['reciever_email']: row['gift'] for row in rows}
+		self.assertEqual(gifts['tester1@example.com'], 'Socks')
+		self.assertEqual(gifts['tester2@example.com'], '')
+
+	def test_unknown_export(self):
+		url = reverse('giftexchange_export', kwargs={'giftexchange_id': self.giftexchange.pk, 'export_name': 'secrets'})
+		self.assertEqual(self.client.get(url).status_code, 404)
+		url = reverse('giftexchange_export', kwargs={'giftexchange_id': self.giftexchange.pk, 'export_name': 'gifts'})
+		self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 404)
+
+	def test_export_command(self):
+		output = StringIO()
+		call_command('export_giftexchange', self.giftexchange.pk, 'participants', '--format', 'jsonl', stdout=output)
+		self.assertEqual(len(output.getvalue().splitlines()), 5)
+
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, 'participants.csv')
+			call_command('export_giftexchange', self.giftexchange.pk, 'participants', '--output', path, stdout=StringIO())
+			with open(path, newline='') as exported:
+				self.assertEqual(len(list(csv.DictReader(exported))), 5)
@@ -0,0 +1,81 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from giftexchange.jobs import enqueue_job
+from giftexchange.models import ExclusionGroup, Job, OutboundEmail
+from giftexchange.tests.test_admin_views import AdminViewTestCase
+
+
+class TestJobs(AdminViewTestCase):
+	def setUp(self):
+		super(TestJobs, self).setUp()
+		self._add_participants(6)
+
+	def test_admin_actions_queue_jobs_for_workers(self):
+		self.client.get(reverse('giftexchange_set_assignments', kwargs={'giftexchange_id': self.giftexchange.pk}), {'seed': 7})
+		job = Job.objects.get()
+		self.assertEqual((job.kind, job.status, job.get_params()), ('generate_assignments', 'queued', {'seed': 7}))
+		self.assertFalse(self.giftexchange.has_assignments)
+
+		call_command('run_workers', '--once', '--concurrency', '1', stdout=StringIO())
+		job.refresh_from_db()
+		self.assertEqual(job.status, 'succeeded')
+		self.assertEqual(job.get_result(), {'assignment_count': 6, 'seed': 7})
+		self.assertEqual(self.giftexchange.exchangeassignment_set.count(), 6)
+
+		url = reverse('giftexchange_job_status', kwargs={'giftexchange_id': self.giftexchange.pk, 'job_id': job.pk})
+		status = self.client.get(url).json()
+		self.assertEqual((status['status'], status['progress'], status['total'], status['percent']), ('succeeded', 1, 1, 100))
+
+	def test_send_all_job_reports_progress(self):
+		self.giftexchange.generate_assignemnts()
+		self.client.post(reverse('giftexchange_send_assignment_email_all', kwargs={'giftexchange_id': self.giftexchange.pk}))
+		self.assertEqual(OutboundEmail.objects.count(), 0)
+		call_command('run_workers', '--once', '--concurrency', '1', stdout=StringIO())
+		job = Job.objects.get(kind='send_assignment_emails')
+		self.assertEqual((job.status, job.progress, job.total), ('succeeded', 6, 6))
+		self.assertEqual(OutboundEmail.objects.count(), 6)
+
+	@override_settings(JOBS_RUN_INLINE=True)
+	def test_failed_job_reports_problems(self):
+		group = ExclusionGroup.objects.create(giftexchange=self.giftexchange, name='Everyone')
+		group.members.set(self.giftexchange.participant_set.all())
+		result = self.client.get(reverse('giftexchange_set_assignments', kwargs={'giftexchange_id': self.giftexchange.pk}), follow=True)
+		job = Job.objects.get()
+		self.assertEqual(job.status, 'failed')
+		self.assertTrue(job.get_result()['problems'])
+		self.assertEqual(
+			[(message.level_tag, message.message) for message in result.context['messages']],
+			[('error', problem) for problem in job.get_result()['problems']]
+		)
+
+	@override_settings(JOBS_RUN_INLINE=True)
+	def test_only_assignment_errors_report_problems(self):
+		self.giftexchange.lock()
+		job = enqueue_job('generate_assignments', giftexchange=self.giftexchange)
+		self.assertEqual((job.status, job.get_result()), ('failed', {'problems': ['Assignments are locked for this gift exchange']}))
+
+		with mock.patch('giftexchange.models.GiftExchange.generate_assignemnts', side_effect=KeyError('bug')):
+			with self.assertLogs('giftexchange.jobs', level='ERROR'):
+				job = enqueue_job('generate_assignments', giftexchange=self.giftexchange)
+		self.assertEqual(job.status, 'failed')
+		self.assertIsNone(job.get_result())
+
+	def test_stale_jobs_are_reclaimed_then_failed(self):
+		job = enqueue_job('generate_assignments', giftexchange=self.giftexchange)
+		self.assertEqual(Job.claim_next(), job)
+		self.assertIsNone(Job.claim_next())
+
+		for attempt in range(2):
+			Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+			self.assertEqual(Job.claim_next(), job)
+		Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+		self.assertIsNone(Job.claim_next())
+		job.refresh_from_db()
+		self.assertEqual((job.status, job.attempts), ('failed', 3))
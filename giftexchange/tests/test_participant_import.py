@@ -0,0 +1,216 @@
+import csv
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import override_settings
+from django.urls import reverse
+
+from giftexchange.models import AppUser, GiftExchange, Job, Participant, ParticipantImport
+from giftexchange.participant_import import PARTICIPANT_CSV_HEADER, ParticipantCSVReader, ParticipantImportError, iter_decoded_lines
+from giftexchange.tests.test_admin_views import AdminViewTestCase
+
+
+CSV_HEADER = 'first_name,last_name,email,shipping_address,likes,dislikes,allergies,other\n'
+
+
+def participant_csv(participant_count):
+	lines = [CSV_HEADER]
+	for i in range(participant_count):
+		lines.append('Tester{0},User,tester{0}@example.com,"{0} Main St, Springfield",cats,,nuts,\n'.format(i))
+	return ''.join(lines)
+
+
+def byte_chunks(content, chunk_size):
+	content = content.encode('utf-8')
+	for start in range(0, len(content), chunk_size):
+		yield content[start:start + chunk_size]
+
+
+class TestParticipantCSVReader(AdminViewTestCase):
+	def test_decodes_across_chunk_boundaries(self):
+		content = 'Zoë,Ünal\n"multi\nline",x'
+		lines = list(iter_decoded_lines(byte_chunks(content, 1)))
+		self.assertEqual(lines, ['Zoë,Ünal\n', '"multi\n', 'line",x'])
+
+	def test_reads_rows_in_batches(self):
+		reader = ParticipantCSVReader(byte_chunks(participant_csv(25), 64))
+		batches = list(reader.batches(batch_size=10))
+		self.assertEqual([len(batch) for batch in batches], [10, 10, 5])
+		self.assertEqual(batches[2][4]['email'], 'tester24@example.com')
+		self.assertEqual(batches[0][0]['shipping_address'], '0 Main St, Springfield')
+
+	def test_invalid_header(self):
+		with self.assertRaises(ParticipantImportError):
+			ParticipantCSVReader(byte_chunks('name,email\nA,a@example.com\n', 8))
+
+	def test_rejects_non_utf8(self):
+		with self.assertRaises(ParticipantImportError):
+			list(ParticipantCSVReader([CSV_HEADER.encode('utf-8'), 'Zoë'.encode('latin-1')]))
+
+
+class TestParticipantBulkUpsert(AdminViewTestCase):
+	def _row(self, i, **values):
+		row = {'email': 'tester{}@example.com'.format(i), 'first_name': 'Tester{}'.format(i), 'last_name': 'User'}
+		row.update(values)
+		return row
+
+	def test_counts_created_updated_and_unchanged(self):
+		self._add_participants(3)
+		Participant.objects.filter(email='tester1@example.com').update(likes='cats')
+		rows = [
+			self._row(0),
+			self._row(1, likes='dogs'),
+			self._row(2, first_name='Renamed'),
+			self._row(3, likes='tea'),
+			self._row(4),
+		]
+		with self.assertNumQueries(6):
+			counts = Participant.bulk_upsert(self.giftexchange, rows)
+		self.assertEqual(counts, {'created': 2, 'updated': 2, 'unchanged': 1})
+		self.assertEqual(Participant.objects.get(email='tester1@example.com').likes, 'dogs')
+		self.assertEqual(Participant.objects.get(email='tester2@example.com').first_name, 'Renamed')
+		self.assertEqual(Participant.objects.get(email='tester3@example.com').likes, 'tea')
+
+	def test_matches_emails_ignoring_case(self):
+		self._add_participants(1)
+		Participant.objects.filter(email='tester0@example.com').update(email='Tester0@Example.com')
+		counts = Participant.bulk_upsert(self.giftexchange, [
+			self._row(0, email='TESTER0@example.com', likes='cats'),
+			self._row(1, email='Tester1@Example.com'),
+		])
+		self.assertEqual(counts, {'created': 1, 'updated': 1, 'unchanged': 0})
+		self.assertEqual(
+			sorted(self.giftexchange.participant_set.values_list('email', 'likes')),
+			[('Tester0@Example.com', 'cats'), ('Tester1@Example.com', None)]
+		)
+
+		counts = Participant.bulk_upsert(self.giftexchange, [self._row(1, email='TESTER1@EXAMPLE.COM')])
+		self.assertEqual(counts, {'created': 0, 'updated': 0, 'unchanged': 1})
+		self.assertEqual(self.giftexchange.participant_set.count(), 2)
+
+	def test_imported_email_keeps_its_case_for_the_app_user(self):
+		djangouser = User.objects.create(email='Jane@Example.com', username='Jane@Example.com', first_name='Jane', last_name='Doe')
+		appuser = AppUser.objects.create(djangouser=djangouser)
+		Participant.bulk_upsert(self.giftexchange, [self._row(0, email='Jane@Example.com')])
+		participant = self.giftexchange.participant_set.get()
+		self.assertEqual(participant.email, 'Jane@Example.com')
+		self.assertEqual(participant.appuser, appuser)
+		self.assertEqual(appuser.exchange_participant(self.giftexchange), participant)
+
+	def test_blank_values_keep_existing(self):
+		self._add_participants(1)
+		Participant.objects.update(likes='cats')
+		counts = Participant.bulk_upsert(self.giftexchange, [self._row(0, likes='')])
+		self.assertEqual(counts, {'created': 0, 'updated': 0, 'unchanged': 1})
+		self.assertEqual(Participant.objects.get().likes, 'cats')
+
+	def test_bumps_email_version_only_on_change(self):
+		self._add_participants(1)
+		version = GiftExchange.objects.get(pk=self.giftexchange.pk).email_version
+		Participant.bulk_upsert(self.giftexchange, [self._row(0)])
+		self.assertEqual(GiftExchange.objects.get(pk=self.giftexchange.pk).email_version, version)
+		Participant.bulk_upsert(self.giftexchange, [self._row(0, dislikes='socks')])
+		self.assertEqual(GiftExchange.objects.get(pk=self.giftexchange.pk).email_version, version + 1)
+
+
+class TestParticipantUpload(AdminViewTestCase):
+	def _upload(self, content, **extra):
+		upload = SimpleUploadedFile('participants.csv', content.encode('utf-8'))
+		url = reverse('giftexchange_upload_participants', kwargs={'giftexchange_id': self.giftexchange.pk})
+		return self.client.post(url, {'file': upload}, **extra)
+
+	@override_settings(JOBS_RUN_INLINE=True, FILE_UPLOAD_MAX_MEMORY_SIZE=1024)
+	def test_upload_larger_than_one_chunk(self):
+		result = self._upload(participant_csv(1200), follow=True)
+		self.assertEqual(self.giftexchange.participant_set.count(), 1200)
+		self.assertMessages(result, [
+			('success', 'Added 1200 participants, updated 0, left 0 unchanged and skipped 0 rows with errors.')
+		])
+		participant_import = ParticipantImport.objects.get()
+		self.assertEqual(participant_import.line_count, 1201)
+		self.assertFalse(participant_import.participantimportchunk_set.exists())
+		self.assertEqual((participant_import.job.progress, participant_import.job.total), (1200, 1200))
+
+	def test_failed_run_keeps_the_file_for_a_retry(self):
+		self._upload(participant_csv(30))
+		participant_import = ParticipantImport.objects.get()
+		bulk_upsert = Participant.bulk_upsert
+		calls = []
+
+		def interrupted_bulk_upsert(*args, **kwargs):
+			calls.append(args)
+			if len(calls) > 1:
+				raise OperationalError('connection lost')
+			return bulk_upsert(*args, **kwargs)
+
+		with mock.patch.object(Participant, 'bulk_upsert', side_effect=interrupted_bulk_upsert):
+			with self.assertRaises(OperationalError):
+				participant_import.run(batch_size=10)
+		self.assertTrue(participant_import.participantimportchunk_set.exists())
+
+		counts = participant_import.run(batch_size=10)
+		self.assertEqual((counts['created'], counts['unchanged']), (20, 10))
+		self.assertEqual(self.giftexchange.participant_set.count(), 30)
+		self.assertFalse(participant_import.participantimportchunk_set.exists())
+
+	def test_unreadable_file_is_discarded(self):
+		self._upload('name,email\nA,a@example.com\n')
+		participant_import = ParticipantImport.objects.get()
+		with self.assertRaises(ParticipantImportError):
+			participant_import.run()
+		self.assertFalse(participant_import.participantimportchunk_set.exists())
+
+	def test_upload_is_imported_by_a_worker(self):
+		self._upload(participant_csv(30))
+		job = Job.objects.get()
+		self.assertEqual((job.kind, job.status), ('import_participants', 'queued'))
+		self.assertFalse(self.giftexchange.participant_set.exists())
+
+		call_command('run_workers', '--once', '--concurrency', '1', stdout=StringIO())
+		job.refresh_from_db()
+		self.assertEqual(job.status, 'succeeded')
+		self.assertEqual(self.giftexchange.participant_set.count(), 30)
+		result = self.client.get(reverse('giftexchange_upload_participants', kwargs={'giftexchange_id': self.giftexchange.pk}))
+		self.assertContains(result, 'added 30, updated 0')
+
+	@override_settings(JOBS_RUN_INLINE=True)
+	def test_bad_rows_are_reported_not_fatal(self):
+		content = (
+			'Email,First_Name,Last_Name,Likes\n'
+			'ok@example.com,Ok,User,tea\n'
+			'not-an-email,Bad,Email,\n'
+			'noname@example.com,,User,\n'
+			'OK@example.com,Again,User,\n'
+			'ok2@example.com,Ok,Two,"multi\nline"\n'
+		)
+		result = self._upload(content, follow=True)
+		self.assertEqual(
+			sorted(self.giftexchange.participant_set.values_list('email', flat=True)),
+			['ok2@example.com', 'ok@example.com']
+		)
+		self.assertMessages(result, [
+			('success', 'Added 2 participants, updated 0, left 0 unchanged and skipped 3 rows with errors.')
+		])
+		participant_import = ParticipantImport.objects.get()
+		errors_url = reverse('giftexchange_participant_import_errors', kwargs={
+			'giftexchange_id': self.giftexchange.pk,
+			'import_id': participant_import.pk
+		})
+		self.assertContains(result, errors_url)
+		report = b''.join(self.client.get(errors_url).streaming_content).decode('utf-8')
+		self.assertEqual(list(csv.reader(StringIO(report))), [
+			['line', 'reason'] + PARTICIPANT_CSV_HEADER,
+			['3', 'bad email', 'Bad', 'Email', 'not-an-email', '', '', '', '', ''],
+			['4', 'missing name', '', 'User', 'noname@example.com', '', '', '', '', ''],
+			['5', 'duplicate in file', 'Again', 'User', 'OK@example.com', '', '', '', '', ''],
+		])
+
+	@override_settings(JOBS_RUN_INLINE=True)
+	def test_missing_required_column_fails_the_job(self):
+		result = self._upload('first_name,email\nA,a@example.com\n', follow=True)
+		self.assertMessages(result, [('error', 'Invalid header, missing columns: last_name')])
+		self.assertEqual(Job.objects.get().status, 'failed')
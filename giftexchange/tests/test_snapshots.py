@@ -0,0 +1,103 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.urls import reverse
+
+from giftexchange.models import ExclusionGroup, ExclusionPair, GiftExchange, Participant
+from giftexchange.snapshots import SNAPSHOT_VERSION, SnapshotError, clone_giftexchange, restore_snapshot, snapshot_chunks
+from giftexchange.tests.test_admin_views import AdminViewTestCase
+
+
+class TestSnapshots(AdminViewTestCase):
+	def setUp(self):
+		super(TestSnapshots, self).setUp()
+		self._add_participants(8)
+		self.giftexchange.assignment_seed = 3
+		self.giftexchange.save()
+		participants = list(self.giftexchange.participant_set.order_by('pk'))
+		ExclusionPair.objects.create(giftexchange=self.giftexchange, giver=participants[0], reciever=participants[1])
+		group = ExclusionGroup.objects.create(giftexchange=self.giftexchange, name='Household')
+		group.members.set(participants[2:4])
+		self.giftexchange.generate_assignemnts(seed=3)
+		Participant.objects.filter(pk=participants[4].pk).update(gift='Socks', likes='tea')
+
+	def _snapshot(self, giftexchange):
+		return io.BytesIO(b''.join(snapshot_chunks(giftexchange)))
+
+	def _loop(self, giftexchange):
+		return [
+			(assignment.giver.email, assignment.reciever.email, assignment.position)
+			for assignment in giftexchange.ordered_assignments
+		]
+
+	def test_restore_round_trip(self):
+		restorer = restore_snapshot(self._snapshot(self.giftexchange), title='Restored')
+		restored = restorer.giftexchange
+		self.assertEqual(restorer.counts, {'participants': 8, 'assignments': 8, 'admins': 1, 'missing_admins': 0})
+		self.assertEqual((restored.title, restored.location, restored.assignment_seed), ('Restored', 'Washington, DC', 3))
+		self.assertEqual(list(restored.admin_appuser.all()), [self.appuser])
+		self.assertEqual(self._loop(restored), self._loop(self.giftexchange))
+		self.assertEqual(restored.participant_set.get(email='tester4@example.com').gift, 'Socks')
+		pair = restored.exclusionpair_set.get()
+		self.assertEqual((pair.giver.email, pair.reciever.email), ('tester0@example.com', 'tester1@example.com'))
+		self.assertEqual(
+			sorted(restored.exclusiongroup_set.get().members.values_list('email', flat=True)),
+			['tester2@example.com', 'tester3@example.com']
+		)
+		self.assertEqual(restored.audit_assignments(), [])
+
+	def test_snapshot_is_compressed_json_lines(self):
+		lines = gzip.decompress(self._snapshot(self.giftexchange).getvalue()).decode('utf-8').splitlines()
+		header = json.loads(lines[0])
+		self.assertEqual(header['version'], SNAPSHOT_VERSION)
+		self.assertEqual(sum(1 for line in lines if line.startswith('["participant"')), 8)
+
+	def test_clone_leaves_assignments_and_gifts_behind(self):
+		restorer = clone_giftexchange(self.giftexchange, 'Next Season', exclude_repeats=True)
+		clone = restorer.giftexchange
+		self.assertEqual(clone.participant_set.count(), 8)
+		self.assertFalse(clone.exchangeassignment_set.exists())
+		self.assertFalse(clone.participant_set.exclude(gift=None).exists())
+		self.assertEqual(clone.participant_set.get(email='tester4@example.com').likes, 'tea')
+		self.assertEqual((clone.assignment_seed, clone.assignments_locked), (None, False))
+		self.assertEqual(list(clone.exclude_repeats_from.all()), [self.giftexchange])
+		self.assertEqual(self.giftexchange.participant_set.count(), 8)
+
+	def test_rejects_other_versions_and_existing_titles(self):
+		with self.assertRaises(SnapshotError):
+			restore_snapshot(self._snapshot(self.giftexchange))
+		header = json.dumps({'format': 'gifterator-snapshot', 'version': SNAPSHOT_VERSION + 1})
+		with self.assertRaises(SnapshotError):
+			restore_snapshot(io.BytesIO(gzip.compress(header.encode('utf-8'))), title='Future')
+		with self.assertRaises(SnapshotError):
+			restore_snapshot(io.BytesIO(b'not a snapshot'), title='Garbage')
+		self.assertFalse(GiftExchange.objects.filter(title__in=['Future', 'Garbage']).exists())
+
+	def test_commands(self):
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, 'exchange.jsonl.gz')
+			call_command('snapshot_giftexchange', self.giftexchange.pk, path, stdout=StringIO())
+			call_command('restore_giftexchange', path, '--title', 'From File', stdout=StringIO())
+			with self.assertRaises(CommandError):
+				call_command('restore_giftexchange', path, stdout=StringIO())
+		self.assertEqual(GiftExchange.objects.get(title='From File').exchangeassignment_set.count(), 8)
+		call_command('clone_giftexchange', self.giftexchange.pk, 'Cloned', stdout=StringIO())
+		self.assertEqual(GiftExchange.objects.get(title='Cloned').participant_set.count(), 8)
+
+	def test_admin_actions(self):
+		superuser = User.objects.create_superuser('root', 'root@example.com', 'password')
+		self.client.force_login(superuser)
+		url = reverse('admin:giftexchange_giftexchange_changelist')
+		result = self.client.post(url, {'action': 'download_snapshot', '_selected_action': [self.giftexchange.pk]})
+		restored = restore_snapshot(io.BytesIO(b''.join(result.streaming_content)), title='Downloaded').giftexchange
+		self.assertEqual(restored.participant_set.count(), 8)
+
+		self.client.post(url, {'action': 'clone_for_next_season', '_selected_action': [self.giftexchange.pk]})
+		self.assertTrue(GiftExchange.objects.filter(title='Admin Test Exchange (copy)').exists())
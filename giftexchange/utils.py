@@ -3,19 +3,6 @@ from giftexchange.models import AppUser, GiftExchange, Participant
 from django.conf import settings
 from giftexchange.sample_data import participant_sample
 
-import csv
-
-
-def csv_lines_to_dict(expected_header, file):
-
-	reader = csv.DictReader(open(file, 'r'), delimiter=',', quotechar='"', skipinitialspace=True)
-	dict_list = []
-	if sorted(reader.fieldnames) != sorted(expected_header):
-		return None, 'Invalid header'
-	for line in reader:
-		dict_list.append(line)
-	return dict_list, ''
-
 
 def set_giftexchange_admin(email, giftexchange):
 	appuser = AppUser.get_by_email(email)
@@ -1,11 +1,17 @@
+import csv
+
 from django.contrib import messages
 from django.contrib.auth.models import User
-from django.http import HttpResponse
+from django.core.paginator import Paginator
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect
 from django.template import loader
 from django.urls import reverse
-from django.core.files.storage import FileSystemStorage
 
+from giftexchange.assignments import AssignmentInfeasible
+from giftexchange.email_rendering import AssignmentEmailRenderer, compiled_template
+from giftexchange.exports import EXPORT_FORMATS, EXPORTS, EchoBuffer, buffered, export_lines
+from giftexchange.jobs import enqueue_job
 from giftexchange.views.base_views import GiftExchangeAdminView, ParticipantAdminAction
 from giftexchange.forms import (
 	GiftExchangeDetailsForm,
@@ -20,9 +26,34 @@ from giftexchange.models import (
 	ExchangeAssignment,
 	MagicLink,
 	AdminInvitation,
+	EMAIL_PREVIEWS_PER_PAGE,
+	EMAIL_SEND_JOB_KINDS,
+	ParticipantImport,
+	new_email_job_id,
 	oneweekfromnow
 )
-from giftexchange.utils import csv_lines_to_dict
+from giftexchange.participant_import import PARTICIPANT_CSV_HEADER
+
+
+def report_job(request, job, queued_message):
+	""" Tells the admin how an enqueued job went, if it already ran inline,
+		or that it is running in the background
+	"""
+	if job.status == 'succeeded':
+		messages.success(request, JOB_SUCCESS_MESSAGES[job.kind].format(**job.get_result()))
+	elif job.status == 'failed':
+		for problem in (job.get_result() or {}).get('problems') or [job.error]:
+			messages.error(request, problem)
+	else:
+		messages.info(request, queued_message)
+
+
+JOB_SUCCESS_MESSAGES = {
+	'generate_assignments': 'Generated {assignment_count} assignments.',
+	'import_participants': 'Added {created} participants, updated {updated}, left {unchanged} unchanged and skipped {failed} rows with errors.',
+	'send_assignment_emails': '{queued} assignment emails queued for active users, {skipped} already sent or queued were skipped (run {job_id}).',
+	'resume_email_send_run': 'Email run {job_id} resumed, {queued} emails queued and {skipped} skipped so far.',
+}
 
 
 class GiftExchangeAdminDetail(GiftExchangeAdminView):
@@ -88,7 +119,9 @@ class ViewAssignments(GiftExchangeAdminView):
 				('Manage Assignments', None)
 			],
 			'giftexchange': self.giftexchange,
-			'assignments': self.giftexchange.ordered_assignments
+			'assignments': self.giftexchange.assignments_page(request.GET.get('page')),
+			'send_run': self.giftexchange.emailsendrun_set.order_by('-pk').first(),
+			'job': self.giftexchange.job_set.filter(kind__in=['generate_assignments'] + EMAIL_SEND_JOB_KINDS).order_by('-pk').first()
 		}
 		return HttpResponse(template.render(context, request))
 
@@ -97,7 +130,43 @@ class SetAssigments(GiftExchangeAdminView):
 	""" Handler for generating gift exchange assignments
 	"""
 	def get(self, request, *args, **kwargs):
-		self.giftexchange.generate_assignemnts()
+		seed = request.GET.get('seed')
+		try:
+			seed = int(seed) if seed else None
+		except ValueError:
+			messages.error(request, 'Seed must be a whole number')
+		else:
+			job = enqueue_job('generate_assignments', giftexchange=self.giftexchange, seed=seed)
+			report_job(request, job, 'Assignments are being generated in the background.')
+		return redirect(reverse('giftexchange_manage_assignments', kwargs={'giftexchange_id': self.giftexchange_id}))
+
+
+class JobStatus(GiftExchangeAdminView):
+	""" JSON status and progress of one of the gift exchange's background jobs
+	"""
+	def get(self, request, *args, **kwargs):
+		job = self.giftexchange.job_set.filter(pk=kwargs['job_id']).first()
+		if not job:
+			raise Http404('Job with id {} not found'.format(kwargs['job_id']))
+		return JsonResponse(job.as_dict())
+
+
+class AuditAssignments(GiftExchangeAdminView):
+	""" Handler for checking the stored assignments are still a valid single loop
+	"""
+	max_messages = 20
+
+	def get(self, request, *args, **kwargs):
+		violations = self.giftexchange.audit_assignments()
+		if not self.giftexchange.has_assignments:
+			messages.warning(request, 'There are no assignments to audit.')
+		elif not violations:
+			messages.success(request, 'Assignments passed the audit.')
+		else:
+			for violation in violations[:self.max_messages]:
+				messages.error(request, violation.message)
+			if len(violations) > self.max_messages:
+				messages.error(request, 'and {} more problems'.format(len(violations) - self.max_messages))
 		return redirect(reverse('giftexchange_manage_assignments', kwargs={'giftexchange_id': self.giftexchange_id}))
 
 
@@ -170,6 +239,18 @@ class AddSingleUser(GiftExchangeAdminView):
 				status='active'
 			)
 			messages.success(request, 'Added {} {} to Gift Exchange'.format(participant_data['first_name'], participant_data['last_name']))
+			if participant_created:
+				# locked loops are spliced too, only the giver handing over their reciever needs a new email
+				try:
+					changed_givers = self.giftexchange.splice_in_participant(participant)
+				except AssignmentInfeasible as infeasible:
+					changed_givers = []
+					messages.warning(
+						request,
+						'{} has no assignment yet, assignments need to be set again: {}'.format(participant.name, infeasible)
+					)
+				for giver in changed_givers:
+					messages.info(request, '{} has a new assignment and needs a new assignment email'.format(giver.name))
 			return redirect(reverse('giftexchange_manage_participants', kwargs={'giftexchange_id': self.giftexchange.pk}))
 
 class UnsetParticipantAdmin(ParticipantAdminAction):
@@ -206,44 +287,21 @@ class ParticipantUpload(GiftExchangeAdminView):
 	""" Handler for uploading a CSV file of participants to a gift exchange
 	"""
 	def post(self, request, *args, **kwargs):
-		error = False
-		filehandle = request.FILES['file']
-		added_count = 0
-		if filehandle.multiple_chunks():
-			messages.error('File is too large. Please split it into smaller files for upload.')
+		form = FileUploadForm(request.POST, request.FILES)
+		if not form.is_valid():
+			messages.error(request, 'Please choose a CSV file to upload.')
 			return redirect(reverse('giftexchange_upload_participants', kwargs={'giftexchange_id': self.giftexchange.pk}))
-		else:
-			expected_header = ['first_name', 'last_name', 'email', 'shipping_address', 'likes', 'dislikes', 'allergies', 'other']
-			fs = FileSystemStorage()
-			filename = fs.save('user-uploads/appuserupload-{}-{}'.format(self.appuser.pk, filehandle.name), filehandle)
-			parsed_participants, error = csv_lines_to_dict(expected_header, filename)
-			fs.delete(filename)
-			if error:
-				messages.error(request, error)
-				return redirect(reverse('giftexchange_upload_participants', kwargs={'giftexchange_id': self.giftexchange.pk}))
-			for participant_data in parsed_participants:
-				particpant, participant_created = Participant.patch(
-					email=participant_data['email'],
-					first_name=participant_data['first_name'],
-					last_name=participant_data['last_name'],
-					likes=participant_data['likes'],
-					dislikes=participant_data['dislikes'],
-					allergies_sensitivities=participant_data['allergies'],
-					shipping_address=participant_data['shipping_address'],
-					additional_info=participant_data['other'],
-					giftexchange=self.giftexchange,
-					status='active'
-				)
-				if participant_created:
-					added_count += 1
-			messages.success(request, 'Added {} participants to Gift Exchange'.format(added_count))
-			return redirect(reverse('giftexchange_manage_participants', kwargs={'giftexchange_id': self.giftexchange.pk}))
-		# just redirect to the GET if it failed
+		participant_import = ParticipantImport.receive(self.giftexchange, form.cleaned_data['file'])
+		job = enqueue_job('import_participants', giftexchange=self.giftexchange, import_id=participant_import.pk)
+		participant_import.job = job
+		participant_import.save(update_fields=['job'])
+		report_job(request, job, 'Participants from {} are being imported in the background.'.format(participant_import.filename))
 		return redirect(reverse('giftexchange_upload_participants', kwargs={'giftexchange_id': self.giftexchange.pk}))
 
 	def get(self, request, *args, **kwargs):
 		form = FileUploadForm()
 		template = loader.get_template('giftexchange/participant_upload.html')
+		participant_import = self.giftexchange.participantimport_set.select_related('job').order_by('-pk').first()
 		context = {
 			'breadcrumbs': [
 				('dashboard', reverse('dashboard')),
@@ -253,16 +311,70 @@ class ParticipantUpload(GiftExchangeAdminView):
 			],
 			'form': form,
 			'giftexchange': self.giftexchange,
+			'participant_import': participant_import,
+			'job': participant_import.job if participant_import else None,
 		}
 		return HttpResponse(template.render(context, request))
 
 
+class ParticipantImportErrors(GiftExchangeAdminView):
+	""" Streams the rows of a participant upload that could not be imported as
+		a CSV file, with the reason for each
+	"""
+	def get(self, request, *args, **kwargs):
+		participant_import = self.giftexchange.participantimport_set.filter(pk=kwargs['import_id']).first()
+		if not participant_import:
+			raise Http404('Participant import with id {} not found'.format(kwargs['import_id']))
+		writer = csv.writer(EchoBuffer())
+
+		def error_lines():
+			yield writer.writerow(['line', 'reason'] + PARTICIPANT_CSV_HEADER)
+			for line_number, reason, row in participant_import.error_rows():
+				yield writer.writerow([line_number, reason] + [row.get(column, '') for column in PARTICIPANT_CSV_HEADER])
+
+		response = StreamingHttpResponse(buffered(error_lines()), content_type='text/csv')
+		response['Content-Disposition'] = 'attachment; filename="import-{}-errors.csv"'.format(participant_import.pk)
+		return response
+
+
+class ExportGiftExchange(GiftExchangeAdminView):
+	""" Streams the gift exchange's participants, assignment loop or gift
+		results as a CSV or JSON Lines download
+	"""
+	content_types = {
+		'csv': 'text/csv',
+		'jsonl': 'application/x-ndjson',
+	}
+
+	def get(self, request, *args, **kwargs):
+		export_name = kwargs['export_name']
+		export_format = request.GET.get('format', 'csv')
+		if export_name not in EXPORTS or export_format not in EXPORT_FORMATS:
+			raise Http404('Export {} as {} not found'.format(export_name, export_format))
+		response = StreamingHttpResponse(
+			export_lines(self.giftexchange, export_name, export_format),
+			content_type=self.content_types[export_format]
+		)
+		response['Content-Disposition'] = 'attachment; filename="giftexchange-{}-{}.{}"'.format(
+			self.giftexchange.pk, export_name, export_format
+		)
+		return response
+
+
 class RemoveParticipant(ParticipantAdminAction):
 	""" Handler for deleting a participant from a gift exchange
 	"""
 	def post(self, request, *args, **kwargs):
+		try:
+			changed_givers = self.giftexchange.splice_out_participant(self.target_participant)
+		except AssignmentInfeasible as infeasible:
+			self.giftexchange.exchangeassignment_set.all().delete()
+			changed_givers = []
+			messages.warning(request, 'Assignments were cleared and need to be set again: {}'.format(infeasible))
 		self.target_participant.delete()
 		messages.success(request, 'Participant removed from gift exchange')
+		for giver in changed_givers:
+			messages.info(request, '{} has a new assignment and needs a new assignment email'.format(giver.name))
 		return redirect(self.return_url)
 
 	def get(self, request, *args, **kwargs):
@@ -287,24 +399,42 @@ class RemoveParticipant(ParticipantAdminAction):
 
 
 class PreviewAssignmentEmail(GiftExchangeAdminView):
-	def _render_email_for_participant(self, target_participant):
+	""" Previews assignment emails a page at a time, or streams every email
+		onto one page with ?stream=1
+	"""
+	stream_marker = '<!-- assignment emails -->'
+	stream_chunk_size = 100
 
-		assignment = ExchangeAssignment.objects.get(
-			giver=target_participant,
-			giftexchange=self.giftexchange
-		)
-		return assignment.render_assignment_email()
+	def _target_assignments(self, target_participant_id):
+		target_assignments = self.giftexchange._assignment_queryset()
+		if target_participant_id:
+			target_assignments = target_assignments.filter(giver_id=target_participant_id)
+		else:
+			target_assignments = target_assignments.filter(giver__status='active')
+		return target_assignments.order_by('position', 'pk')
+
+	def _render_emails(self, renderer, assignments):
+		for assignment in assignments:
+			assignment.giftexchange = self.giftexchange
+		return renderer.render_many(assignments)
+
+	def _stream_emails(self, renderer, target_assignments, page_head, page_tail):
+		email_template = compiled_template('giftexchange/includes/email_preview.html')
+		yield page_head
+		chunk = []
+		for assignment in target_assignments.iterator(chunk_size=self.stream_chunk_size):
+			chunk.append(assignment)
+			if len(chunk) == self.stream_chunk_size:
+				yield ''.join(email_template.render({'email': email}) for email in self._render_emails(renderer, chunk))
+				chunk = []
+		yield ''.join(email_template.render({'email': email}) for email in self._render_emails(renderer, chunk))
+		yield page_tail
 
 	def get(self, request, *args, **kwargs):
 		template = loader.get_template('giftexchange/emails_preview.html')
 		return_url = reverse('giftexchange_manage_assignments', kwargs={'giftexchange_id': self.giftexchange_id})
-		if kwargs.get('target_participant_id'):
-			participant = Participant.objects.get(pk=kwargs['target_participant_id'])
-			assignment = ExchangeAssignment.objects.get(giver=participant)
-			send_all = False
-		else:
-			send_all = True
-
+		target_assignments = self._target_assignments(kwargs.get('target_participant_id'))
+		renderer = AssignmentEmailRenderer(self.giftexchange)
 		context = {
 			'breadcrumbs': [
 				('dashboard', reverse('dashboard')),
@@ -313,28 +443,20 @@ class PreviewAssignmentEmail(GiftExchangeAdminView):
 				('Preview Assignment Email', None)
 			],
 			'return_url': return_url,
-			'emails': []
 		}
 
-		if send_all:
-			target_participants = Participant.objects.filter(giftexchange=self.giftexchange, status='active').all()
-		else:
-			target_participants = [assignment.giver, ]
-		for participant in target_participants:
-			context['emails'].append(self._render_email_for_participant(participant))
+		if request.GET.get('stream'):
+			context['stream_marker'] = self.stream_marker
+			page_head, page_tail = template.render(context, request).split(self.stream_marker, 1)
+			return StreamingHttpResponse(self._stream_emails(renderer, target_assignments, page_head, page_tail))
 
+		page = Paginator(target_assignments, EMAIL_PREVIEWS_PER_PAGE).get_page(request.GET.get('page'))
+		page.object_list = self._render_emails(renderer, list(page.object_list))
+		context['emails'] = page
 		return HttpResponse(template.render(context, request))
 
 
 class SendAssignmentEmail(GiftExchangeAdminView):
-	def _send_email_for_participant(self, target_participant):
-
-		assignment = ExchangeAssignment.objects.get(
-			giver=target_participant,
-			giftexchange=self.giftexchange
-		)
-		assignment.send_assignment_email()
-
 	def setup(self, request, *args, **kwargs):
 		super(SendAssignmentEmail, self).setup(request, *args, **kwargs)
 		self.template = loader.get_template('giftexchange/confirm_action.html')
@@ -365,21 +487,47 @@ class SendAssignmentEmail(GiftExchangeAdminView):
 	def post(self, request, *args, **kwargs):
 
 		if self.send_all:
-			target_participants = Participant.objects.filter(giftexchange=self.giftexchange, status='active').all()
-			success_message = 'Assignment emails sent to active users.'
+			job = enqueue_job('send_assignment_emails', giftexchange=self.giftexchange)
+			report_job(request, job, 'Assignment emails for active users are being queued in the background.')
 		else:
-			target_participants = [self.assignment.giver, ]
-			success_message = 'Assignment email sent to {}'.format(self.assignment.giver.name)
-		for participant in target_participants:
-			self._send_email_for_participant(participant)
-
-		messages.success(
-			request,
-			success_message
-		)
+			job_id = new_email_job_id()
+			self.assignment.send_assignment_email(job_id=job_id)
+			messages.success(
+				request,
+				'Assignment email queued for {} (job {})'.format(self.assignment.giver.name, job_id)
+			)
 		return redirect(self.return_url)
 
 
+class EmailSendRunAction(GiftExchangeAdminView):
+	""" Base view for actions on one send-all run
+	"""
+	def setup(self, request, *args, **kwargs):
+		super(EmailSendRunAction, self).setup(request, *args, **kwargs)
+		self.send_run = self.giftexchange.emailsendrun_set.filter(pk=kwargs['run_id']).first()
+		if not self.send_run:
+			raise Http404('Email send run with id {} not found'.format(kwargs['run_id']))
+
+
+class EmailSendRunStatus(EmailSendRunAction):
+	""" JSON progress of a send-all run, polled by the manage assignments page
+	"""
+	def get(self, request, *args, **kwargs):
+		return JsonResponse(self.send_run.progress())
+
+
+class ResumeEmailSendRun(EmailSendRunAction):
+	""" Finishes an interrupted send-all run or retries its failed emails in a background job
+	"""
+	def post(self, request, *args, **kwargs):
+		if not self.send_run.is_interrupted:
+			messages.warning(request, 'Email run {} is still in progress and can not be resumed.'.format(self.send_run.job_id))
+		else:
+			job = enqueue_job('resume_email_send_run', giftexchange=self.giftexchange, run_id=self.send_run.pk)
+			report_job(request, job, 'Email run {} is being resumed in the background.'.format(self.send_run.job_id))
+		return redirect(reverse('giftexchange_manage_assignments', kwargs={'giftexchange_id': self.giftexchange_id}))
+
+
 class InviteAdmin(GiftExchangeAdminView):
 	def setup(self, request, *args, **kwargs):
 		super(InviteAdmin, self).setup(request, *args, **kwargs)
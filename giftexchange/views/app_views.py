@@ -158,7 +158,7 @@ class GiftExchangeDetailResult(GiftExchangeView):
 	def get(self, request, *args, **kwargs):
 		my_giver = self.giftexchange.get_giver(self.appuser)
 		participant_details = self.giftexchange.get_participant(self.appuser)
-		assignments = self.giftexchange.ordered_assignments
+		assignments = self.giftexchange.assignments_page(request.GET.get('page'))
 		template = loader.get_template('giftexchange/giftexchange_results.html')
 		context = {
 			'breadcrumbs': [
@@ -0,0 +1,37 @@
+import json
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from giftexchange.models import EmailDeliveryStatus
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class DeliveryEventWebhook(View):
+	""" Receives batched delivery events from the email provider's event webhook
+
+		The provider must be configured to post to this url with
+		?token=<DELIVERY_WEBHOOK_TOKEN>. Every request is refused while
+		settings.DELIVERY_WEBHOOK_TOKEN is not set, as events can suppress
+		addresses.
+	"""
+	def post(self, request, *args, **kwargs):
+		token = getattr(settings, 'DELIVERY_WEBHOOK_TOKEN', None)
+		if not token:
+			return HttpResponseForbidden('Webhook token is not configured')
+		if not constant_time_compare(request.GET.get('token', ''), token):
+			return HttpResponseForbidden('Invalid token')
+		try:
+			events = json.loads(request.body.decode('utf-8'))
+		except ValueError:
+			return HttpResponseBadRequest('Payload must be JSON')
+		if isinstance(events, dict):
+			events = [events]
+		if not isinstance(events, list):
+			return HttpResponseBadRequest('Payload must be a list of events')
+		EmailDeliveryStatus.apply_events([event for event in events if isinstance(event, dict)])
+		return HttpResponse(status=204)
@@ -133,3 +133,40 @@ TEST_EMAIL_DOMAIN = 'gifterator3ktest.com'
 SEND_EMAILS = False
 
 ENVIRONMENT = 'prod'
+
+# outbound email transport: sendgrid, django (EMAIL_BACKEND), smtp or file, see giftexchange/email_transports.py
+EMAIL_TRANSPORT = 'sendgrid'
+EMAIL_TRANSPORT_SMTP_HOST = 'localhost'
+EMAIL_TRANSPORT_SMTP_PORT = 1025
+EMAIL_TRANSPORT_FILE_PATH = os.path.join(BASE_DIR, 'outbound_emails.mbox')
+
+# outbound email dispatcher, see giftexchange/email_dispatch.py
+EMAIL_MAX_WORKERS = 4
+# provider requests per second across the dispatcher threads, 0 for no limit
+EMAIL_RATE_PER_SECOND = 10
+EMAIL_CIRCUIT_FAILURES = 5
+EMAIL_CIRCUIT_RESET_SECONDS = 60
+# seconds between reloads of the in-process email suppression list
+SUPPRESSION_REFRESH_SECONDS = 60
+# shared secret the email provider's event webhook posts as ?token=, the webhook refuses every request without it
+DELIVERY_WEBHOOK_TOKEN = None
+
+# run background jobs in the request instead of through the run_workers command
+JOBS_RUN_INLINE = False
+
+# rendered assignment emails, see giftexchange/email_rendering.py. These caches are per process, so
+# the web and run_workers processes each render an email once; point assignment_emails at a shared
+# backend such as memcached to reuse renders between them
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'assignment_emails': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'assignment_emails',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+EMAIL_RENDER_CACHE = 'assignment_emails'
@@ -16,6 +16,8 @@ DATABASES = {
 
 SENDGRID_API_KEY = os.environ['SENDGRID_API_KEY']
 
+DELIVERY_WEBHOOK_TOKEN = os.environ.get('DELIVERY_WEBHOOK_TOKEN')
+
 ALLOWED_HOSTS = ['gifterator3000.herokuapp.com', 'herokuapp.com', 'gifterator3k.com', 'www.gifterator3k.com']
 
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
@@ -5,6 +5,7 @@ from django.urls import path
 from giftexchange.views import app_views
 from giftexchange.views import session_views
 from giftexchange.views import admin_views
+from giftexchange.views import webhook_views
 from django.views.static import serve
 from django.conf import settings
 
@@ -22,14 +23,21 @@ urlpatterns = [
     path('giftexchange/<int:giftexchange_id>/manage/editdetails/', admin_views.GiftExchangeEdit.as_view(), name='giftexchange_manage_edit_details'),
     path('giftexchange/<int:giftexchange_id>/manage/participants/', admin_views.ParticipantsList.as_view(), name='giftexchange_manage_participants'),
     path('giftexchange/<int:giftexchange_id>/manage/participants/upload/', admin_views.ParticipantUpload.as_view(), name='giftexchange_upload_participants'),
+    path('giftexchange/<int:giftexchange_id>/manage/participants/upload/<int:import_id>/errors/', admin_views.ParticipantImportErrors.as_view(), name='giftexchange_participant_import_errors'),
     path('giftexchange/<int:giftexchange_id>/manage/participants/add/', admin_views.AddSingleUser.as_view(), name='giftexchange_add_single_user'),
     path('giftexchange/<int:giftexchange_id>/manage/participants/<int:participant_id>/remove/', admin_views.RemoveParticipant.as_view(), name='giftexchange_remove_participant'),
     path('giftexchange/<int:giftexchange_id>/manage/participants/<int:participant_id>/addadmin/', admin_views.InviteAdmin.as_view(), name='giftexchange_add_participant_admin'),
     path('giftexchange/<int:giftexchange_id>/manage/participants/<int:participant_id>/removeadmin/', admin_views.UnsetParticipantAdmin.as_view(), name='giftexchange_remove_participant_admin'),
     path('giftexchange/<int:giftexchange_id>/manage/assignments/', admin_views.ViewAssignments.as_view(), name='giftexchange_manage_assignments'),
     path('giftexchange/<int:giftexchange_id>/manage/assignments/set/', admin_views.SetAssigments.as_view(), name='giftexchange_set_assignments'),
+    path('giftexchange/<int:giftexchange_id>/manage/assignments/audit/', admin_views.AuditAssignments.as_view(), name='giftexchange_audit_assignments'),
     path('giftexchange/<int:giftexchange_id>/manage/assignments/sendemail/all/', admin_views.SendAssignmentEmail.as_view(), name='giftexchange_send_assignment_email_all'),
     path('giftexchange/<int:giftexchange_id>/manage/assignments/sendemail/<int:target_participant_id>/', admin_views.SendAssignmentEmail.as_view(), name='giftexchange_send_assignment_email'),
+    path('giftexchange/<int:giftexchange_id>/manage/assignments/sendemail/runs/<int:run_id>/status/', admin_views.EmailSendRunStatus.as_view(), name='giftexchange_email_send_run_status'),
+    path('giftexchange/<int:giftexchange_id>/manage/assignments/sendemail/runs/<int:run_id>/resume/', admin_views.ResumeEmailSendRun.as_view(), name='giftexchange_resume_email_send_run'),
+    path('giftexchange/<int:giftexchange_id>/manage/jobs/<int:job_id>/status/', admin_views.JobStatus.as_view(), name='giftexchange_job_status'),
+    path('giftexchange/<int:giftexchange_id>/manage/export/<str:export_name>/', admin_views.ExportGiftExchange.as_view(), name='giftexchange_export'),
+    path('webhooks/email/events/', webhook_views.DeliveryEventWebhook.as_view(), name='email_delivery_event_webhook'),
     path('giftexchange/<int:giftexchange_id>/manage/assignments/previewemail/all/', admin_views.PreviewAssignmentEmail.as_view(), name='giftexchange_preview_assignment_email_all'),
     path('giftexchange/<int:giftexchange_id>/manage/assignments/previewemail/<int:target_participant_id>/', admin_views.PreviewAssignmentEmail.as_view(), name='giftexchange_preview_assignment_email'),
     path('giftexchange/<int:giftexchange_id>/manage/assignments/toggle-lock/', admin_views.ToggleAssignmentLock.as_view(), name='giftexchange_toggle_assignment_lock'),